@@ -1,16 +1,28 @@
 import os
-import telebot
-from telebot import types
+from src.bot.startup import startup_phase, warmup_models, report_startup, PRELOAD_MODELS
 
-from src.database.database import SessionLocal
-from src.database.models import User, Settings
-from src.database.services import save_image, get_users, find_similar_images
-from src.emote_processor.get_emote import get_emotions
-from src.emote_processor.create_calendar import create_calendar
-from src.emote_processor.similar_people_plot import create_similar_image
+with startup_phase("imports"):
+    import telebot
+    from telebot import apihelper, util
 
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.cron import CronTrigger
+    from src.bot.keyboards import main_keyboard, emotion_keyboard, confirm_emotion_keyboard, settings_markup, EMOTIONS
+    from src.database.services import save_image, get_users, find_similar_images, register_user, get_latest_image_id
+    from src.database.instrumentation import query_budget
+    from src.database.storage import stage_image, find_upload, sweep_staging
+    from src.database.ann_index import get_index, save_index, refresh_index
+    from src.database.settings_service import get_settings, toggle_setting, update_settings
+    from src.database.photo_jobs import PHOTO_QUEUE, PENDING, enqueue_photo, get_job, queue_depth, purge_finished_jobs
+    from src.emote_processor.face_analysis import analyze_face
+    from src.emote_processor.inference_cache import analyze_cached, cached_content_hash, remember_file, report_stats
+    from src.emote_processor import calendar_cache
+    from src.emote_processor.similar_people_plot import create_similar_image
+    from src.bot.reminders import ReminderDispatcher
+    from src.bot.usernames import remember_user, resolve_usernames
+    from src.bot.conversation import create_store
+    from src.metrics import stage_timer, timed, register_queue, start_metrics_server
+
+    from apscheduler.schedulers.background import BackgroundScheduler
+    from apscheduler.triggers.cron import CronTrigger
 
 from datetime import datetime
 from dotenv import load_dotenv
@@ -18,244 +30,235 @@ from os import environ
 
 load_dotenv()
 TOKEN = environ.get("TELEGRAM_TOKEN")
-bot = telebot.TeleBot(TOKEN)
+BOT_THREADS = int(environ.get("BOT_THREADS", 2))
+apihelper.ENABLE_MIDDLEWARE = True
+bot = telebot.TeleBot(TOKEN, num_threads=BOT_THREADS)
+
+# Следующий шаг диалога хранится вне процесса (CONVERSATION_BACKEND), чтобы
+# ответ пользователя мог обработать любой экземпляр бота
+conversation = create_store()
 
+# Запускается в schedule_jobs: в webhook-режиме только в процессе `webhook.py scheduler`
 scheduler = BackgroundScheduler()
-scheduler.start()
 
-# Клавиатуры
-def main_keyboard():
-    keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
-    keyboard.add('📅 Скачать календарь')
-    keyboard.add('👥 Похожие люди')
-    keyboard.add('⚙️ Настройки')
-    return keyboard
-
-def emotion_keyboard():
-    keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
-    emotions = ['angry', 'disgust', 'fear', 'happy', 'neutral', 'sad', 'surprise']
-    for emotion in emotions:
-        keyboard.add(emotion)
-    return keyboard
-
-def confirm_emotion_keyboard():
-    keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
-    keyboard.add('✅ Подтвердить')
-    keyboard.add('📋 Выбрать вручную')
-    return keyboard
+# Запоминаем username при каждом сообщении, чтобы не запрашивать его у Telegram
+@bot.middleware_handler(update_types=['message', 'callback_query'])
+def remember_username(bot_instance, update):
+    remember_user(update.from_user)
 
-def settings_keyboard(user_id):
-    with SessionLocal() as session:
-        settings = session.query(Settings).filter(Settings.user_id == str(user_id)).first()
-        
-        keyboard = types.InlineKeyboardMarkup()
-        
-        ai_status = "ВКЛ" if settings.ai_enabled else "ВЫКЛ"
-        keyboard.add(types.InlineKeyboardButton(
-            f"ИИ распознавание: {ai_status}", 
-            callback_data=f"toggle_ai")
-        )
-        
-        reminder_time = settings.reminder_time.strftime("%H:%M")
-        keyboard.add(types.InlineKeyboardButton(
-            f"Время напоминания: {reminder_time}",
-            callback_data=f"change_time")
-        )
+# Следующие шаги диалога идут раньше остальных обработчиков, как в register_next_step_handler
+@bot.message_handler(func=lambda m: conversation.has_step(m.chat.id), content_types=util.content_type_media)
+def handle_next_step(message):
+    state = conversation.pop_step(message.chat.id)
+    if state is not None:  # None - шаг уже забрал другой экземпляр
+        handler, args = state
+        handler(message, *args)
 
-        search_status = "РАЗРЕШЕНО" if settings.search_allowed else "ЗАПРЕЩЕНО"
-        keyboard.add(types.InlineKeyboardButton(
-            f"Поиск в похожих: {search_status}", 
-            callback_data=f"toggle_search")
-        )
-        
-        return keyboard
+# Клавиатуры
+def settings_keyboard(user_id):
+    return settings_markup(get_settings(user_id))
 
 # Обработчики команд
 @bot.message_handler(commands=['start'])
+@query_budget(2)
 def handle_start(message):
-    with SessionLocal() as session:
-        user = session.query(User).filter(User.user_id == str(message.chat.id)).first()
-    
-        if not user:
-            user = User(user_id=str(message.chat.id))
-            session.add(user)
-            session.commit()
-            
-            # Создаем настройки по умолчанию
-            settings = Settings(user_id=user.user_id)
-            session.add(settings)
-            session.commit()
+    register_user(message.chat.id)
     
     welcome_text = "Добро пожаловать! Отправьте селфи, либо выберите действие:"
     bot.send_message(message.chat.id, welcome_text, reply_markup=main_keyboard())
 
 # Обработчик изображений
 @bot.message_handler(content_types=['photo'])
+@query_budget(3)
+@timed("handle_photo")
 def handle_photo(message):
-    with SessionLocal() as session:
-        user = session.query(User).get(str(message.chat.id))
-        settings = user.settings
+    settings = get_settings(message.chat.id)
     
-    # Сохраняем фото
-    file_info = bot.get_file(message.photo[-1].file_id)
-    downloaded_file = bot.download_file(file_info.file_path)
+    # Сохраняем фото (повторно отправленное фото не скачиваем)
+    photo_path, image, content_hash = download_photo(message.photo[-1])
     
-    temp_path = f"temp/temp_{message.chat.id}.jpg"
-    with open(temp_path, 'wb') as new_file:
-        new_file.write(downloaded_file)
-    
-    # Определяем эмоцию
-    if settings.ai_enabled:
+    # Анализ в воркерах photo_worker: ответ придет от воркера, следующий шаг - confirm_job
+    if settings.ai_enabled and PHOTO_QUEUE:
+        job_id = enqueue_photo(message.chat.id, photo_path, content_hash)
+        bot.send_message(message.chat.id, "Фото получено, распознаю эмоцию...")
+        conversation.set_step(message.chat.id, confirm_job, job_id)
+    # Определяем эмоцию по байтам в памяти, без повторного чтения с диска
+    elif settings.ai_enabled:
         try:
-            emotion = get_emotions(temp_path)
-            msg = bot.send_message(message.chat.id, f"Распознанная эмоция: {emotion}", reply_markup=confirm_emotion_keyboard())
-            bot.register_next_step_handler(msg, confirm_emotion, temp_path, emotion)
+            with stage_timer("handle_photo", "inference"):
+                analysis = analyze_cached(content_hash, image, analyze_face)
+            bot.send_message(message.chat.id, f"Распознанная эмоция: {analysis.emotion}", reply_markup=confirm_emotion_keyboard())
+            conversation.set_step(message.chat.id, confirm_emotion, photo_path, analysis.emotion, analysis.embedding)
         except:        
-            msg = bot.send_message(message.chat.id, "Не удалось распознать эмоцию, выберите ее вручную.", reply_markup=emotion_keyboard())
-            bot.register_next_step_handler(msg, save_emotion, temp_path)
+            bot.send_message(message.chat.id, "Не удалось распознать эмоцию, выберите ее вручную.", reply_markup=emotion_keyboard())
+            conversation.set_step(message.chat.id, save_emotion, photo_path)
     else:
-        msg = bot.send_message(message.chat.id, "Выберите эмоцию:", reply_markup=emotion_keyboard())
-        bot.register_next_step_handler(msg, save_emotion, temp_path)
+        bot.send_message(message.chat.id, "Выберите эмоцию:", reply_markup=emotion_keyboard())
+        conversation.set_step(message.chat.id, save_emotion, photo_path)
 
 # Другое
+def download_photo(photo):
+    """Возвращает (путь к файлу, байты или путь для анализа, хэш содержимого).
+
+    Новая загрузка лежит в STAGING_DIR, пока save_image не перенесет ее в хранилище."""
+    content_hash = cached_content_hash(photo.file_unique_id)
+    photo_path = find_upload(content_hash) if content_hash is not None else None
+    if photo_path is not None:
+        return str(photo_path), str(photo_path), content_hash
+
+    with stage_timer("handle_photo", "download"):
+        file_info = bot.get_file(photo.file_id)
+        downloaded_file = bot.download_file(file_info.file_path)
+
+    with stage_timer("handle_photo", "store"):
+        photo_path = stage_image(downloaded_file)
+    remember_file(photo.file_unique_id, photo_path.stem)
+    return str(photo_path), downloaded_file, photo_path.stem
+
 def get_username_from_user_id(user_id):
-    try:
-        chat = bot.get_chat(user_id)
-        return chat.username
-    except Exception as e:
-        print(f"Error fecching {user_id}: {e}")
-        return user_id
+    return bot.get_chat(user_id).username
+
+@conversation.step
+@query_budget(2)
+def confirm_job(message, job_id):
+    job = get_job(job_id)
+    if job.status in PENDING:
+        bot.send_message(message.chat.id, "Эмоция еще распознается, подождите немного.")
+        conversation.set_step(message.chat.id, confirm_job, job_id)
+    elif job.emotion is not None:
+        confirm_emotion(message, job.photo_path, job.emotion, job.embedding)
+    else:
+        # Лицо не найдено или попытки исчерпаны: воркер предложил выбрать эмоцию вручную
+        save_emotion(message, job.photo_path)
 
-def confirm_emotion(message, temp_path, detected_emotion):
+@conversation.step
+@query_budget(7)
+def confirm_emotion(message, photo_path, detected_emotion, embedding=None):
     if message.text == '✅ Подтвердить':
-        save_photo(message, temp_path, detected_emotion)
+        save_photo(message, photo_path, detected_emotion, embedding)
     else:
-        msg = bot.send_message(message.chat.id, 
-                             "Выберите правильную эмоцию:",
-                             reply_markup=emotion_keyboard())
-        bot.register_next_step_handler(msg, save_emotion, temp_path)
-
-def save_emotion(message, temp_path):
-    if message.text.lower() in ['angry', 'disgust', 'fear', 'happy', 'neutral', 'sad', 'surprise']:
-        save_photo(message, temp_path, message.text.lower())
+        bot.send_message(message.chat.id, 
+                         "Выберите правильную эмоцию:",
+                         reply_markup=emotion_keyboard())
+        conversation.set_step(message.chat.id, save_emotion, photo_path, embedding)
+
+@conversation.step
+@query_budget(7)
+def save_emotion(message, photo_path, embedding=None):
+    if message.text and message.text.lower() in EMOTIONS:
+        save_photo(message, photo_path, message.text.lower(), embedding)
     else:
         bot.send_message(message.chat.id, "Неверная эмоция", reply_markup=main_keyboard())
     return
 
-def save_photo(message, image_path, emotion):
-    with SessionLocal() as session:
-        user = session.query(User).get(str(message.chat.id))
+def save_photo(message, image_path, emotion, embedding=None):
+    created_date = datetime.now()
+    try:
+        _, stored_path = save_image(image_path, emotion, str(message.chat.id), created_date, embedding=embedding)
+    except ValueError:
+        bot.send_message(message.chat.id, "Невозможно распознать лицо", reply_markup=main_keyboard())
+        return
+    except Exception as e:
+        bot.send_message(message.chat.id, "Не удалось сохранить картинку", reply_markup=main_keyboard())
+        return
 
-        try:
-            image_uuid = save_image(image_path, emotion, user.user_id)
-        except ValueError:
-            bot.send_message(message.chat.id, "Невозможно распознать лицо", reply_markup=main_keyboard())
-            return
-        except Exception as e:
-            bot.send_message(message.chat.id, "Не удалось сохранить картинку", reply_markup=main_keyboard())
-            return
-        
-        total_users = get_users()
-        emotion_users = get_users(emotion)
-        
-        bot.send_message(message.chat.id,
-                        f"Картинка успешно сохранена! Сегодня {total_users} других пользователя тоже загрузили селфи!\n"
-                        f"У {emotion_users} пользователей такое же настроение!",
-                        reply_markup=main_keyboard())
-        
-        # os.remove(image_path)
+    calendar_cache.add_day(message.chat.id, created_date, stored_path, emotion)
+    
+    total_users = get_users()
+    emotion_users = get_users(emotion)
+    
+    bot.send_message(message.chat.id,
+                    f"Картинка успешно сохранена! Сегодня {total_users} других пользователя тоже загрузили селфи!\n"
+                    f"У {emotion_users} пользователей такое же настроение!",
+                    reply_markup=main_keyboard())
     return
 
 # Обработчики кнопок
 @bot.message_handler(func=lambda m: m.text == '📅 Скачать календарь')
+@query_budget(2)
 def handle_calendar(message):
-    with SessionLocal() as session:
-        user = session.query(User).get(str(message.chat.id))
-    
-        if not user.images:
-            bot.send_message(message.chat.id, "Сначала отправьте свое селфи!")
-        else:
-            calendar = create_calendar(user.user_id)
-            bot.send_photo(message.chat.id, calendar)
+    if get_latest_image_id(message.chat.id) is None:
+        bot.send_message(message.chat.id, "Сначала отправьте свое селфи!")
+    else:
+        send_calendar(message.chat.id)
+
+def send_calendar(chat_id):
+    """Отправляет календарь по file_id, если месяц не менялся, иначе загружает PNG."""
+    png, file_id = calendar_cache.get_calendar(chat_id)
+    if file_id is not None:
+        try:
+            bot.send_photo(chat_id, file_id)
+            return
+        except apihelper.ApiTelegramException as e:
+            print(f"Error resending calendar by file_id: {e}")
+
+    sent = bot.send_photo(chat_id, png)
+    calendar_cache.remember_file_id(chat_id, None, None, png, sent.photo[-1].file_id)
 
 @bot.message_handler(func=lambda m: m.text == '👥 Похожие люди')
+@query_budget(5)
 def handle_similar(message):
-    with SessionLocal() as session:
-        user = session.query(User).get(str(message.chat.id))
-    
-        if not user.images:
-            bot.send_message(message.chat.id, "Сначала отправьте свое селфи!")
+    last_image_id = get_latest_image_id(message.chat.id)
+
+    if last_image_id is None:
+        bot.send_message(message.chat.id, "Сначала отправьте свое селфи!")
+    else:
+        similar = find_similar_images(last_image_id)
+        
+        if not similar:
+            bot.send_message(message.chat.id, "Похожих пользователей не найдено")
         else:
-            last_image = sorted(user.images, key=lambda x: x.created_date, reverse=True)[0]
-            similar = find_similar_images(last_image)
-            image = create_similar_image((data["file_path"] for data in similar))
-            
-            if not similar:
-                bot.send_message(message.chat.id, "Похожих пользователей не найдено")
-            else:
-                bot.send_photo(message.chat.id, image)
-                response = "Похожие пользователи:\n" + "\n".join([f"- {get_username_from_user_id(u['user_id'])}" for u in similar])
-                bot.send_message(message.chat.id, response)
+            image = create_similar_image([data["file_path"] for data in similar])
+            bot.send_photo(message.chat.id, image)
+            usernames = resolve_usernames([u['user_id'] for u in similar], get_username_from_user_id)
+            response = "Похожие пользователи:\n" + "\n".join([f"- {usernames[u['user_id']]}" for u in similar])
+            bot.send_message(message.chat.id, response)
 
 @bot.message_handler(func=lambda m: m.text == '⚙️ Настройки')
+@query_budget(1)
 def handle_settings(message):
     user_id = str(message.chat.id)
     bot.send_message(message.chat.id, "⚙️ Настройки:", reply_markup=settings_keyboard(user_id))
 
 # Настройки
 @bot.callback_query_handler(func=lambda call: call.data == ('toggle_ai'))
+@query_budget(1)
 def toggle_ai(call):
-    user_id = call.message.chat.id
-    with SessionLocal() as session:
-        settings = session.query(Settings).filter(Settings.user_id == str(user_id)).first()
-        settings.ai_enabled = not settings.ai_enabled
-        session.commit()
+    settings = toggle_setting(call.message.chat.id, "ai_enabled")
         
     bot.edit_message_reply_markup(
         chat_id=call.message.chat.id,
         message_id=call.message.message_id,
-        reply_markup=settings_keyboard(user_id)
+        reply_markup=settings_markup(settings)
     )
 
 @bot.callback_query_handler(func=lambda call: call.data == ('toggle_search'))
+@query_budget(1)
 def toggle_search(call):
-    user_id = call.message.chat.id
-    with SessionLocal() as session:
-        settings = session.query(Settings).filter(Settings.user_id == str(user_id)).first()
-        settings.search_allowed = not settings.search_allowed
-        session.commit()
+    settings = toggle_setting(call.message.chat.id, "search_allowed")
         
     bot.edit_message_reply_markup(
         chat_id=call.message.chat.id,
         message_id=call.message.message_id,
-        reply_markup=settings_keyboard(user_id)
+        reply_markup=settings_markup(settings)
     )
 
 @bot.callback_query_handler(func=lambda call: call.data == ('change_time'))
+@query_budget(1)
 def change_time(call):
     user_id = call.message.chat.id
-    msg = bot.send_message(
+    bot.send_message(
         call.message.chat.id,
         "Введите новое время в формате ЧЧ:MM (например 21:30):"
     )
-    bot.register_next_step_handler(msg, process_time_input, user_id)
+    conversation.set_step(call.message.chat.id, process_time_input, user_id)
 
+@conversation.step
+@query_budget(1)
 def process_time_input(message, user_id):
     try:
-        new_time = datetime.strptime(message.text, "%H:%M").time()
-        with SessionLocal() as session:
-            settings = session.query(Settings).filter(Settings.user_id == str(user_id)).first()
-            settings.reminder_time = new_time
-            session.commit()
-            
-        scheduler.remove_job(f"reminder_{user_id}")
-        trigger = CronTrigger(hour=new_time.hour, minute=new_time.minute)
-        scheduler.add_job(
-            send_reminder,
-            trigger=trigger,
-            args=[user_id],
-            id=f"reminder_{user_id}"
-        )
+        new_time = datetime.strptime(message.text or "", "%H:%M").time()
+        update_settings(user_id, reminder_time=new_time)
         
         bot.send_message(
             message.chat.id,
@@ -271,30 +274,46 @@ def process_time_input(message, user_id):
         )
 
 # Планировщик
-def schedule_reminders():
-    with SessionLocal() as session:
-        users = session.query(User).all()
-        
-        for user in users:
-            trigger = CronTrigger(
-                hour=user.settings.reminder_time.hour,
-                minute=user.settings.reminder_time.minute
-            )
-
-            scheduler.add_job(
-                send_reminder,
-                trigger=trigger,
-                args=[user.user_id],
-                id=f"reminder_{user.user_id}"
-            )
-
 def send_reminder(user_id):
     bot.send_message(user_id, 
                     "Пора отправить сегодняшнее селфи!",
                     reply_markup=main_keyboard())
 
+reminders = ReminderDispatcher(send_reminder)
+
+register_queue("reminders", reminders.depth)
+if PHOTO_QUEUE:
+    register_queue("photo_jobs", queue_depth)
+if bot.threaded:
+    register_queue("bot_updates", bot.worker_pool.tasks.qsize)
+
 # Запуск
+def schedule_jobs():
+    """Периодические задачи. При нескольких экземплярах (webhook) - только в одном из них."""
+    scheduler.start()
+
+    with startup_phase("load ANN index"):
+        if get_index() is not None:
+            scheduler.add_job(refresh_index, 'interval', minutes=5, id="refresh_ann_index")
+            scheduler.add_job(save_index, 'interval', minutes=10, id="save_ann_index")
+
+    scheduler.add_job(report_stats, 'interval', minutes=10, id="inference_cache_stats")
+    scheduler.add_job(sweep_staging, 'interval', hours=1, args=[conversation.ttl], id="sweep_staging")
+    if PHOTO_QUEUE:
+        scheduler.add_job(purge_finished_jobs, 'interval', hours=1, id="purge_photo_jobs")
+
+    # Одна задача в минуту вместо отдельной задачи на каждого пользователя
+    reminders.start()
+    scheduler.add_job(reminders.dispatch, CronTrigger(minute='*'), id="reminders", coalesce=True, misfire_grace_time=30)
+
 if __name__ == "__main__":
-    schedule_reminders()
+    schedule_jobs()
+
+    if PRELOAD_MODELS:
+        warmup_models()
+
+    start_metrics_server()
+
+    report_startup()
     print("Bot ready")
     bot.polling(none_stop=True)
\ No newline at end of file
@@ -0,0 +1,329 @@
+import asyncio
+from src.bot.startup import startup_phase, report_startup, PRELOAD_MODELS
+
+with startup_phase("imports"):
+    from telebot import util
+    from telebot.async_telebot import AsyncTeleBot
+    from telebot.asyncio_handler_backends import BaseMiddleware
+    from telebot.asyncio_helper import ApiTelegramException
+
+    from src.bot.keyboards import main_keyboard, emotion_keyboard, confirm_emotion_keyboard, settings_markup, EMOTIONS
+    from src.database.services import save_image, get_users, find_similar_images, register_user, get_latest_image_id
+    from src.database.instrumentation import query_budget
+    from src.database.storage import stage_image, find_upload, sweep_staging
+    from src.database.ann_index import get_index, save_index, refresh_index
+    from src.database.settings_service import get_settings, toggle_setting, update_settings
+    from src.database.photo_jobs import PHOTO_QUEUE, PENDING, enqueue_photo, get_job, queue_depth, purge_finished_jobs
+    from src.emote_processor.inference_pool import run_inference, prestart, shutdown, analyze, embed
+    from src.emote_processor.inference_cache import analyze_cached_async, cached_content_hash, remember_file, report_stats
+    from src.emote_processor import calendar_cache
+    from src.emote_processor.similar_people_plot import create_similar_image
+    from src.bot.reminders import AsyncReminderDispatcher
+    from src.bot.usernames import remember_user, resolve_usernames_async
+    from src.bot.conversation import create_store
+    from src.metrics import stage_timer, timed, register_queue, start_metrics_server
+
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
+    from apscheduler.triggers.cron import CronTrigger
+
+from datetime import datetime
+from dotenv import load_dotenv
+from os import environ
+
+load_dotenv()
+TOKEN = environ.get("TELEGRAM_TOKEN")
+bot = AsyncTeleBot(TOKEN)
+
+scheduler = AsyncIOScheduler()
+
+# Следующий шаг диалога хранится вне процесса (CONVERSATION_BACKEND)
+conversation = create_store()
+
+async def register_next_step(chat_id, handler, *args):
+    await asyncio.to_thread(conversation.set_step, chat_id, handler, *args)
+
+async def has_next_step(message) -> bool:
+    return await asyncio.to_thread(conversation.has_step, message.chat.id)
+
+# Запоминаем username при каждом сообщении, чтобы не запрашивать его у Telegram
+class UsernameMiddleware(BaseMiddleware):
+    def __init__(self):
+        self.update_types = ['message', 'callback_query']
+
+    async def pre_process(self, update, data):
+        await asyncio.to_thread(remember_user, update.from_user)
+
+    async def post_process(self, update, data, exception):
+        pass
+
+bot.setup_middleware(UsernameMiddleware())
+
+# Следующие шаги диалога идут раньше остальных обработчиков, как в register_next_step_handler
+@bot.message_handler(func=has_next_step, content_types=util.content_type_media)
+async def handle_next_step(message):
+    state = await asyncio.to_thread(conversation.pop_step, message.chat.id)
+    if state is not None:  # None - шаг уже забрал другой экземпляр
+        handler, args = state
+        await handler(message, *args)
+
+# Обработчики команд
+@bot.message_handler(commands=['start'])
+@query_budget(2)
+async def handle_start(message):
+    await asyncio.to_thread(register_user, message.chat.id)
+
+    welcome_text = "Добро пожаловать! Отправьте селфи, либо выберите действие:"
+    await bot.send_message(message.chat.id, welcome_text, reply_markup=main_keyboard())
+
+# Обработчик изображений
+@bot.message_handler(content_types=['photo'])
+@query_budget(3)
+@timed("handle_photo")
+async def handle_photo(message):
+    settings = await asyncio.to_thread(get_settings, message.chat.id)
+
+    # Сохраняем фото (повторно отправленное фото не скачиваем)
+    photo_path, image, content_hash = await download_photo(message.photo[-1])
+
+    # Анализ в воркерах photo_worker: ответ придет от воркера, следующий шаг - confirm_job
+    if settings.ai_enabled and PHOTO_QUEUE:
+        job_id = await asyncio.to_thread(enqueue_photo, message.chat.id, photo_path, content_hash)
+        await bot.send_message(message.chat.id, "Фото получено, распознаю эмоцию...")
+        await register_next_step(message.chat.id, confirm_job, job_id)
+    # Определяем эмоцию
+    elif settings.ai_enabled:
+        try:
+            with stage_timer("handle_photo", "inference"):
+                analysis = await analyze_cached_async(content_hash, image, lambda image: run_inference(analyze, image))
+            await bot.send_message(message.chat.id, f"Распознанная эмоция: {analysis.emotion}", reply_markup=confirm_emotion_keyboard())
+            await register_next_step(message.chat.id, confirm_emotion, photo_path, analysis.emotion, analysis.embedding)
+        except Exception:
+            await bot.send_message(message.chat.id, "Не удалось распознать эмоцию, выберите ее вручную.", reply_markup=emotion_keyboard())
+            await register_next_step(message.chat.id, save_emotion, photo_path)
+    else:
+        await bot.send_message(message.chat.id, "Выберите эмоцию:", reply_markup=emotion_keyboard())
+        await register_next_step(message.chat.id, save_emotion, photo_path)
+
+# Другое
+async def download_photo(photo):
+    """Возвращает (путь к файлу, байты или путь для анализа, хэш содержимого).
+
+    Новая загрузка лежит в STAGING_DIR, пока save_image не перенесет ее в хранилище."""
+    content_hash = await asyncio.to_thread(cached_content_hash, photo.file_unique_id)
+    photo_path = await asyncio.to_thread(find_upload, content_hash) if content_hash is not None else None
+    if photo_path is not None:
+        return str(photo_path), str(photo_path), content_hash
+
+    with stage_timer("handle_photo", "download"):
+        file_info = await bot.get_file(photo.file_id)
+        downloaded_file = await bot.download_file(file_info.file_path)
+
+    with stage_timer("handle_photo", "store"):
+        photo_path = await asyncio.to_thread(stage_image, downloaded_file)
+    await asyncio.to_thread(remember_file, photo.file_unique_id, photo_path.stem)
+    return str(photo_path), downloaded_file, photo_path.stem
+
+async def get_username_from_user_id(user_id):
+    return (await bot.get_chat(user_id)).username
+
+@conversation.step
+@query_budget(2)
+async def confirm_job(message, job_id):
+    job = await asyncio.to_thread(get_job, job_id)
+    if job.status in PENDING:
+        await bot.send_message(message.chat.id, "Эмоция еще распознается, подождите немного.")
+        await register_next_step(message.chat.id, confirm_job, job_id)
+    elif job.emotion is not None:
+        await confirm_emotion(message, job.photo_path, job.emotion, job.embedding)
+    else:
+        # Лицо не найдено или попытки исчерпаны: воркер предложил выбрать эмоцию вручную
+        await save_emotion(message, job.photo_path)
+
+@conversation.step
+@query_budget(7)
+async def confirm_emotion(message, photo_path, detected_emotion, embedding=None):
+    if message.text == '✅ Подтвердить':
+        await save_photo(message, photo_path, detected_emotion, embedding)
+    else:
+        await bot.send_message(message.chat.id,
+                             "Выберите правильную эмоцию:",
+                             reply_markup=emotion_keyboard())
+        await register_next_step(message.chat.id, save_emotion, photo_path, embedding)
+
+@conversation.step
+@query_budget(7)
+async def save_emotion(message, photo_path, embedding=None):
+    if message.text and message.text.lower() in EMOTIONS:
+        await save_photo(message, photo_path, message.text.lower(), embedding)
+    else:
+        await bot.send_message(message.chat.id, "Неверная эмоция", reply_markup=main_keyboard())
+
+async def save_photo(message, image_path, emotion, embedding=None):
+    created_date = datetime.now()
+    try:
+        if embedding is None:
+            embedding = await run_inference(embed, image_path)
+        _, stored_path = await asyncio.to_thread(save_image, image_path, emotion, str(message.chat.id), created_date, embedding=embedding)
+    except ValueError:
+        await bot.send_message(message.chat.id, "Невозможно распознать лицо", reply_markup=main_keyboard())
+        return
+    except Exception:
+        await bot.send_message(message.chat.id, "Не удалось сохранить картинку", reply_markup=main_keyboard())
+        return
+
+    await asyncio.to_thread(calendar_cache.add_day, message.chat.id, created_date, stored_path, emotion)
+
+    total_users = await asyncio.to_thread(get_users)
+    emotion_users = await asyncio.to_thread(get_users, emotion)
+
+    await bot.send_message(message.chat.id,
+                    f"Картинка успешно сохранена! Сегодня {total_users} других пользователя тоже загрузили селфи!\n"
+                    f"У {emotion_users} пользователей такое же настроение!",
+                    reply_markup=main_keyboard())
+
+# Обработчики кнопок
+@bot.message_handler(func=lambda m: m.text == '📅 Скачать календарь')
+@query_budget(2)
+async def handle_calendar(message):
+    if await asyncio.to_thread(get_latest_image_id, message.chat.id) is None:
+        await bot.send_message(message.chat.id, "Сначала отправьте свое селфи!")
+    else:
+        await send_calendar(message.chat.id)
+
+async def send_calendar(chat_id):
+    """Отправляет календарь по file_id, если месяц не менялся, иначе загружает PNG."""
+    png, file_id = await asyncio.to_thread(calendar_cache.get_calendar, chat_id)
+    if file_id is not None:
+        try:
+            await bot.send_photo(chat_id, file_id)
+            return
+        except ApiTelegramException as e:
+            print(f"Error resending calendar by file_id: {e}")
+
+    sent = await bot.send_photo(chat_id, png)
+    calendar_cache.remember_file_id(chat_id, None, None, png, sent.photo[-1].file_id)
+
+@bot.message_handler(func=lambda m: m.text == '👥 Похожие люди')
+@query_budget(5)
+async def handle_similar(message):
+    last_image_id = await asyncio.to_thread(get_latest_image_id, message.chat.id)
+
+    if last_image_id is None:
+        await bot.send_message(message.chat.id, "Сначала отправьте свое селфи!")
+        return
+
+    similar = await asyncio.to_thread(find_similar_images, last_image_id)
+
+    if not similar:
+        await bot.send_message(message.chat.id, "Похожих пользователей не найдено")
+    else:
+        image = await asyncio.to_thread(create_similar_image, [data["file_path"] for data in similar])
+        await bot.send_photo(message.chat.id, image)
+        usernames = await resolve_usernames_async([u['user_id'] for u in similar], get_username_from_user_id)
+        response = "Похожие пользователи:\n" + "\n".join([f"- {usernames[u['user_id']]}" for u in similar])
+        await bot.send_message(message.chat.id, response)
+
+@bot.message_handler(func=lambda m: m.text == '⚙️ Настройки')
+@query_budget(1)
+async def handle_settings(message):
+    settings = await asyncio.to_thread(get_settings, message.chat.id)
+    await bot.send_message(message.chat.id, "⚙️ Настройки:", reply_markup=settings_markup(settings))
+
+# Настройки
+@bot.callback_query_handler(func=lambda call: call.data == ('toggle_ai'))
+@query_budget(1)
+async def toggle_ai(call):
+    settings = await asyncio.to_thread(toggle_setting, call.message.chat.id, "ai_enabled")
+
+    await bot.edit_message_reply_markup(
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=settings_markup(settings)
+    )
+
+@bot.callback_query_handler(func=lambda call: call.data == ('toggle_search'))
+@query_budget(1)
+async def toggle_search(call):
+    settings = await asyncio.to_thread(toggle_setting, call.message.chat.id, "search_allowed")
+
+    await bot.edit_message_reply_markup(
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=settings_markup(settings)
+    )
+
+@bot.callback_query_handler(func=lambda call: call.data == ('change_time'))
+@query_budget(1)
+async def change_time(call):
+    user_id = call.message.chat.id
+    await bot.send_message(
+        call.message.chat.id,
+        "Введите новое время в формате ЧЧ:MM (например 21:30):"
+    )
+    await register_next_step(call.message.chat.id, process_time_input, user_id)
+
+@conversation.step
+@query_budget(1)
+async def process_time_input(message, user_id):
+    try:
+        new_time = datetime.strptime(message.text or "", "%H:%M").time()
+        await asyncio.to_thread(update_settings, user_id, reminder_time=new_time)
+
+        await bot.send_message(
+            message.chat.id,
+            f"Время напоминания обновлено на {new_time.strftime('%H:%M')}",
+            reply_markup=main_keyboard()
+        )
+
+    except ValueError:
+        await bot.send_message(
+            message.chat.id,
+            "❌ Неверный формат времени! Используйте ЧЧ:MM",
+            reply_markup=main_keyboard()
+        )
+
+# Планировщик
+async def send_reminder(user_id):
+    await bot.send_message(user_id,
+                    "Пора отправить сегодняшнее селфи!",
+                    reply_markup=main_keyboard())
+
+reminders = AsyncReminderDispatcher(send_reminder)
+register_queue("reminders", reminders.depth)
+if PHOTO_QUEUE:
+    register_queue("photo_jobs", queue_depth)
+
+# Запуск
+async def main():
+    scheduler.start()
+
+    with startup_phase("load ANN index"):
+        if await asyncio.to_thread(get_index) is not None:
+            scheduler.add_job(refresh_index, 'interval', minutes=5, id="refresh_ann_index")
+            scheduler.add_job(save_index, 'interval', minutes=10, id="save_ann_index")
+
+    scheduler.add_job(report_stats, 'interval', minutes=10, id="inference_cache_stats")
+    scheduler.add_job(sweep_staging, 'interval', hours=1, args=[conversation.ttl], id="sweep_staging")
+    if PHOTO_QUEUE:
+        scheduler.add_job(purge_finished_jobs, 'interval', hours=1, id="purge_photo_jobs")
+
+    # Одна задача в минуту вместо отдельной задачи на каждого пользователя
+    reminders.start()
+    scheduler.add_job(reminders.dispatch, CronTrigger(minute='*'), id="reminders", coalesce=True, misfire_grace_time=30)
+
+    if PRELOAD_MODELS:
+        with startup_phase("start inference workers"):
+            await prestart()
+
+    start_metrics_server()
+
+    report_startup()
+    print("Bot ready (asyncio)")
+
+    try:
+        await bot.infinity_polling()
+    finally:
+        shutdown()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,181 @@
+import os
+import json
+import time
+import uuid
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from dotenv import load_dotenv
+from os import environ
+
+load_dotenv()
+CONVERSATION_BACKEND = environ.get("CONVERSATION_BACKEND", "memory")  # memory, sql или file
+CONVERSATION_STATE_DIR = environ.get("CONVERSATION_STATE_DIR", "conversations")
+CONVERSATION_TTL = float(environ.get("CONVERSATION_TTL", 24 * 60 * 60))  # секунды до забытого шага
+
+class ConversationStore(ABC):
+    """Ожидаемый следующий шаг диалога для каждого чата: имя обработчика и аргументы.
+
+    Замена register_next_step_handler, которая хранит состояние вне процесса:
+    при бэкенде sql или file следующее сообщение может обработать любой
+    экземпляр бота. Аргументы шага должны сериализоваться в JSON.
+
+    Пример:
+        @conversation.step
+        def save_emotion(message, photo_path): ...
+
+        conversation.set_step(chat_id, save_emotion, photo_path)
+    """
+
+    def __init__(self, ttl: float = CONVERSATION_TTL):
+        self.ttl = ttl
+        self.steps = {}
+
+    def step(self, func):
+        """Декоратор: разрешает использовать func как следующий шаг диалога."""
+        self.steps[func.__name__] = func
+        return func
+
+    def set_step(self, chat_id, handler, *args):
+        if handler.__name__ not in self.steps:
+            raise ValueError(f"{handler.__name__} is not registered as a conversation step")
+        self._save(str(chat_id), handler.__name__, json.dumps(args), time.time() + self.ttl)
+
+    def has_step(self, chat_id) -> bool:
+        return self._exists(str(chat_id))
+
+    def pop_step(self, chat_id) -> tuple | None:
+        """Забирает шаг чата. Returns: (обработчик, аргументы) или None, если шаг
+        уже забрал другой экземпляр или он устарел."""
+        state = self._take(str(chat_id))
+        if state is None:
+            return None
+
+        name, args, expires = state
+        if expires < time.time():
+            return None
+        return self.steps[name], json.loads(args)
+
+    @abstractmethod
+    def _save(self, chat_id: str, name: str, args: str, expires: float):
+        ...
+
+    @abstractmethod
+    def _exists(self, chat_id: str) -> bool:
+        ...
+
+    @abstractmethod
+    def _take(self, chat_id: str) -> tuple[str, str, float] | None:
+        ...
+
+class MemoryConversationStore(ConversationStore):
+    """Состояние в памяти процесса: только для одного экземпляра бота."""
+
+    def __init__(self, ttl: float = CONVERSATION_TTL):
+        super().__init__(ttl)
+        self.states = {}
+        self.lock = threading.Lock()
+
+    def _save(self, chat_id, name, args, expires):
+        with self.lock:
+            self.states[chat_id] = (name, args, expires)
+
+    def _exists(self, chat_id):
+        with self.lock:
+            state = self.states.get(chat_id)
+        return state is not None and state[2] >= time.time()
+
+    def _take(self, chat_id):
+        with self.lock:
+            return self.states.pop(chat_id, None)
+
+class FileConversationStore(ConversationStore):
+    """Файл JSON на чат в общем каталоге: экземпляры на одной машине или с общим диском.
+
+    Шаг забирается переименованием файла, поэтому его получает ровно один экземпляр.
+    """
+
+    def __init__(self, directory: str = CONVERSATION_STATE_DIR, ttl: float = CONVERSATION_TTL):
+        super().__init__(ttl)
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, chat_id: str) -> Path:
+        return self.directory / f"{chat_id}.json"
+
+    def _save(self, chat_id, name, args, expires):
+        temp_path = self.directory / f".{chat_id}.{uuid.uuid4().hex}.tmp"
+        temp_path.write_text(json.dumps({"step": name, "args": args, "expires": expires}), encoding="utf-8")
+        os.replace(temp_path, self._path(chat_id))
+
+    def _exists(self, chat_id):
+        try:
+            with open(self._path(chat_id), encoding="utf-8") as f:
+                return json.load(f)["expires"] >= time.time()
+        except (FileNotFoundError, ValueError):
+            return False
+
+    def _take(self, chat_id):
+        taken_path = self.directory / f".{chat_id}.{uuid.uuid4().hex}.taken"
+        try:
+            os.rename(self._path(chat_id), taken_path)
+        except FileNotFoundError:
+            return None
+
+        try:
+            state = json.loads(taken_path.read_text(encoding="utf-8"))
+        finally:
+            taken_path.unlink(missing_ok=True)
+        return state["step"], state["args"], state["expires"]
+
+class SqlConversationStore(ConversationStore):
+    """Таблица conversation_states в Postgres: любое число экземпляров на любых машинах."""
+
+    def _save(self, chat_id, name, args, expires):
+        from sqlalchemy.dialects.postgresql import insert
+        from src.database.database import SessionLocal
+        from src.database.models import ConversationState
+
+        values = {"chat_id": chat_id, "step": name, "args": args, "expires": expires}
+        with SessionLocal() as session:
+            session.execute(
+                insert(ConversationState).values(**values)
+                .on_conflict_do_update(index_elements=[ConversationState.chat_id], set_=values)
+            )
+            session.commit()
+
+    def _exists(self, chat_id):
+        from sqlalchemy import select
+        from src.database.database import SessionLocal
+        from src.database.models import ConversationState
+
+        with SessionLocal() as session:
+            return session.scalar(
+                select(ConversationState.chat_id)
+                .where(ConversationState.chat_id == chat_id, ConversationState.expires >= time.time())
+            ) is not None
+
+    def _take(self, chat_id):
+        from sqlalchemy import delete
+        from src.database.database import SessionLocal
+        from src.database.models import ConversationState
+
+        with SessionLocal() as session:
+            row = session.execute(
+                delete(ConversationState)
+                .where(ConversationState.chat_id == chat_id)
+                .returning(ConversationState.step, ConversationState.args, ConversationState.expires)
+            ).first()
+            session.commit()
+        return tuple(row) if row else None
+
+BACKENDS = {
+    "memory": MemoryConversationStore,
+    "file": FileConversationStore,
+    "sql": SqlConversationStore,
+}
+
+def create_store(backend: str = CONVERSATION_BACKEND) -> ConversationStore:
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown CONVERSATION_BACKEND {backend!r}, expected one of {', '.join(BACKENDS)}")
+    return BACKENDS[backend]()
@@ -0,0 +1,45 @@
+from telebot import types
+
+EMOTIONS = ['angry', 'disgust', 'fear', 'happy', 'neutral', 'sad', 'surprise']
+
+def main_keyboard():
+    keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
+    keyboard.add('📅 Скачать календарь')
+    keyboard.add('👥 Похожие люди')
+    keyboard.add('⚙️ Настройки')
+    return keyboard
+
+def emotion_keyboard():
+    keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
+    for emotion in EMOTIONS:
+        keyboard.add(emotion)
+    return keyboard
+
+def confirm_emotion_keyboard():
+    keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
+    keyboard.add('✅ Подтвердить')
+    keyboard.add('📋 Выбрать вручную')
+    return keyboard
+
+def settings_markup(settings):
+    keyboard = types.InlineKeyboardMarkup()
+    
+    ai_status = "ВКЛ" if settings.ai_enabled else "ВЫКЛ"
+    keyboard.add(types.InlineKeyboardButton(
+        f"ИИ распознавание: {ai_status}", 
+        callback_data=f"toggle_ai")
+    )
+    
+    reminder_time = settings.reminder_time.strftime("%H:%M")
+    keyboard.add(types.InlineKeyboardButton(
+        f"Время напоминания: {reminder_time}",
+        callback_data=f"change_time")
+    )
+
+    search_status = "РАЗРЕШЕНО" if settings.search_allowed else "ЗАПРЕЩЕНО"
+    keyboard.add(types.InlineKeyboardButton(
+        f"Поиск в похожих: {search_status}", 
+        callback_data=f"toggle_search")
+    )
+    
+    return keyboard
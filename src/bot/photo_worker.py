@@ -0,0 +1,103 @@
+"""Воркер очереди фото: python -m src.bot.photo_worker [--threads N]
+
+Забирает задачи photo_jobs, распознает эмоцию и эмбеддинг и отправляет
+результат в чат. Воркеров можно запускать сколько угодно, в том числе на
+разных машинах (каталог IMAGES_DIR должен быть общим). Сообщение отправляется
+только после сохранения результата: если аренда истекла во время обработки,
+сообщение отправит воркер, который выполнит задачу повторно. Если отправка
+не удалась, результат все равно доступен через confirm_job.
+"""
+import os
+import time
+import socket
+import argparse
+import threading
+import telebot
+from dotenv import load_dotenv
+from os import environ
+
+from src.bot.keyboards import emotion_keyboard, confirm_emotion_keyboard
+from src.bot.startup import PRELOAD_MODELS, warmup_models, report_startup
+from src.database.photo_jobs import claim_job, complete_job, fail_job, queue_depth, JobSnapshot
+from src.emote_processor.inference_cache import analyze_cached
+from src.metrics import stage_timer, register_queue, start_metrics_server
+
+load_dotenv()
+TOKEN = environ.get("TELEGRAM_TOKEN")
+PHOTO_WORKER_POLL = float(environ.get("PHOTO_WORKER_POLL", 1))  # секунды ожидания при пустой очереди
+
+bot = telebot.TeleBot(TOKEN, threaded=False)
+
+def process_job(job: JobSnapshot):
+    """Распознает эмоцию и эмбеддинг. Returns: (эмоция, эмбеддинг) или (None, None), если лица нет"""
+    from src.emote_processor.face_analysis import analyze_face
+
+    try:
+        with stage_timer("photo_job", "inference"):
+            analysis = analyze_cached(job.content_hash, job.photo_path, analyze_face)
+    except ValueError:
+        return None, None
+    return analysis.emotion, analysis.embedding
+
+def notify(user_id: str, emotion: str | None):
+    """Отправляет распознанную эмоцию или предложение выбрать ее вручную."""
+    try:
+        if emotion is not None:
+            bot.send_message(user_id, f"Распознанная эмоция: {emotion}", reply_markup=confirm_emotion_keyboard())
+        else:
+            bot.send_message(user_id, "Не удалось распознать эмоцию, выберите ее вручную.", reply_markup=emotion_keyboard())
+    except Exception as e:
+        print(f"Error notifying user {user_id}: {e}")
+
+def run(worker_id: str):
+    while True:
+        job = claim_job(worker_id)
+        if job is None:
+            time.sleep(PHOTO_WORKER_POLL)
+            continue
+
+        if job.status == "failed":
+            # Аренда истекла на последней попытке (воркер упал) - пользователь выберет эмоцию сам
+            print(f"Photo job {job.id} failed: lease expired after {job.attempts} attempts")
+            notify(job.user_id, None)
+            continue
+
+        try:
+            with stage_timer("photo_job", "total"):
+                emotion, embedding = process_job(job)
+        except Exception as e:
+            print(f"Photo job {job.id} failed (attempt {job.attempts}): {e}")
+            if fail_job(job, worker_id, str(e)):
+                # Попытки исчерпаны - пользователь выберет эмоцию сам
+                notify(job.user_id, None)
+            continue
+
+        # Сначала результат, потом сообщение: ответ пользователя не должен опередить запись
+        if not complete_job(job.id, worker_id, emotion, embedding):
+            print(f"Photo job {job.id} lease expired before completion")
+            continue
+        notify(job.user_id, emotion)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Photo analysis worker")
+    parser.add_argument("--threads", type=int, default=1, help="Parallel job loops in this process")
+    args = parser.parse_args()
+
+    if PRELOAD_MODELS:
+        warmup_models()
+        report_startup()
+
+    register_queue("photo_jobs", queue_depth)
+    start_metrics_server()
+
+    worker_prefix = f"{socket.gethostname()[:40]}:{os.getpid()}"
+    threads = [
+        threading.Thread(target=run, args=(f"{worker_prefix}:{i}",), daemon=True)
+        for i in range(args.threads)
+    ]
+    for thread in threads:
+        thread.start()
+
+    print(f"Photo worker {worker_prefix} ready ({args.threads} threads)")
+    for thread in threads:
+        thread.join()
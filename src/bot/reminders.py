@@ -0,0 +1,162 @@
+import time
+import queue
+import asyncio
+import threading
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from os import environ
+
+from src.database.database import SessionLocal
+from src.database.models import Settings
+
+load_dotenv()
+REMINDER_RATE = float(environ.get("REMINDER_RATE", 25))  # сообщений в секунду, лимит Telegram ~30
+REMINDER_CATCH_UP = int(environ.get("REMINDER_CATCH_UP", 5))  # минут, которые досылаются после задержки
+
+class RateLimiter:
+    """Равномерно распределяет отправки: не больше rate сообщений в секунду."""
+
+    def __init__(self, rate: float = REMINDER_RATE):
+        self.interval = 1 / rate
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def delay(self) -> float:
+        """Резервирует слот отправки и возвращает, сколько секунд до него ждать."""
+        with self.lock:
+            now = time.monotonic()
+            self.next_time = max(self.next_time, now)
+            wait = self.next_time - now
+            self.next_time += self.interval
+            return wait
+
+    def pause(self, seconds: float):
+        """Сдвигает все отправки после ответа 429 от Telegram."""
+        with self.lock:
+            self.next_time = max(self.next_time, time.monotonic() + seconds)
+
+def due_user_ids(moment: datetime) -> list[str]:
+    """Пользователи, у которых напоминание назначено на минуту moment.
+
+    Один запрос по индексу settings.reminder_time.
+    """
+    minute_start = moment.replace(second=0, microsecond=0)
+    minute_end = minute_start + timedelta(minutes=1)
+
+    filters = [Settings.reminder_time >= minute_start.time()]
+    if minute_end.date() == minute_start.date():
+        filters.append(Settings.reminder_time < minute_end.time())
+
+    with SessionLocal() as session:
+        return [user_id for (user_id,) in session.query(Settings.user_id).filter(*filters)]
+
+class MinuteCursor:
+    """Минуты, которые еще не разосланы.
+
+    Запуск планировщика может опоздать на следующую минуту (misfire_grace_time),
+    поэтому минута берется не из datetime.now(), а как все минуты после
+    последней разосланной до текущей: опоздавший запуск досылает пропущенную
+    минуту, а следующий не рассылает ее повторно.
+    """
+
+    def __init__(self, catch_up: int = REMINDER_CATCH_UP):
+        self.catch_up = catch_up
+        self.last_minute = None
+        self.lock = threading.Lock()
+
+    def advance(self, now: datetime) -> list[datetime]:
+        current = now.replace(second=0, microsecond=0)
+        with self.lock:
+            if self.last_minute is None:
+                minutes = [current]
+            elif self.last_minute >= current:
+                minutes = []
+            else:
+                first = max(self.last_minute + timedelta(minutes=1), current - timedelta(minutes=self.catch_up))
+                minutes = [first + timedelta(minutes=i) for i in range(int((current - first) / timedelta(minutes=1)) + 1)]
+            if minutes:
+                self.last_minute = minutes[-1]
+        return minutes
+
+def _retry_after(error: Exception) -> float | None:
+    """Время ожидания из ответа 429 Too Many Requests, если это он."""
+    if getattr(error, "error_code", None) != 429:
+        return None
+    parameters = (getattr(error, "result_json", None) or {}).get("parameters", {})
+    return float(parameters.get("retry_after", 1))
+
+class ReminderDispatcher:
+    """Раз в минуту выбирает пользователей с напоминанием на эту минуту
+    и отправляет им сообщения из очереди с ограничением скорости."""
+
+    def __init__(self, send, rate: float = REMINDER_RATE):
+        self.send = send
+        self.limiter = RateLimiter(rate)
+        self.queue = queue.Queue()
+        self.cursor = MinuteCursor()
+        self.thread = None
+
+    def start(self):
+        """Запускает поток отправки. Только в процессе, который выполняет schedule_jobs."""
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def dispatch(self, moment: datetime | None = None):
+        """Рассылает минуту moment или, по умолчанию, все еще не разосланные минуты."""
+        minutes = [moment] if moment is not None else self.cursor.advance(datetime.now())
+        for minute in minutes:
+            for user_id in due_user_ids(minute):
+                self.queue.put(user_id)
+
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    def _run(self):
+        while True:
+            user_id = self.queue.get()
+            time.sleep(self.limiter.delay())
+            try:
+                self.send(user_id)
+            except Exception as e:
+                retry_after = _retry_after(e)
+                if retry_after is not None:
+                    self.limiter.pause(retry_after)
+                    self.queue.put(user_id)
+                else:
+                    print(f"Error sending reminder to {user_id}: {e}")
+
+class AsyncReminderDispatcher:
+    """То же, что ReminderDispatcher, для асинхронного бота."""
+
+    def __init__(self, send, rate: float = REMINDER_RATE):
+        self.send = send
+        self.limiter = RateLimiter(rate)
+        self.queue = asyncio.Queue()
+        self.cursor = MinuteCursor()
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def dispatch(self, moment: datetime | None = None):
+        minutes = [moment] if moment is not None else self.cursor.advance(datetime.now())
+        for minute in minutes:
+            for user_id in await asyncio.to_thread(due_user_ids, minute):
+                self.queue.put_nowait(user_id)
+
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    async def _run(self):
+        while True:
+            user_id = await self.queue.get()
+            await asyncio.sleep(self.limiter.delay())
+            try:
+                await self.send(user_id)
+            except Exception as e:
+                retry_after = _retry_after(e)
+                if retry_after is not None:
+                    self.limiter.pause(retry_after)
+                    self.queue.put_nowait(user_id)
+                else:
+                    print(f"Error sending reminder to {user_id}: {e}")
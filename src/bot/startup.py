@@ -0,0 +1,63 @@
+import time
+import threading
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from os import environ
+
+load_dotenv()
+PRELOAD_MODELS = environ.get("PRELOAD_MODELS", "0") == "1"
+
+_phases: list[tuple[str, float]] = []
+_warmup_lock = threading.Lock()
+_warmed_up = False
+
+@contextmanager
+def startup_phase(name: str):
+    """Замеряет длительность фазы запуска для отчета report_startup."""
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        _phases.append((name, time.perf_counter() - start_time))
+
+def warmup_models() -> bool:
+    """Загружает модели эмоций, детектора и dlib и прогоняет через них пустое изображение,
+    чтобы первый пользователь после запуска не ждал инициализации.
+
+    Выполняется один раз на процесс (потоки пула с INFERENCE_EXECUTOR=thread
+    ждут первый прогрев). Returns: был ли прогрев выполнен этим вызовом
+    """
+    global _warmed_up
+
+    with _warmup_lock:
+        if _warmed_up:
+            return False
+        _warmup()
+        _warmed_up = True
+        return True
+
+def _warmup():
+    import numpy as np
+
+    with startup_phase("import deepface"):
+        from deepface import DeepFace
+        from src.emote_processor.face_analysis import classify_emotion, encode_face, FACE_DETECTOR
+        from src.emote_processor.detector_cascade import load_profile
+
+    with startup_phase("load emotion model"):
+        DeepFace.build_model(task="facial_attribute", model_name="Emotion")
+        detectors = load_profile()["cascade"] if FACE_DETECTOR == "cascade" else [FACE_DETECTOR]
+        for detector in detectors:
+            DeepFace.build_model(task="face_detector", model_name=detector)
+
+    with startup_phase("warm up emotion model"):
+        classify_emotion(np.zeros((48, 48, 3), dtype=np.float32))
+
+    with startup_phase("warm up embedding model"):
+        encode_face(np.zeros((150, 150, 3), dtype=np.uint8), (0, 150, 150, 0))
+
+def report_startup():
+    total = sum(elapsed for _, elapsed in _phases)
+    print(f"Startup finished in {total:.2f}s")
+    for name, elapsed in _phases:
+        print(f"  {name}: {elapsed:.2f}s")
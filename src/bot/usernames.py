@@ -0,0 +1,132 @@
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from os import environ
+
+from src.database.database import SessionLocal
+from src.database.models import User
+
+load_dotenv()
+USERNAME_CACHE_SIZE = int(environ.get("USERNAME_CACHE_SIZE", 10_000))
+USERNAME_CACHE_TTL = float(environ.get("USERNAME_CACHE_TTL", 6 * 60 * 60))
+
+_MISSING = object()
+
+class UsernameCache:
+    """LRU кэш user_id -> username с ограничением по времени жизни записи."""
+
+    def __init__(self, maxsize: int = USERNAME_CACHE_SIZE, ttl: float = USERNAME_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, user_id: str):
+        with self.lock:
+            item = self.items.get(user_id)
+            if item is None:
+                return _MISSING
+            username, expires = item
+            if expires < time.monotonic():
+                del self.items[user_id]
+                return _MISSING
+            self.items.move_to_end(user_id)
+            return username
+
+    def put(self, user_id: str, username: str | None):
+        with self.lock:
+            self.items[user_id] = (username, time.monotonic() + self.ttl)
+            self.items.move_to_end(user_id)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+cache = UsernameCache()
+
+def _load_persisted(user_ids: list[str]) -> dict:
+    with SessionLocal() as session:
+        return dict(session.query(User.user_id, User.username)
+            .filter(User.user_id.in_(user_ids), User.username.isnot(None)))
+
+def _persist(usernames: dict):
+    with SessionLocal() as session:
+        for user_id, username in usernames.items():
+            session.query(User).filter(User.user_id == user_id).update({User.username: username})
+        session.commit()
+
+def remember_user(user):
+    """Обновляет username по входящему сообщению или нажатию, без запросов к Telegram."""
+    if user is None:
+        return
+
+    user_id = str(user.id)
+    if cache.get(user_id) != user.username:
+        cache.put(user_id, user.username)
+        _persist({user_id: user.username})
+
+def _split_misses(user_ids: list[str]) -> tuple[dict, list]:
+    resolved, misses = {}, []
+    for user_id in user_ids:
+        username = cache.get(user_id)
+        if username is _MISSING:
+            misses.append(user_id)
+        else:
+            resolved[user_id] = username
+
+    if misses:
+        for user_id, username in _load_persisted(misses).items():
+            cache.put(user_id, username)
+            resolved[user_id] = username
+        misses = [user_id for user_id in misses if user_id not in resolved]
+
+    return resolved, misses
+
+def _store_fetched(resolved: dict, fetched: dict):
+    fetched = {user_id: username for user_id, username in fetched.items() if username is not _MISSING}
+    for user_id, username in fetched.items():
+        cache.put(user_id, username)
+        resolved[user_id] = username
+    if fetched:
+        _persist(fetched)
+
+def resolve_usernames(user_ids, fetch) -> dict:
+    """Возвращает {user_id: username или user_id} для отображения.
+
+    Сначала кэш, затем колонка users.username, и только для оставшихся
+    параллельные вызовы fetch(user_id) к Telegram.
+    """
+    user_ids = [str(user_id) for user_id in user_ids]
+    resolved, misses = _split_misses(user_ids)
+
+    def safe_fetch(user_id):
+        try:
+            return fetch(user_id)
+        except Exception as e:
+            print(f"Error fecching {user_id}: {e}")
+            return _MISSING
+
+    if misses:
+        with ThreadPoolExecutor(max_workers=len(misses)) as executor:
+            _store_fetched(resolved, dict(zip(misses, executor.map(safe_fetch, misses))))
+
+    return {user_id: resolved.get(user_id) or user_id for user_id in user_ids}
+
+async def resolve_usernames_async(user_ids, fetch) -> dict:
+    """То же, что resolve_usernames, с асинхронной fetch."""
+    user_ids = [str(user_id) for user_id in user_ids]
+    resolved, misses = await asyncio.to_thread(_split_misses, user_ids)
+
+    async def safe_fetch(user_id):
+        try:
+            return await fetch(user_id)
+        except Exception as e:
+            print(f"Error fecching {user_id}: {e}")
+            return _MISSING
+
+    if misses:
+        fetched = await asyncio.gather(*(safe_fetch(user_id) for user_id in misses))
+        await asyncio.to_thread(_store_fetched, resolved, dict(zip(misses, fetched)))
+
+    return {user_id: resolved.get(user_id) or user_id for user_id in user_ids}
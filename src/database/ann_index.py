@@ -0,0 +1,406 @@
+import os
+import threading
+import numpy as np
+from datetime import datetime
+from dotenv import load_dotenv
+from os import environ
+
+from .database import SessionLocal
+from .models import Image, Settings
+
+load_dotenv()
+ANN_INDEX_PATH = environ.get("ANN_INDEX_PATH")  # Пустое значение - индекс выключен
+ANN_INDEX_PROBES = int(environ.get("ANN_INDEX_PROBES", 8))
+# Переобучение центроидов, когда индекс вырос во столько раз с последнего обучения
+ANN_RETRAIN_GROWTH = float(environ.get("ANN_RETRAIN_GROWTH", 2.0))
+
+EMBEDDING_DIM = 128
+TRAIN_SAMPLE = 50_000
+KMEANS_ITERATIONS = 10
+ASSIGN_CHUNK = 8192  # строк на одно матричное умножение при поиске ближайших центроидов
+
+class _Column:
+    """Растущий непрерывный numpy массив (удвоение емкости при вставке)."""
+
+    def __init__(self, dtype, width: int | None = None, data: np.ndarray | None = None):
+        shape = (0,) if width is None else (0, width)
+        self.data = np.ascontiguousarray(data) if data is not None else np.empty(shape, dtype=dtype)
+        self.size = len(self.data)
+
+    def append(self, value):
+        if self.size == len(self.data):
+            grown = np.empty((max(16, self.size * 2),) + self.data.shape[1:], dtype=self.data.dtype)
+            grown[:self.size] = self.data[:self.size]
+            self.data = grown
+        self.data[self.size] = value
+        self.size += 1
+
+    def view(self) -> np.ndarray:
+        return self.data[:self.size]
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return (vectors / norms).astype(np.float32)
+
+def _nearest(vectors: np.ndarray, centroids: np.ndarray, chunk: int = ASSIGN_CHUNK) -> np.ndarray:
+    """Ближайший центроид каждого вектора. Матрица сходства считается
+    частями по chunk строк, а не целиком N x число кластеров."""
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk):
+        labels[start:start + chunk] = np.argmax(vectors[start:start + chunk] @ centroids.T, axis=1)
+    return labels
+
+def _to_timestamp(date: datetime) -> int:
+    return int(date.timestamp())
+
+class AnnIndex:
+    """IVF индекс по эмбеддингам Image.embedding в памяти процесса.
+
+    Векторы хранятся нормированными в непрерывной float32 матрице, поэтому
+    косинусное расстояние сводится к скалярному произведению. Центроиды
+    обучаются k-means на выборке, новые строки приписываются к ближайшему
+    центроиду без переобучения.
+    """
+
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+        self.lock = threading.RLock()
+        self.train_lock = threading.Lock()  # одно обучение за раз
+
+        self.vectors = _Column(np.float32, dim)
+        self.user_codes = _Column(np.int32)
+        self.emotion_codes = _Column(np.int16)
+        self.created = _Column(np.int64)
+        self.assignments = _Column(np.int32)
+
+        self.ids: list[str] = []
+        self.id_to_row: dict[str, int] = {}
+        self.users: list[str] = []
+        self.user_to_code: dict[str, int] = {}
+        self.emotions: list[str] = []
+        self.emotion_to_code: dict[str, int] = {}
+        self.allowed = _Column(np.bool_)
+
+        self.centroids: np.ndarray | None = None
+        self.lists: list[_Column] = []
+        self.trained_size = 0  # строк в индексе при последнем обучении
+
+    def __len__(self):
+        return len(self.ids)
+
+    # Справочники пользователей и эмоций
+    def _user_code(self, user_id: str) -> int:
+        code = self.user_to_code.get(user_id)
+        if code is None:
+            code = len(self.users)
+            self.users.append(user_id)
+            self.user_to_code[user_id] = code
+            self.allowed.append(True)
+        return code
+
+    def _emotion_code(self, emotion: str) -> int:
+        code = self.emotion_to_code.get(emotion)
+        if code is None:
+            code = len(self.emotions)
+            self.emotions.append(emotion)
+            self.emotion_to_code[emotion] = code
+        return code
+
+    def add(self, image_id: str, user_id: str, emotion: str, created_date: datetime, embedding):
+        """Добавляет одно изображение в индекс."""
+        vector = _normalize(np.asarray(embedding, dtype=np.float32))
+
+        with self.lock:
+            image_id = str(image_id)
+            if image_id in self.id_to_row:
+                return
+
+            row = len(self.ids)
+            self.ids.append(image_id)
+            self.id_to_row[image_id] = row
+            self.vectors.append(vector)
+            self.user_codes.append(self._user_code(str(user_id)))
+            self.emotion_codes.append(self._emotion_code(emotion))
+            self.created.append(_to_timestamp(created_date))
+
+            if self.centroids is None:
+                self.assignments.append(0)
+            else:
+                cluster = int(np.argmax(self.centroids @ vector))
+                self.assignments.append(cluster)
+                self.lists[cluster].append(row)
+
+    def set_search_allowed(self, user_id: str, allowed: bool):
+        with self.lock:
+            self.allowed.data[self._user_code(str(user_id))] = allowed
+
+    def train(self, n_lists: int | None = None):
+        """Обучает центроиды k-means и перестраивает инвертированные списки.
+
+        Обучение и распределение строк по кластерам идут без блокировки индекса
+        на снимке уже добавленных строк (строки только дописываются, поэтому
+        снимок не меняется). Под блокировкой распределяются строки, добавленные
+        за время обучения, и подменяются центроиды и списки: поиск и вставка
+        не ждут переобучения.
+        """
+        with self.train_lock:
+            with self.lock:
+                size = len(self.ids)
+                vectors = self.vectors.data[:size]
+
+            if n_lists is None:
+                n_lists = int(np.sqrt(size))
+            n_lists = min(n_lists, size)
+            if n_lists < 2:
+                with self.lock:
+                    self.trained_size = size
+                    self.centroids = None
+                    self.lists = []
+                return
+
+            rng = np.random.default_rng(0)
+            sample = vectors[rng.choice(size, min(TRAIN_SAMPLE, size), replace=False)]
+            centroids = sample[rng.choice(len(sample), n_lists, replace=False)]
+
+            for _ in range(KMEANS_ITERATIONS):
+                labels = _nearest(sample, centroids)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, labels, sample)
+                counts = np.bincount(labels, minlength=n_lists)
+                filled = counts > 0
+                centroids[filled] = sums[filled] / counts[filled, None]
+                centroids = _normalize(centroids)
+
+            assignments = _nearest(vectors, centroids)
+
+            with self.lock:
+                added = self.vectors.data[size:len(self.ids)]
+                if len(added):
+                    assignments = np.concatenate([assignments, _nearest(added, centroids)])
+                self.trained_size = size
+                self.centroids = centroids
+                self._assign(assignments)
+
+    def needs_training(self, growth: float = ANN_RETRAIN_GROWTH) -> bool:
+        """Центроидов еще нет, хотя строк уже хватает, или индекс вырос в growth раз.
+
+        На новой установке индекс строится почти пустым и без центроидов,
+        а кластеры загруженного индекса устаревают по мере роста данных.
+        """
+        with self.lock:
+            size = len(self.ids)
+            if self.centroids is None:
+                return int(np.sqrt(size)) >= 2 and size > self.trained_size
+            return size >= self.trained_size * growth
+
+    def _assign(self, assignments: np.ndarray):
+        self.assignments = _Column(np.int32, data=assignments)
+        order = np.argsort(assignments, kind='stable')
+        bounds = np.searchsorted(assignments[order], np.arange(len(self.centroids) + 1))
+        self.lists = [
+            _Column(np.int64, data=order[bounds[k]:bounds[k + 1]].astype(np.int64))
+            for k in range(len(self.centroids))
+        ]
+
+    def search(
+        self,
+        image_id: str,
+        find_n: int = 5,
+        same_emotion: bool = False,
+        ignore_original_user: bool = True,
+        since: datetime | None = None,
+        n_probe: int = ANN_INDEX_PROBES
+    ) -> list[tuple[str, float]] | None:
+        """Ищет ближайшие изображения с теми же фильтрами, что и find_similar_images.
+
+        Returns:
+            list: Пары (id изображения, косинусное расстояние) по возрастанию
+            расстояния, либо None если исходного изображения нет в индексе
+        """
+        with self.lock:
+            row = self.id_to_row.get(str(image_id))
+            if row is None:
+                return None
+
+            query = self.vectors.data[row]
+            allowed = self.allowed.view()
+            user_codes = self.user_codes.view()
+
+            def keep(rows: np.ndarray) -> np.ndarray:
+                mask = allowed[user_codes[rows]]
+                if ignore_original_user:
+                    mask &= user_codes[rows] != user_codes[row]
+                if same_emotion:
+                    mask &= self.emotion_codes.data[rows] == self.emotion_codes.data[row]
+                if since is not None:
+                    mask &= self.created.data[rows] >= _to_timestamp(since)
+                return rows[mask]
+
+            if self.centroids is None:
+                candidates = keep(np.arange(len(self.ids)))
+            else:
+                # Просматриваем ближайшие кластеры, пока не наберется find_n кандидатов
+                probe_order = np.argsort(-(self.centroids @ query))
+                chunks, found = [], 0
+                for probed, cluster in enumerate(probe_order):
+                    if probed >= n_probe and found >= find_n:
+                        break
+                    rows = keep(self.lists[cluster].view())
+                    chunks.append(rows)
+                    found += len(rows)
+                candidates = np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int64)
+
+            if not len(candidates):
+                return []
+
+            scores = self.vectors.data[candidates] @ query
+            top = min(find_n, len(candidates))
+            best = np.argpartition(-scores, top - 1)[:top]
+            best = best[np.argsort(-scores[best])]
+
+            return [(self.ids[candidates[i]], float(1 - scores[i])) for i in best]
+
+    def save(self, path: str):
+        """Атомарно сохраняет индекс на диск."""
+        with self.lock:
+            arrays = {
+                "vectors": self.vectors.view(),
+                "user_codes": self.user_codes.view(),
+                "emotion_codes": self.emotion_codes.view(),
+                "created": self.created.view(),
+                "assignments": self.assignments.view(),
+                "allowed": self.allowed.view(),
+                "ids": np.array(self.ids, dtype="U36"),
+                "users": np.array(self.users, dtype="U128"),
+                "emotions": np.array(self.emotions, dtype="U50"),
+                "trained_size": np.array(self.trained_size),
+            }
+            if self.centroids is not None:
+                arrays["centroids"] = self.centroids
+
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "AnnIndex":
+        with np.load(path) as data:
+            index = cls(dim=data["vectors"].shape[1])
+            index.vectors = _Column(np.float32, data=data["vectors"])
+            index.user_codes = _Column(np.int32, data=data["user_codes"])
+            index.emotion_codes = _Column(np.int16, data=data["emotion_codes"])
+            index.created = _Column(np.int64, data=data["created"])
+            index.allowed = _Column(np.bool_, data=data["allowed"])
+
+            index.ids = data["ids"].tolist()
+            index.id_to_row = {image_id: row for row, image_id in enumerate(index.ids)}
+            index.users = data["users"].tolist()
+            index.user_to_code = {user_id: code for code, user_id in enumerate(index.users)}
+            index.emotions = data["emotions"].tolist()
+            index.emotion_to_code = {emotion: code for code, emotion in enumerate(index.emotions)}
+            # Индексы, сохраненные до появления trained_size, считаем обученными на всех строках
+            index.trained_size = int(data["trained_size"]) if "trained_size" in data else len(index.ids)
+
+            if "centroids" in data:
+                index.centroids = data["centroids"]
+                index._assign(data["assignments"])
+            else:
+                index.assignments = _Column(np.int32, data=data["assignments"])
+
+        return index
+
+    def sync(self, batch_size: int = 10_000):
+        """Догружает из БД изображения, которых нет в индексе, и обновляет флаги search_allowed.
+
+        Новые строки ищутся по набору id, а не по дате: импортированные и
+        сохраненные задним числом изображения тоже попадают в индекс.
+        """
+        with SessionLocal() as session:
+            with self.lock:
+                known = set(self.id_to_row)
+            missing = [
+                image_id for (image_id,) in session.query(Image.id).yield_per(batch_size)
+                if str(image_id) not in known
+            ]
+
+            for start in range(0, len(missing), batch_size):
+                query = session.query(
+                    Image.id, Image.user_id, Image.emotion, Image.created_date, Image.embedding
+                ).filter(Image.id.in_(missing[start:start + batch_size]))
+
+                for image_id, user_id, emotion, created_date, embedding in query:
+                    self.add(image_id, user_id, emotion, created_date, embedding)
+
+            for user_id, allowed in session.query(Settings.user_id, Settings.search_allowed):
+                self.set_search_allowed(user_id, bool(allowed))
+
+_index: AnnIndex | None = None
+_index_lock = threading.Lock()
+
+def get_index() -> AnnIndex | None:
+    """Возвращает общий индекс процесса, загружая или строя его при первом вызове.
+
+    Если ANN_INDEX_PATH не задан, возвращает None и поиск идет через SQL.
+    """
+    global _index
+
+    if not ANN_INDEX_PATH:
+        return None
+
+    with _index_lock:
+        if _index is None:
+            if os.path.exists(ANN_INDEX_PATH):
+                _index = AnnIndex.load(ANN_INDEX_PATH)
+                _index.sync()
+                if _index.needs_training():
+                    _index.train()
+            else:
+                _index = build_index()
+        return _index
+
+def disable_index():
+    """Выключает индекс в этом процессе, поиск идет через SQL.
+
+    Индекс живет в памяти процесса: при нескольких процессах (webhook) опт-аут
+    и новые фото попадают только в индекс процесса, который их обработал.
+    """
+    global ANN_INDEX_PATH, _index
+
+    with _index_lock:
+        ANN_INDEX_PATH = None
+        _index = None
+
+def loaded_index() -> AnnIndex | None:
+    """Индекс процесса, если он уже загружен; в отличие от get_index не строит его."""
+    return _index
+
+def build_index() -> AnnIndex:
+    """Строит индекс заново по всей таблице images."""
+    index = AnnIndex()
+    index.sync()
+    index.train()
+    if ANN_INDEX_PATH:
+        index.save(ANN_INDEX_PATH)
+    return index
+
+def refresh_index():
+    """Периодическая задача: догрузка новых строк и опт-аутов, переобучение при росте."""
+    if _index is None:
+        return
+
+    _index.sync()
+    if _index.needs_training():
+        _index.train()
+        print(f"ANN index retrained on {len(_index)} images")
+
+def save_index():
+    if _index is not None and ANN_INDEX_PATH:
+        _index.save(ANN_INDEX_PATH)
+
+if __name__ == "__main__":
+    if not ANN_INDEX_PATH:
+        raise SystemExit("ANN_INDEX_PATH is not set")
+    index = build_index()
+    print(f"Indexed {len(index)} images into {ANN_INDEX_PATH}")
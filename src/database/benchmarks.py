@@ -1,66 +1,23 @@
-import os
 import time
-from PIL import Image
-import matplotlib.pyplot as plt
-from datetime import datetime, timedelta
-import random
+import numpy as np
+from sqlalchemy import func, text
 
 from src.database.database import init_db, SessionLocal
-from src.database.services import save_image, find_similar_images
-from src.database.models import User, Settings
+from src.database.services import find_similar_images
+from src.database.models import Image
+from src.database.bulk_import import import_images, scan_folders
+from src.database.indexes import VECTOR_INDEX
 init_db()
 
 folders = ['actors'] # ['celeb_images'] #['angry', 'disgust', 'fear', 'happy', 'neutral', 'sad', 'surprise']
 
 def create_test_users_and_save_images(n_users: int = 50, n_images_per_user: int = 50):
-    for i in range(n_users):
-        current_user = f"test_user{i}"
-        print(current_user)
-        with SessionLocal() as session:
-            user = session.query(User).filter(User.user_id == str(current_user)).first()
-        
-            if not user:
-                user = User(user_id=str(current_user))
-                session.add(user)
-                session.commit()
-                
-                # Создаем настройки по умолчанию
-                settings = Settings(user_id=user.user_id)
-                session.add(settings)
-                session.commit()
-
-        image_list = []
-        for folder in folders:
-            emotion_dir = os.path.join('test_images', folder)
-            if not os.path.exists(emotion_dir):
-                continue
-            for img_name in os.listdir(emotion_dir):
-                img_path = os.path.join(emotion_dir, img_name)
-                if os.path.isfile(img_path):
-                    image_list.append((img_path, folder))
-
-        for file in image_list[i * n_images_per_user:(i + 1) * n_images_per_user]:
-            image, emotion = file
-
-            selected_date = datetime.now() # - timedelta(days=total)
-
-            try:
-                image_id = save_image(
-                    image,
-                    emotion,
-                    current_user,
-                    selected_date
-                )
-
-                print(image_id)
-            except ValueError:
-                print(f"No face for {image}")
+    """Заполняет БД тестовыми пользователями через параллельный bulk импорт."""
+    import_images(scan_folders(folders, n_users, n_images_per_user))
 
 def benchmark_similar_images(find_n: int = 1, total_images: int = -1):
-    ids = []
-    for image in os.listdir('images'):
-        image_id = image.replace(".jpg", "")
-        ids.append(image_id)
+    with SessionLocal() as session:
+        ids = [str(image_id) for (image_id,) in session.query(Image.id)]
 
     success = total = 0
     start_time = time.time()
@@ -73,6 +30,107 @@ def benchmark_similar_images(find_n: int = 1, total_images: int = -1):
     print(f"Time taken: {time.time() - start_time} seconds")
     print(f"Total images: {total} / {success} succeed")
 
+def benchmark_vector_index(
+    n_queries: int = 100,
+    find_n: int = 10,
+    ef_search_values: tuple = (10, 20, 40, 80, 160, 320),
+    probes_values: tuple = (1, 2, 5, 10, 20, 50)
+):
+    """Recall@k и задержка поиска для разных hnsw.ef_search / ivfflat.probes
+    относительно точного поиска без индекса."""
+    with SessionLocal() as session:
+        ids = [str(image_id) for (image_id,) in session.query(Image.id).order_by(func.random()).limit(n_queries)]
+
+    exact = {
+        image_id: {data["id"] for data in find_similar_images(image_id, find_n=find_n, all_time=True, exact=True)}
+        for image_id in ids
+    }
+
+    knob, values = ("ef_search", ef_search_values) if VECTOR_INDEX == "hnsw" else ("probes", probes_values)
+
+    for value in values:
+        latencies = []
+        found = expected = 0
+
+        for image_id in ids:
+            start_time = time.perf_counter()
+            similar = find_similar_images(image_id, find_n=find_n, all_time=True, **{knob: value})
+            latencies.append(time.perf_counter() - start_time)
+
+            found += len(exact[image_id] & {data["id"] for data in similar})
+            expected += len(exact[image_id])
+
+        latencies = np.array(latencies) * 1000
+        recall = found / expected if expected else 1.0
+        print(f"{knob}={value}: recall@{find_n} {recall:.3f}, "
+              f"mean {latencies.mean():.1f} ms, p95 {np.percentile(latencies, 95):.1f} ms, "
+              f"p99 {np.percentile(latencies, 99):.1f} ms")
+
+def benchmark_quantization(
+    n_queries: int = 100,
+    find_n: int = 10,
+    sample: int = 10_000,
+    ef_search: int = 40,
+    probes: int = 10
+):
+    """Экономия памяти и recall@k поиска по halfvec с дорасчетом
+    относительно точного косинусного поиска по float32.
+
+    Оба варианта идут в Postgres с одинаковыми ef_search / probes, минуя
+    ANN индекс процесса; без векторного индекса - оба точным поиском.
+    """
+    with SessionLocal() as session:
+        full_bytes, half_bytes = session.execute(text(f"""
+            SELECT avg(pg_column_size(embedding)), avg(pg_column_size(embedding::halfvec(128)))
+            FROM (SELECT embedding FROM images LIMIT {int(sample)}) sample
+        """)).one()
+        index_sizes = dict(session.execute(text("""
+            SELECT c.relname, pg_relation_size(c.oid)
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            JOIN pg_class t ON t.oid = i.indrelid
+            WHERE t.relname = 'images' AND c.relname LIKE 'ix_images_embedding_%'
+        """)).all())
+        ids = [str(image_id) for (image_id,) in session.query(Image.id).order_by(func.random()).limit(n_queries)]
+
+    print(f"Vector size: float32 {full_bytes:.0f} B, halfvec {half_bytes:.0f} B "
+          f"({1 - half_bytes / full_bytes:.0%} saved)")
+    for name, size in index_sizes.items():
+        print(f"Index {name}: {size / 2**20:.1f} MB")
+
+    exact = {
+        image_id: {data["id"] for data in find_similar_images(image_id, find_n=find_n, all_time=True, exact=True)}
+        for image_id in ids
+    }
+
+    if VECTOR_INDEX == "hnsw":
+        options = {"ef_search": ef_search}
+    elif VECTOR_INDEX == "ivfflat":
+        options = {"probes": probes}
+    else:
+        options = {"exact": True}
+    print(f"Search options: {options}")
+
+    for quantized in (False, True):
+        latencies = []
+        found = expected = 0
+
+        for image_id in ids:
+            start_time = time.perf_counter()
+            similar = find_similar_images(image_id, find_n=find_n, all_time=True, quantized=quantized,
+                                          **options)
+            latencies.append(time.perf_counter() - start_time)
+
+            found += len(exact[image_id] & {data["id"] for data in similar})
+            expected += len(exact[image_id])
+
+        latencies = np.array(latencies) * 1000
+        recall = found / expected if expected else 1.0
+        print(f"{'halfvec + rerank' if quantized else 'float32'}: recall@{find_n} {recall:.3f}, "
+              f"mean {latencies.mean():.1f} ms, p95 {np.percentile(latencies, 95):.1f} ms")
+
 if __name__ == "__main__":
     create_test_users_and_save_images(1, 100)
-    # benchmark_similar_images(100)
\ No newline at end of file
+    # benchmark_similar_images(100)
+    # benchmark_vector_index()
+    # benchmark_quantization()
\ No newline at end of file
@@ -0,0 +1,258 @@
+import io
+import os
+import time
+import uuid
+import argparse
+import multiprocessing
+from pathlib import Path
+from dataclasses import dataclass, replace
+from datetime import date, datetime
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from sqlalchemy.dialects.postgresql import insert
+from dotenv import load_dotenv
+from os import environ
+
+from .database import SessionLocal
+from .models import Image, User, Settings
+from .ann_index import ANN_INDEX_PATH, build_index
+from .storage import store_image
+from . import daily_stats
+
+load_dotenv()
+BULK_IMPORT_WORKERS = int(environ.get("BULK_IMPORT_WORKERS", os.cpu_count() or 1))
+BULK_IMPORT_BATCH = int(environ.get("BULK_IMPORT_BATCH", 500))
+
+# Пространство имен для детерминированных id: повторный импорт того же файла
+# дает тот же Image.id, и вставка после прерванного запуска не создает дублей
+IMPORT_NAMESPACE = uuid.UUID("5d0c6f1e-8a4b-4c1f-9a57-3f1c2b7e9d40")
+
+@dataclass(frozen=True)
+class ImportItem:
+    """Одно изображение для импорта.
+
+    source - путь к файлу либо ключ записи датасета, если содержимое
+    передается в data (закодированные байты изображения).
+    """
+    source: str
+    emotion: str
+    user_id: str
+    created_date: datetime
+    data: bytes | None = None
+
+    @property
+    def image_id(self) -> uuid.UUID:
+        return uuid.uuid5(IMPORT_NAMESPACE, self.source)
+
+def scan_folders(
+    folders,
+    n_users: int,
+    n_images_per_user: int,
+    root: str = "test_images",
+    user_prefix: str = "test_user"
+) -> list[ImportItem]:
+    """Изображения из root/<folder> (эмоция = имя папки), по n_images_per_user
+    на каждого из n_users тестовых пользователей."""
+    files = []
+    for folder in folders:
+        emotion_dir = Path(root) / folder
+        if not emotion_dir.exists():
+            continue
+        files.extend((str(path), folder) for path in sorted(emotion_dir.iterdir()) if path.is_file())
+
+    created_date = datetime.now()
+    return [
+        ImportItem(source, emotion, f"{user_prefix}{i // n_images_per_user}", created_date)
+        for i, (source, emotion) in enumerate(files[:n_users * n_images_per_user])
+    ]
+
+def _as_jpeg(data: bytes) -> bytes:
+    """Байты изображения в JPEG, перекодируются только не-JPEG."""
+    from PIL import Image as PILImage
+
+    with PILImage.open(io.BytesIO(data)) as photo:
+        if photo.format == "JPEG":
+            return data
+        output = io.BytesIO()
+        photo.convert("RGB").save(output, "JPEG", quality=95)
+        return output.getvalue()
+
+def _process(item: ImportItem) -> tuple[str, list | None, str]:
+    """Выполняется в рабочем процессе: эмбеддинг, запись в хранилище и миниатюры.
+
+    Returns:
+        tuple: (item.source, эмбеддинг или None, путь в хранилище или текст ошибки)
+    """
+    from src.emote_processor.face_embedding import get_face_embedding
+    from src.emote_processor.thumbnails import create_thumbnails
+
+    # Любая ошибка чтения, декодирования или записи пропускает только этот файл:
+    # он попадает в журнал как skip и не прерывает импорт
+    try:
+        data = Path(item.source).read_bytes() if item.data is None else _as_jpeg(item.data)
+        embedding = get_face_embedding(data)
+        target_path = store_image(data)
+    except Exception as e:
+        return item.source, None, str(e)
+
+    try:
+        create_thumbnails(target_path)
+    except OSError as e:
+        print(f"Error creating thumbnails for {target_path}: {e}")
+
+    return item.source, embedding, str(target_path)
+
+class Checkpoint:
+    """Журнал обработанных файлов: строка "<статус>\\t<путь>" на файл.
+
+    Записывается только после коммита пачки, поэтому при перезапуске
+    пропускаются лишь файлы, уже сохраненные в БД (или без лица).
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.done = set()
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as f:
+                self.done = {line.rstrip("\n").split("\t", 1)[1] for line in f if "\t" in line}
+        self.file = open(self.path, "a", encoding="utf-8")
+
+    def mark(self, entries):
+        for status, source in entries:
+            self.file.write(f"{status}\t{source}\n")
+            self.done.add(source)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+def _insert_batch(rows: list[tuple[ImportItem, list, str]]):
+    """Одна транзакция на пачку: пользователи, настройки и изображения
+    многострочными INSERT ... ON CONFLICT DO NOTHING."""
+    user_ids = sorted({item.user_id for item, _, _ in rows})
+
+    with SessionLocal() as session:
+        session.execute(
+            insert(User).values([{"user_id": user_id} for user_id in user_ids]).on_conflict_do_nothing()
+        )
+        session.execute(
+            insert(Settings).values([{"user_id": user_id} for user_id in user_ids]).on_conflict_do_nothing()
+        )
+        session.execute(
+            insert(Image).values([
+                {
+                    "id": item.image_id,
+                    "user_id": item.user_id,
+                    "emotion": item.emotion,
+                    "file_path": file_path,
+                    "embedding": embedding,
+                    "created_date": item.created_date,
+                }
+                for item, embedding, file_path in rows
+            ]).on_conflict_do_nothing(index_elements=[Image.id])
+        )
+        session.commit()
+
+def _results(executor, items, window: int):
+    """Результаты _process в порядке готовности, не больше window задач в полете.
+
+    Память ограничена окном: items читается лениво, байты изображения
+    освобождаются, как только задача выполнена.
+    """
+    items = iter(items)
+    pending = {}
+
+    while True:
+        for item in items:
+            pending[executor.submit(_process, item)] = replace(item, data=None)
+            if len(pending) >= window:
+                break
+
+        if not pending:
+            return
+
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            _, embedding, result = future.result()
+            yield pending.pop(future), embedding, result
+
+def import_images(
+    items,
+    checkpoint_path: str = "bulk_import.checkpoint",
+    workers: int = BULK_IMPORT_WORKERS,
+    batch_size: int = BULK_IMPORT_BATCH,
+):
+    """Параллельный импорт изображений с возобновлением после прерывания.
+
+    items может быть ленивым итератором (например, потоком из Parquet).
+    Эмбеддинги, запись в хранилище и миниатюры считаются в пуле процессов,
+    строки вставляются пачками по batch_size. После импорта пересчитывается
+    дневная статистика затронутых дней и перестраивается ANN индекс.
+    """
+    checkpoint = Checkpoint(checkpoint_path)
+    print(f"{len(checkpoint.done)} images already imported")
+    todo = (item for item in items if item.source not in checkpoint.done)
+
+    imported = failed = 0
+    days: set[date] = set()
+    rows, entries = [], []
+    start_time = time.perf_counter()
+
+    def flush():
+        nonlocal imported
+        if rows:
+            _insert_batch(rows)
+            imported += len(rows)
+            days.update(item.created_date.date() for item, _, _ in rows)
+        checkpoint.mark(entries)
+        rows.clear()
+        entries.clear()
+
+        elapsed = time.perf_counter() - start_time
+        print(f"Imported {imported}, no face {failed}, {(imported + failed) / elapsed:.1f} images/sec")
+
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        for item, embedding, result in _results(executor, todo, window=workers * 4):
+            if embedding is None:
+                failed += 1
+                entries.append(("skip", item.source))
+                print(f"Skipped {item.source}: {result}")
+            else:
+                rows.append((item, embedding, result))
+                entries.append(("ok", item.source))
+
+            if len(entries) >= batch_size:
+                flush()
+        flush()
+    finally:
+        executor.shutdown(cancel_futures=True)
+        checkpoint.close()
+
+    for day in sorted(days):
+        daily_stats.rebuild_day(day)
+
+    if ANN_INDEX_PATH and imported:
+        build_index()
+
+    elapsed = time.perf_counter() - start_time
+    print(f"Done: {imported} imported, {failed} without face in {elapsed:.1f} s "
+          f"({(imported + failed) / elapsed if elapsed else 0:.1f} images/sec)")
+
+if __name__ == "__main__":
+    # python -m src.database.bulk_import actors --users 50 --per-user 50
+    parser = argparse.ArgumentParser(description="Bulk import of test faces")
+    parser.add_argument("folders", nargs="+", help="Folders inside --root, folder name is used as emotion")
+    parser.add_argument("--root", default="test_images")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--per-user", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=BULK_IMPORT_WORKERS)
+    parser.add_argument("--batch-size", type=int, default=BULK_IMPORT_BATCH)
+    parser.add_argument("--checkpoint", default="bulk_import.checkpoint")
+    args = parser.parse_args()
+
+    from .database import init_db
+    init_db()
+
+    items = scan_folders(args.folders, args.users, args.per_user, root=args.root)
+    import_images(items, args.checkpoint, workers=args.workers, batch_size=args.batch_size)
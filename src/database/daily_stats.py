@@ -0,0 +1,100 @@
+import sys
+import time
+import threading
+from datetime import date, datetime, timedelta
+from sqlalchemy import select, delete, func, literal
+from sqlalchemy.dialects.postgresql import insert
+
+from .database import SessionLocal
+from .models import Image, DailyParticipant, DailyStats
+
+ALL_EMOTIONS = ""
+CACHE_TTL = 5  # секунд, чтобы подхватывать записи других процессов
+
+_cache: dict[tuple[date, str], tuple[int, float]] = {}
+_cache_lock = threading.Lock()
+
+def record_participation(session, user_id: str, emotion: str, day: date):
+    """Учитывает загрузку в дневной статистике в транзакции вызывающего.
+
+    Счетчик увеличивается только если пользователь еще не участвовал
+    в этом дне (в целом и с этой эмоцией).
+    """
+    for key in (ALL_EMOTIONS, emotion):
+        inserted = session.execute(
+            insert(DailyParticipant)
+            .values(day=day, emotion=key, user_id=str(user_id))
+            .on_conflict_do_nothing()
+        ).rowcount
+
+        if inserted:
+            session.execute(
+                insert(DailyStats)
+                .values(day=day, emotion=key, user_count=1)
+                .on_conflict_do_update(
+                    index_elements=[DailyStats.day, DailyStats.emotion],
+                    set_={"user_count": DailyStats.user_count + 1}
+                )
+            )
+
+def invalidate(day: date, emotion: str | None = None):
+    """Сбрасывает кэш счетчиков дня после коммита."""
+    with _cache_lock:
+        _cache.pop((day, ALL_EMOTIONS), None)
+        if emotion:
+            _cache.pop((day, emotion), None)
+
+def get_user_count(day: date, emotion: str | None = None) -> int:
+    """Число уникальных пользователей за день, опционально с данной эмоцией."""
+    key = (day, emotion or ALL_EMOTIONS)
+
+    with _cache_lock:
+        cached = _cache.get(key)
+    if cached is not None and time.monotonic() - cached[1] < CACHE_TTL:
+        return cached[0]
+
+    with SessionLocal() as session:
+        stats = session.get(DailyStats, key)
+        count = stats.user_count if stats else 0
+
+    with _cache_lock:
+        _cache[key] = (count, time.monotonic())
+    return count
+
+def rebuild_day(day: date):
+    """Пересчитывает статистику дня по таблице images."""
+    day_start = datetime.combine(day, datetime.min.time())
+    day_filter = [Image.created_date >= day_start, Image.created_date < day_start + timedelta(days=1)]
+
+    with SessionLocal() as session:
+        session.execute(delete(DailyStats).where(DailyStats.day == day))
+        session.execute(delete(DailyParticipant).where(DailyParticipant.day == day))
+
+        columns = [DailyParticipant.day, DailyParticipant.emotion, DailyParticipant.user_id]
+        session.execute(insert(DailyParticipant).from_select(
+            columns,
+            select(literal(day), literal(ALL_EMOTIONS), Image.user_id).where(*day_filter).distinct()
+        ))
+        session.execute(insert(DailyParticipant).from_select(
+            columns,
+            select(literal(day), Image.emotion, Image.user_id).where(*day_filter).distinct()
+        ))
+
+        session.execute(insert(DailyStats).from_select(
+            [DailyStats.day, DailyStats.emotion, DailyStats.user_count],
+            select(DailyParticipant.day, DailyParticipant.emotion, func.count())
+            .where(DailyParticipant.day == day)
+            .group_by(DailyParticipant.day, DailyParticipant.emotion)
+        ))
+        session.commit()
+
+    with _cache_lock:
+        for key in [key for key in _cache if key[0] == day]:
+            _cache.pop(key)
+
+if __name__ == "__main__":
+    # python -m src.database.daily_stats [YYYY-MM-DD ...]
+    days = [date.fromisoformat(arg) for arg in sys.argv[1:]] or [date.today()]
+    for day in days:
+        rebuild_day(day)
+        print(f"Rebuilt stats for {day}: {get_user_count(day)} users")
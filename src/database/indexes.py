@@ -0,0 +1,183 @@
+import re
+import threading
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex
+from dotenv import load_dotenv
+from os import environ
+
+from .database import engine, Base
+from . import models  # Регистрирует таблицы в Base.metadata
+
+load_dotenv()
+VECTOR_INDEX = environ.get("VECTOR_INDEX", "hnsw")  # hnsw | ivfflat | none
+HNSW_M = int(environ.get("HNSW_M", 16))
+HNSW_EF_CONSTRUCTION = int(environ.get("HNSW_EF_CONSTRUCTION", 64))
+IVFFLAT_LISTS = int(environ.get("IVFFLAT_LISTS", 100))
+INDEX_MAINTENANCE_WORK_MEM = environ.get("INDEX_MAINTENANCE_WORK_MEM")  # например "1GB"
+# halfvec - индекс по половинной точности (pgvector >= 0.7), поиск с дорасчетом по полной
+EMBEDDING_QUANTIZATION = environ.get("EMBEDDING_QUANTIZATION", "none")  # none | halfvec
+RERANK_FACTOR = int(environ.get("RERANK_FACTOR", 4))  # кандидатов на каждый результат для дорасчета
+
+PROGRESS_INTERVAL = 5
+
+VECTOR_INDEXES = {
+    "hnsw": ("ix_images_embedding_hnsw", {"m": HNSW_M, "ef_construction": HNSW_EF_CONSTRUCTION}),
+    "ivfflat": ("ix_images_embedding_ivfflat", {"lists": IVFFLAT_LISTS}),
+}
+
+# Квантизация: (суффикс имени индекса, индексируемое выражение, класс операторов)
+QUANTIZATIONS = {
+    "none": ("", "embedding", "vector_cosine_ops"),
+    "halfvec": ("_halfvec", "(embedding::halfvec(128))", "halfvec_cosine_ops"),
+}
+
+def vector_index_name(method: str, quantization: str = EMBEDDING_QUANTIZATION) -> str:
+    return VECTOR_INDEXES[method][0] + QUANTIZATIONS[quantization][0]
+
+_vector_version: tuple[int, ...] | None = None
+
+def vector_extension_version() -> tuple[int, ...]:
+    """Версия расширения pgvector в БД, например (0, 8, 0)."""
+    global _vector_version
+
+    if _vector_version is None:
+        with engine.connect() as conn:
+            version = conn.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar()
+        _vector_version = tuple(int(part) for part in (version or "0").split("."))
+    return _vector_version
+
+def _existing_indexes(conn, table: str) -> dict[str, tuple[str, bool]]:
+    """Возвращает индексы таблицы: имя -> (определение, валиден ли индекс)."""
+    rows = conn.execute(text("""
+        SELECT c.relname, pg_get_indexdef(i.indexrelid), i.indisvalid
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        JOIN pg_class t ON t.oid = i.indrelid
+        WHERE t.relname = :table
+    """), {"table": table})
+    return {name: (definition, valid) for name, definition, valid in rows}
+
+def _index_ddl(index, dialect) -> str:
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS для индекса модели.
+
+    DDL генерирует SQLAlchemy, поэтому сохраняются частичные индексы
+    (postgresql_where), выражения и UNIQUE.
+    """
+    ddl = str(CreateIndex(index, if_not_exists=True).compile(dialect=dialect))
+    return re.sub(r"^CREATE (UNIQUE )?INDEX", r"CREATE \1INDEX CONCURRENTLY", ddl)
+
+def _is_partial(index) -> bool:
+    return index.dialect_options["postgresql"]["where"] is not None
+
+def _report_progress(stop: threading.Event, name: str, table: str):
+    """Периодически печатает прогресс CREATE INDEX из pg_stat_progress_create_index."""
+    with engine.connect() as conn:
+        while not stop.wait(PROGRESS_INTERVAL):
+            row = conn.execute(text("""
+                SELECT phase, blocks_done, blocks_total, tuples_done, tuples_total
+                FROM pg_stat_progress_create_index
+                WHERE relid = CAST(:table AS regclass)
+            """), {"table": table}).first()
+            conn.rollback()
+
+            if row is None:
+                continue
+
+            phase, blocks_done, blocks_total, tuples_done, tuples_total = row
+            if tuples_total:
+                done = f"{tuples_done}/{tuples_total} tuples"
+            else:
+                done = f"{blocks_done}/{blocks_total} blocks"
+            print(f"Building {name}: {phase}, {done}")
+
+def _create_index(conn, name: str, table: str, sql: str):
+    stop = threading.Event()
+    reporter = threading.Thread(target=_report_progress, args=(stop, name, table), daemon=True)
+
+    print(f"Creating index {name}")
+    reporter.start()
+    try:
+        conn.execute(text(sql))
+    finally:
+        stop.set()
+        reporter.join()
+    print(f"Index {name} is ready")
+
+def ensure_columns():
+    """Добавляет в существующие таблицы новые nullable колонки моделей
+    (create_all создает только отсутствующие таблицы)."""
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+
+                column_type = column.type.compile(dialect=conn.dialect)
+                print(f"Adding column {table.name}.{column.name}")
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN IF NOT EXISTS {column.name} {column_type}"))
+
+def ensure_indexes(vector_index: str = VECTOR_INDEX, quantization: str = EMBEDDING_QUANTIZATION):
+    """Идемпотентно создает и мигрирует индексы таблицы images.
+
+    B-tree индексы берутся из метаданных моделей. Векторный индекс
+    (hnsw, ivfflat или none) пересоздается, если сменился метод, квантизация
+    или параметры, а также если предыдущая сборка оборвалась и оставила
+    невалидный индекс. Индексы строятся CONCURRENTLY, чтобы не блокировать запись.
+    """
+    if vector_index not in VECTOR_INDEXES and vector_index != "none":
+        raise ValueError(f"Unknown vector index type: {vector_index}")
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown embedding quantization: {quantization}")
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if INDEX_MAINTENANCE_WORK_MEM:
+            conn.execute(text(f"SET maintenance_work_mem = '{INDEX_MAINTENANCE_WORK_MEM}'"))
+
+        for table in Base.metadata.sorted_tables:
+            existing = _existing_indexes(conn, table.name)
+
+            for index in table.indexes:
+                definition, valid = existing.get(index.name, (None, True))
+                # Частичный индекс, ранее созданный полным, пересоздается
+                outdated = definition is not None and _is_partial(index) != (" WHERE " in definition)
+                if not valid or outdated:
+                    conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index.name}"))
+                if definition is None or not valid or outdated:
+                    _create_index(conn, index.name, table.name, _index_ddl(index, conn.dialect))
+
+        existing = _existing_indexes(conn, "images")
+
+        for method, (_, options) in VECTOR_INDEXES.items():
+            for kind in QUANTIZATIONS:
+                name = vector_index_name(method, kind)
+                if name not in existing:
+                    continue
+
+                definition, valid = existing[name]
+                up_to_date = valid and method == vector_index and kind == quantization and all(
+                    f"{key}='{value}'" in definition for key, value in options.items()
+                )
+                if not up_to_date:
+                    print(f"Dropping outdated index {name}")
+                    conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+                    existing.pop(name)
+
+        if vector_index != "none":
+            name = vector_index_name(vector_index, quantization)
+            _, expression, opclass = QUANTIZATIONS[quantization]
+            if name not in existing:
+                with_clause = ", ".join(f"{key} = {value}" for key, value in VECTOR_INDEXES[vector_index][1].items())
+                _create_index(conn, name, "images", (
+                    f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON images "
+                    f"USING {vector_index} ({expression} {opclass}) WITH ({with_clause})"
+                ))
+
+if __name__ == "__main__":
+    ensure_columns()
+    ensure_indexes()
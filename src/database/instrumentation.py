@@ -0,0 +1,95 @@
+import time
+import inspect
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from sqlalchemy import event
+
+from .database import engine
+from ..metrics import SQL_SECONDS
+
+@dataclass
+class QueryStats:
+    """Запросы, выполненные в рамках одного вызова обработчика."""
+    count: int = 0
+    duration: float = 0.0
+    statements: list = field(default_factory=list)
+
+_current: ContextVar[QueryStats | None] = ContextVar("query_stats", default=None)
+
+def _statement_kind(statement: str) -> str:
+    """Первое слово запроса (SELECT, INSERT, ...) - метка без неограниченного числа значений."""
+    words = statement.lstrip().split(None, 1)
+    return words[0].upper() if words else "EMPTY"
+
+@event.listens_for(engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+@event.listens_for(engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    SQL_SECONDS.observe(elapsed, statement=_statement_kind(statement))
+
+    stats = _current.get()
+    if stats is not None:
+        stats.count += 1
+        stats.duration += elapsed
+        stats.statements.append(statement)
+
+@contextmanager
+def track_queries():
+    """Считает запросы внутри блока, включая вызовы через asyncio.to_thread
+    (они копируют контекст и пишут в тот же объект QueryStats)."""
+    stats = QueryStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+def _report(name: str, stats: QueryStats, max_queries: int):
+    if stats.count > max_queries:
+        print(f"Query budget exceeded in {name}: {stats.count} queries "
+              f"(budget {max_queries}), {stats.duration * 1000:.1f} ms in SQL")
+
+def query_budget(max_queries: int):
+    """Декоратор обработчика: логирует вызовы, превысившие max_queries запросов."""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with track_queries() as stats:
+                    try:
+                        return await func(*args, **kwargs)
+                    finally:
+                        _report(func.__name__, stats, max_queries)
+            async_wrapper.max_queries = max_queries
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with track_queries() as stats:
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    _report(func.__name__, stats, max_queries)
+        wrapper.max_queries = max_queries
+        return wrapper
+    return decorator
+
+@contextmanager
+def assert_max_queries(max_queries: int):
+    """Для тестов: падает, если в блоке выполнено больше max_queries запросов.
+
+    Пример:
+        with assert_max_queries(handle_settings.max_queries):
+            handle_settings(message)
+    """
+    with track_queries() as stats:
+        yield stats
+
+    if stats.count > max_queries:
+        statements = "\n".join(stats.statements)
+        raise AssertionError(f"Expected at most {max_queries} queries, got {stats.count}:\n{statements}")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, Boolean, ForeignKey, text, Time
+from sqlalchemy import Column, String, DateTime, Date, Integer, BigInteger, Float, Text, Boolean, ForeignKey, Index, text, Time
 from datetime import time
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import UUID
@@ -22,12 +22,19 @@ class Image(Base):
     
     user = relationship("User", back_populates="images")
 
+    __table_args__ = (
+        Index("ix_images_created_date", "created_date"),
+        Index("ix_images_user_id_created_date", "user_id", "created_date"),
+        Index("ix_images_emotion", "emotion"),
+    )
+
 class User(Base):
     __tablename__ = 'users'
     user_id = Column(
         String(128),
         primary_key=True,
     )
+    username = Column(String(64), nullable=True)
     images = relationship("Image", back_populates="user")
     settings = relationship("Settings", uselist=False, back_populates="user")
 
@@ -37,4 +44,56 @@ class Settings(Base):
     ai_enabled = Column(Boolean, default=True)
     reminder_time = Column(Time, default=time(20, 0))
     search_allowed = Column(Boolean, default=True)
-    user = relationship("User", back_populates="settings")
\ No newline at end of file
+    user = relationship("User", back_populates="settings")
+
+    __table_args__ = (
+        Index("ix_settings_reminder_time", "reminder_time"),
+    )
+
+class DailyParticipant(Base):
+    """Факт участия пользователя в дне (emotion = '' - в целом за день)."""
+    __tablename__ = 'daily_participants'
+    day = Column(Date, primary_key=True)
+    emotion = Column(String(50), primary_key=True)
+    user_id = Column(String(128), ForeignKey('users.user_id'), primary_key=True)
+
+class DailyStats(Base):
+    """Число уникальных пользователей за день (emotion = '' - в целом за день)."""
+    __tablename__ = 'daily_stats'
+    day = Column(Date, primary_key=True)
+    emotion = Column(String(50), primary_key=True)
+    user_count = Column(Integer, nullable=False, default=0)
+
+class PhotoJob(Base):
+    """Задача анализа фото для воркеров photo_worker.
+
+    status: queued -> running -> done или failed. Для running available_at -
+    конец аренды воркером, после которого задачу может забрать другой воркер;
+    для queued - время следующей попытки.
+    """
+    __tablename__ = 'photo_jobs'
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    user_id = Column(String(128), nullable=False)
+    photo_path = Column(String(255), nullable=False)
+    content_hash = Column(String(64), nullable=False)
+    status = Column(String(16), nullable=False, default="queued")
+    attempts = Column(Integer, nullable=False, default=0)
+    available_at = Column(DateTime, nullable=False, server_default=text("LOCALTIMESTAMP"))
+    locked_by = Column(String(64), nullable=True)
+    last_error = Column(String(255), nullable=True)
+    emotion = Column(String(50), nullable=True)
+    embedding = Column(Vector(128), nullable=True)
+    created_date = Column(DateTime, nullable=False, server_default=text("CURRENT_TIMESTAMP"))
+
+    __table_args__ = (
+        Index("ix_photo_jobs_pending", "available_at", postgresql_where=text("status IN ('queued', 'running')")),
+        Index("ix_photo_jobs_user_id_id", "user_id", "id", postgresql_where=text("status IN ('queued', 'running')")),
+    )
+
+class ConversationState(Base):
+    """Следующий шаг диалога чата для SqlConversationStore (args - JSON)."""
+    __tablename__ = 'conversation_states'
+    chat_id = Column(String(128), primary_key=True)
+    step = Column(String(64), nullable=False)
+    args = Column(Text, nullable=False)
+    expires = Column(Float, nullable=False)
@@ -1,9 +1,70 @@
-from datasets import load_dataset
-from PIL import Image
 import io
+from pathlib import Path
+from datetime import datetime
+from PIL import Image
+
+PARQUET_BATCH_SIZE = 64  # строк на пачку Arrow, память не зависит от размера датасета
+
+def export_images(dataset_path: str = 'dataset', output_dir: str = 'celeb_images'):
+    from datasets import load_dataset  # Тяжелый импорт, нужен только здесь
+
+    dataset = load_dataset(dataset_path)
+    for i, example in enumerate(dataset['train']):
+        image_bytes = example['image']['bytes']
+        image = Image.open(io.BytesIO(image_bytes))
+        image.save(f"{output_dir}/{i}.png")
+
+def parquet_files(dataset_path: str) -> list[Path]:
+    """Файл .parquet или все .parquet внутри каталога датасета."""
+    path = Path(dataset_path)
+    return [path] if path.is_file() else sorted(path.rglob("*.parquet"))
+
+def iter_images(dataset_path: str = 'dataset', batch_size: int = PARQUET_BATCH_SIZE):
+    """Потоково читает байты изображений из колонки image, пачка за пачкой.
+
+    Yields:
+        tuple: (ключ записи "<файл>#<номер строки>", закодированные байты изображения)
+    """
+    import pyarrow.parquet as pq
+
+    for path in parquet_files(dataset_path):
+        row = 0
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size, columns=["image"]):
+            for image_bytes in batch.column("image").field("bytes").to_pylist():
+                if image_bytes:
+                    yield f"{path}#{row}", image_bytes
+                row += 1
+
+def stream_items(
+    dataset_path: str = 'dataset',
+    emotion: str = 'neutral',
+    n_images_per_user: int = 50,
+    user_prefix: str = "celeb_user",
+    limit: int | None = None,
+):
+    """ImportItem для bulk импорта прямо из Parquet, без промежуточных файлов.
+
+    Байты не декодируются здесь: битая ячейка разбирается в рабочем процессе
+    импорта и попадает в журнал как skip, не прерывая поток.
+    """
+    from .bulk_import import ImportItem
+
+    created_date = datetime.now()
+    for i, (key, image_bytes) in enumerate(iter_images(dataset_path)):
+        if limit is not None and i >= limit:
+            return
+        yield ImportItem(key, emotion, f"{user_prefix}{i // n_images_per_user}", created_date, data=image_bytes)
+
+def ingest(dataset_path: str = 'dataset', **kwargs):
+    """Импортирует датасет в БД потоком: эмбеддинги и вставка пачками."""
+    from .bulk_import import import_images
+
+    import_images(stream_items(dataset_path, **kwargs), checkpoint_path="parquet_import.checkpoint")
+
+if __name__ == "__main__":
+    # python -m src.database.parquet [путь к датасету]
+    import sys
+    from .database import init_db
 
-dataset = load_dataset('dataset')
-for i, example in enumerate(dataset['train']):
-    image_bytes = example['image']['bytes']
-    image = Image.open(io.BytesIO(image_bytes))
-    image.save(f"celeb_images/{i}.png")
+    init_db()
+    ingest(sys.argv[1] if len(sys.argv) > 1 else 'dataset')
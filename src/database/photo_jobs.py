@@ -0,0 +1,155 @@
+from dataclasses import dataclass
+from datetime import timedelta
+from sqlalchemy import select, update, delete, exists, func
+from sqlalchemy.orm import aliased
+from dotenv import load_dotenv
+from os import environ
+
+from .database import SessionLocal
+from .models import PhotoJob
+
+load_dotenv()
+PHOTO_QUEUE = environ.get("PHOTO_QUEUE", "0") == "1"  # 1 - анализ фото в воркерах photo_worker
+PHOTO_JOB_VISIBILITY = float(environ.get("PHOTO_JOB_VISIBILITY", 300))  # секунды аренды задачи воркером
+PHOTO_JOB_MAX_ATTEMPTS = int(environ.get("PHOTO_JOB_MAX_ATTEMPTS", 5))
+PHOTO_JOB_RETRY_DELAY = float(environ.get("PHOTO_JOB_RETRY_DELAY", 5))  # секунды, удваивается с каждой попыткой
+# Секунды хранения завершенных задач: confirm_job читает результат, пока жив шаг диалога,
+# поэтому значение должно быть больше CONVERSATION_TTL
+PHOTO_JOB_RETENTION = float(environ.get("PHOTO_JOB_RETENTION", 7 * 24 * 60 * 60))
+
+PENDING = ("queued", "running")
+
+@dataclass(frozen=True)
+class JobSnapshot:
+    """Копия строки photo_jobs, не привязанная к сессии."""
+    id: int
+    user_id: str
+    photo_path: str
+    content_hash: str
+    status: str
+    attempts: int
+    emotion: str | None
+    embedding: list | None
+
+def _snapshot(job: PhotoJob) -> JobSnapshot:
+    return JobSnapshot(
+        id=job.id,
+        user_id=job.user_id,
+        photo_path=job.photo_path,
+        content_hash=job.content_hash,
+        status=job.status,
+        attempts=job.attempts,
+        emotion=job.emotion,
+        embedding=[float(value) for value in job.embedding] if job.embedding is not None else None
+    )
+
+def enqueue_photo(user_id, photo_path: str, content_hash: str) -> int:
+    """Ставит фото в очередь анализа. Returns: id задачи"""
+    with SessionLocal() as session:
+        job = PhotoJob(user_id=str(user_id), photo_path=photo_path, content_hash=content_hash)
+        session.add(job)
+        session.commit()
+        return job.id
+
+def claim_job(
+    worker_id: str,
+    visibility: float = PHOTO_JOB_VISIBILITY,
+    max_attempts: int = PHOTO_JOB_MAX_ATTEMPTS
+) -> JobSnapshot | None:
+    """Забирает самую старую доступную задачу и берет ее в аренду на visibility секунд.
+
+    Задача пользователя доступна, только если у него нет более ранних
+    незавершенных задач: фото одного пользователя обрабатываются по порядку.
+    Задача running с истекшей арендой (воркер упал) забирается снова, а если
+    попытки исчерпаны - помечается failed и возвращается со статусом failed,
+    чтобы воркер сообщил пользователю. Иначе такая задача повторялась бы
+    бесконечно и блокировала следующие фото пользователя.
+    Параллельные воркеры не ждут друг друга благодаря SKIP LOCKED.
+    """
+    earlier = aliased(PhotoJob)
+    blocked = exists().where(
+        earlier.user_id == PhotoJob.user_id,
+        earlier.id < PhotoJob.id,
+        earlier.status.in_(PENDING)
+    )
+
+    with SessionLocal() as session:
+        job = session.execute(
+            select(PhotoJob)
+            .where(PhotoJob.status.in_(PENDING), PhotoJob.available_at <= func.localtimestamp(), ~blocked)
+            .order_by(PhotoJob.id)
+            .limit(1)
+            .with_for_update(skip_locked=True, of=PhotoJob)
+        ).scalar_one_or_none()
+
+        if job is None:
+            return None
+
+        if job.status == "running" and job.attempts >= max_attempts:
+            job.status = "failed"
+            job.locked_by = None
+            job.last_error = f"Lease expired after {job.attempts} attempts"
+            session.commit()
+            session.refresh(job)
+            return _snapshot(job)
+
+        job.status = "running"
+        job.attempts += 1
+        job.locked_by = worker_id
+        job.available_at = func.localtimestamp() + timedelta(seconds=visibility)
+        session.commit()
+        session.refresh(job)
+        return _snapshot(job)
+
+def _finish(job_id: int, worker_id: str, **values) -> bool:
+    """Обновляет задачу, если она все еще арендована этим воркером."""
+    with SessionLocal() as session:
+        result = session.execute(
+            update(PhotoJob)
+            .where(PhotoJob.id == job_id, PhotoJob.status == "running", PhotoJob.locked_by == worker_id)
+            .values(locked_by=None, **values)
+        )
+        session.commit()
+    return result.rowcount == 1
+
+def complete_job(job_id: int, worker_id: str, emotion: str | None, embedding: list | None) -> bool:
+    """Сохраняет результат анализа (emotion=None - лицо не найдено)."""
+    return _finish(job_id, worker_id, status="done", emotion=emotion, embedding=embedding)
+
+def fail_job(job: JobSnapshot, worker_id: str, error: str, max_attempts: int = PHOTO_JOB_MAX_ATTEMPTS) -> bool:
+    """Возвращает задачу в очередь с экспоненциальной задержкой или помечает failed.
+
+    Returns:
+        bool: True, если попытки исчерпаны и задача больше не будет выполняться
+    """
+    if job.attempts >= max_attempts:
+        _finish(job.id, worker_id, status="failed", last_error=error[:255])
+        return True
+
+    delay = timedelta(seconds=PHOTO_JOB_RETRY_DELAY * 2 ** (job.attempts - 1))
+    _finish(job.id, worker_id, status="queued", last_error=error[:255], available_at=func.localtimestamp() + delay)
+    return False
+
+def get_job(job_id: int) -> JobSnapshot | None:
+    with SessionLocal() as session:
+        job = session.get(PhotoJob, job_id)
+        return _snapshot(job) if job is not None else None
+
+def purge_finished_jobs(retention: float = PHOTO_JOB_RETENTION) -> int:
+    """Удаляет задачи done и failed старше retention секунд. Returns: число удаленных"""
+    with SessionLocal() as session:
+        result = session.execute(
+            delete(PhotoJob)
+            .where(PhotoJob.status.in_(("done", "failed")),
+                   PhotoJob.created_date < func.localtimestamp() - timedelta(seconds=retention))
+        )
+        session.commit()
+
+    if result.rowcount:
+        print(f"Removed {result.rowcount} finished photo jobs")
+    return result.rowcount
+
+def queue_depth() -> int:
+    """Число незавершенных задач (ожидающих и выполняющихся)."""
+    with SessionLocal() as session:
+        return session.scalar(select(func.count()).select_from(PhotoJob).where(PhotoJob.status.in_(PENDING)))
@@ -1,34 +1,44 @@
 import uuid
-import shutil
-from pathlib import Path
-from sqlalchemy import and_, true
-from datetime import datetime
+from sqlalchemy import and_, func, true, text, cast, select
+from pgvector.sqlalchemy import HALFVEC
+from sqlalchemy.dialects.postgresql import insert
+from datetime import date, datetime
 from .models import Image, User, Settings
 from ..emote_processor.face_embedding import get_face_embedding
+from ..emote_processor.thumbnails import create_thumbnails, thumbnail_path, THUMBNAILS
 from .database import SessionLocal
+from .storage import store_image, store_file
+from .ann_index import get_index, EMBEDDING_DIM
+from .indexes import EMBEDDING_QUANTIZATION, RERANK_FACTOR, VECTOR_INDEX, vector_extension_version
+from . import daily_stats
+from ..metrics import stage_timer, timed
 
 def save_image(
-    image_path: str,
+    image: str | bytes,
     emotion: str,
     user_id: str,
     created_date: datetime | None = None,
-) -> str:
-    # Генерация UUID и путей
+    embedding: list | None = None,
+) -> tuple[str, str]:
+    """Сохраняет фото (байты, путь в хранилище или любой файл) и запись о нем.
+
+    Файл пишется в контентно-адресуемое хранилище один раз, одинаковые
+    загрузки ссылаются на один и тот же объект.
+
+    Returns:
+        tuple: (id изображения, путь файла в хранилище)
+    """
+    # Получение эмбеддинга (если не посчитан заранее в analyze_face)
+    if embedding is None:
+        with stage_timer("save_image", "embedding"):
+            embedding = get_face_embedding(image)
+
     image_uuid = uuid.uuid4()
-    target_dir = Path("images")
-    target_dir.mkdir(exist_ok=True)
-    target_path = target_dir / f"{image_uuid}.jpg"
-    shutil.copy(image_path, target_path)
-    
-    # Получение эмбеддинга
-    try:
-        embedding = get_face_embedding(image_path)
-    except Exception as e:
-        target_path.unlink()
-        raise e
+    with stage_timer("save_image", "store"):
+        target_path = store_image(image) if isinstance(image, bytes) else store_file(image)
     
     # Сохранение в БД
-    with SessionLocal() as session:
+    with stage_timer("save_image", "db_insert"), SessionLocal() as session:
         if created_date is None:
             created_date = datetime.now()
 
@@ -42,60 +52,226 @@ def save_image(
         )
 
         session.add(image)
+        daily_stats.record_participation(session, user_id, emotion, created_date.date())
         session.commit()
+
+    daily_stats.invalidate(created_date.date(), emotion)
+
+    # Производные для календаря и коллажа, чтобы не декодировать оригинал при каждом запросе
+    try:
+        kinds = tuple(kind for kind in THUMBNAILS if not thumbnail_path(target_path, kind).exists())
+        if kinds:
+            with stage_timer("save_image", "thumbnails"):
+                create_thumbnails(target_path, kinds)
+    except OSError as e:
+        print(f"Error creating thumbnails for {target_path}: {e}")
+
+    index = get_index()
+    if index is not None:
+        with stage_timer("save_image", "ann_index"):
+            index.add(image_uuid, user_id, emotion, created_date, embedding)
     
-    return str(image_uuid)
+    return str(image_uuid), str(target_path)
+
+def register_user(user_id):
+    """Создает пользователя с настройками по умолчанию, если его еще нет."""
+    with SessionLocal() as session:
+        session.execute(insert(User).values(user_id=str(user_id)).on_conflict_do_nothing())
+        session.execute(insert(Settings).values(user_id=str(user_id)).on_conflict_do_nothing())
+        session.commit()
+
+def get_latest_image_id(user_id):
+    """Id последнего изображения пользователя или None, если изображений нет."""
+    with SessionLocal() as session:
+        return (session.query(Image.id)
+            .filter(Image.user_id == str(user_id))
+            .order_by(Image.created_date.desc())
+            .limit(1)
+            .scalar()
+        ) # LIMIT 1 по индексу (user_id, created_date)
 
-def get_user_data(user_id):
+def get_user_data(user_id, start: datetime | None = None, end: datetime | None = None):
+    """Изображения пользователя за период [start, end) в хронологическом порядке."""
     with SessionLocal() as session:        
-        query = session.query(Image).filter(Image.user_id == user_id)
+        query = (session.query(Image.file_path, Image.emotion, Image.created_date)
+            .filter(*_history_filters(user_id, start, end))
+            .order_by(Image.created_date)
+        )
         
         return [{
-            "image_path": img.file_path,
-            "emotion": img.emotion,
-            "created_at": img.created_date
-        } for img in query]
+            "image_path": file_path,
+            "emotion": emotion,
+            "created_at": created_date
+        } for file_path, emotion, created_date in query]
+
+def get_first_entries_per_day(user_id, start: datetime | None = None, end: datetime | None = None):
+    """Первое изображение пользователя за каждый день периода [start, end)."""
+    day = func.date_trunc('day', Image.created_date)
+
+    with SessionLocal() as session:
+        query = (session.query(Image.file_path, Image.emotion, Image.created_date)
+            .filter(*_history_filters(user_id, start, end))
+            .distinct(day)
+            .order_by(day, Image.created_date)
+        ) # DISTINCT ON по дню, индекс (user_id, created_date) ограничивает период
+
+        return [{
+            "image_path": file_path,
+            "emotion": emotion,
+            "created_at": created_date
+        } for file_path, emotion, created_date in query]
+
+def get_month_entries(user_id, year: int, month: int) -> dict:
+    """Первое изображение за каждый день месяца: {день месяца: запись}."""
+    start = datetime(year, month, 1)
+    end = datetime(year + month // 12, month % 12 + 1, 1)
+    return {entry["created_at"].day: entry for entry in get_first_entries_per_day(user_id, start, end)}
+
+def _history_filters(user_id, start: datetime | None, end: datetime | None) -> list:
+    filters = [Image.user_id == str(user_id)]
+    if start is not None:
+        filters.append(Image.created_date >= start)
+    if end is not None:
+        filters.append(Image.created_date < end)
+    return filters
     
+@timed("get_users")
 def get_users(emotion = None):
-    today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    
-    with SessionLocal() as session:
-        query = session.query(Image).filter(
-            Image.created_date >= today_start
-        )
-        
-        if emotion:
-            query = query.filter(Image.emotion == emotion)
-        
-        unique_user_count = len(set(img.user_id for img in query)) # query.scalar() doesnt work for some reason, will fix later
-        return unique_user_count
+    return daily_stats.get_user_count(date.today(), emotion)
 
+@timed("find_similar_images")
 def find_similar_images(
     image_id: str,
     find_n: int = 5,
     same_emotion: bool = False,
     ignore_original_user: bool = True,
-    all_time = False
+    all_time = False,
+    ef_search: int | None = None,
+    probes: int | None = None,
+    exact: bool = False,
+    quantized: bool | None = None
 ) -> list:
+    """Ищет похожие лица по косинусному расстоянию эмбеддингов.
+
+    ef_search и probes задают hnsw.ef_search / ivfflat.probes для этого запроса,
+    exact отключает векторный индекс. Если задан любой из них, запрос всегда
+    идет в Postgres, минуя ANN индекс процесса.
+
+    quantized (по умолчанию - при EMBEDDING_QUANTIZATION=halfvec) ищет
+    find_n * RERANK_FACTOR кандидатов по halfvec индексу и упорядочивает
+    их по полноточным эмбеддингам.
+
+    Фильтры (сегодня, та же эмоция) применяются к ef_search ближайшим из
+    индекса за все время, поэтому на большой таблице результат может
+    оказаться коротким. С pgvector >= 0.8 включается итеративный обход HNSW.
+    Если результатов все равно меньше find_n, а подходящих строк по дешевому
+    подсчету больше, запрос повторяется точным поиском (кроме явно заданных
+    ef_search / probes / exact, нужных бенчмаркам).
+    """
+    if quantized is None:
+        quantized = EMBEDDING_QUANTIZATION == "halfvec"
+
+    today_start = None
+    if not all_time:
+        today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    pgvector_options = ef_search is not None or probes is not None or exact
+
+    index = None if pgvector_options else get_index()
+    if index is not None:
+        with stage_timer("find_similar_images", "ann_search"):
+            hits = index.search(
+                image_id,
+                find_n=find_n,
+                same_emotion=same_emotion,
+                ignore_original_user=ignore_original_user,
+                since=today_start
+            )
+        if hits is not None:
+            with SessionLocal() as session:
+                ids = [hit_id for hit_id, _ in hits]
+                images = {str(img.id): img for img in session.query(Image).filter(Image.id.in_(ids))}
+
+                return [{
+                    "id": hit_id,
+                    "file_path": images[hit_id].file_path,
+                    "user_id": str(images[hit_id].user_id),
+                    "emotion": images[hit_id].emotion
+                } for hit_id in ids if hit_id in images]
+
+    results = _search_postgres(image_id, find_n, same_emotion, ignore_original_user, today_start,
+                               ef_search, probes, exact, quantized)
+
+    # Короткий результат - обычно просто мало подходящих строк (фильтр "сегодня").
+    # Точный поиск нужен, только если шел приближенный индекс, а строк на самом деле хватает
+    approximate = VECTOR_INDEX != "none" and not pgvector_options
+    if approximate and len(results) < find_n and \
+            _count_matches(image_id, same_emotion, ignore_original_user, today_start, find_n) > len(results):
+        with stage_timer("find_similar_images", "exact_fallback"):
+            results = _search_postgres(image_id, find_n, same_emotion, ignore_original_user, today_start,
+                                       None, None, True, False)
+    return results
+
+def _filtered_query(session, original_image: Image, same_emotion: bool, ignore_original_user: bool,
+                    today_start: datetime | None):
+    """Изображения, среди которых ищутся похожие: фильтры find_similar_images без сортировки."""
+    filters = [Settings.search_allowed == true()]
+
+    if ignore_original_user:
+        filters.append(Image.user_id != original_image.user_id)
+    if same_emotion:
+        filters.append(Image.emotion == original_image.emotion)
+    if today_start is not None:
+        filters.append(Image.created_date >= today_start)
+
+    return session.query(Image).join(User).join(Settings).filter(and_(*filters)) # Join all tables and apply filters
+
+def _count_matches(image_id: str, same_emotion: bool, ignore_original_user: bool,
+                   today_start: datetime | None, limit: int) -> int:
+    """Число подходящих изображений, но не больше limit: дешевый запрос без векторного индекса."""
     with SessionLocal() as session:
-        original_image = session.query(Image).get(image_id)
+        original_image = session.get(Image, image_id)
+        matches = (_filtered_query(session, original_image, same_emotion, ignore_original_user, today_start)
+            .with_entities(Image.id).limit(limit).subquery())
+        return session.scalar(select(func.count()).select_from(matches))
 
-        if not all_time:
-            today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+def _search_postgres(
+    image_id: str,
+    find_n: int,
+    same_emotion: bool,
+    ignore_original_user: bool,
+    today_start: datetime | None,
+    ef_search: int | None,
+    probes: int | None,
+    exact: bool,
+    quantized: bool
+) -> list:
+    with SessionLocal() as session:
+        # Настройки действуют только внутри текущей транзакции
+        if VECTOR_INDEX == "hnsw" and not exact and vector_extension_version() >= (0, 8):
+            session.execute(text("SELECT set_config('hnsw.iterative_scan', 'strict_order', true)"))
+        if ef_search is not None:
+            session.execute(text("SELECT set_config('hnsw.ef_search', :value, true)"), {"value": str(ef_search)})
+        if probes is not None:
+            session.execute(text("SELECT set_config('ivfflat.probes', :value, true)"), {"value": str(probes)})
+        if exact:
+            session.execute(text("SELECT set_config('enable_indexscan', 'off', true)"))
 
-        filters = [Settings.search_allowed == true()]
+        original_image = session.get(Image, image_id)
+        query = _filtered_query(session, original_image, same_emotion, ignore_original_user, today_start)
 
-        if ignore_original_user:
-            filters.append(Image.user_id != original_image.user_id)
-        if same_emotion:
-            filters.append(Image.emotion == original_image.emotion)
-        if all_time:
-            filters.append(Image.created_date >= today_start)
+        if quantized and not exact:
+            # Первый проход по halfvec индексу, затем точный порядок среди кандидатов
+            half_distance = cast(Image.embedding, HALFVEC(EMBEDDING_DIM)).cosine_distance(
+                cast(original_image.embedding, HALFVEC(EMBEDDING_DIM))
+            )
+            candidates = (query.with_entities(Image.id)
+                .order_by(half_distance).limit(find_n * RERANK_FACTOR)
+                .subquery()
+            )
+            query = session.query(Image).join(candidates, Image.id == candidates.c.id)
 
-        query = (session.query(Image).join(User).join(Settings)
-            .filter(and_(*filters))
-            .order_by(Image.embedding.cosine_distance(original_image.embedding)).limit(find_n)
-        ) # Join all tables and apply filters
+        query = query.order_by(Image.embedding.cosine_distance(original_image.embedding)).limit(find_n)
         
         return [{
             "id": str(img.id),
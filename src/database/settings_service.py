@@ -0,0 +1,111 @@
+import threading
+from time import monotonic
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import time
+from sqlalchemy import select, update, not_
+from dotenv import load_dotenv
+from os import environ
+
+from .database import SessionLocal
+from .models import Settings
+from .ann_index import loaded_index
+
+load_dotenv()
+SETTINGS_CACHE_SIZE = int(environ.get("SETTINGS_CACHE_SIZE", 100_000))
+# Секунды жизни записи, 0 - без ограничения. Кэш у каждого процесса свой и видит
+# только свои записи, поэтому при нескольких процессах (webhook) нужен короткий срок
+SETTINGS_CACHE_TTL = float(environ.get("SETTINGS_CACHE_TTL", 0))
+
+@dataclass(frozen=True)
+class SettingsSnapshot:
+    """Неизменяемая копия строки settings."""
+    user_id: str
+    ai_enabled: bool
+    reminder_time: time
+    search_allowed: bool
+
+_COLUMNS = (Settings.user_id, Settings.ai_enabled, Settings.reminder_time, Settings.search_allowed)
+
+_cache: OrderedDict[str, tuple[SettingsSnapshot, float]] = OrderedDict()  # user_id -> (снимок, время записи)
+_cache_lock = threading.Lock()
+_writes = 0  # счетчик записей в кэш из _write
+
+def _written() -> int:
+    with _cache_lock:
+        return _writes
+
+def _remember(snapshot: SettingsSnapshot, seen_writes: int, write: bool = False) -> SettingsSnapshot:
+    """Кладет снимок в кэш, если с момента чтения seen_writes не было других записей.
+
+    Иначе медленное чтение могло бы вернуть в кэш строку старее только что
+    записанной, поэтому запись просто сбрасывается и следующий вызов перечитает БД.
+    """
+    global _writes
+
+    with _cache_lock:
+        if _writes == seen_writes:
+            _cache[snapshot.user_id] = (snapshot, monotonic())
+            _cache.move_to_end(snapshot.user_id)
+            while len(_cache) > SETTINGS_CACHE_SIZE:
+                _cache.popitem(last=False)
+        else:
+            _cache.pop(snapshot.user_id, None)
+        if write:
+            _writes += 1
+    return snapshot
+
+def get_settings(user_id) -> SettingsSnapshot | None:
+    """Настройки пользователя из кэша, при промахе - одним запросом из БД."""
+    user_id = str(user_id)
+
+    with _cache_lock:
+        cached = _cache.get(user_id)
+        if cached is not None and SETTINGS_CACHE_TTL and monotonic() - cached[1] >= SETTINGS_CACHE_TTL:
+            del _cache[user_id]
+            cached = None
+        if cached is not None:
+            _cache.move_to_end(user_id)
+            return cached[0]
+        seen_writes = _writes
+
+    with SessionLocal() as session:
+        row = session.execute(select(*_COLUMNS).where(Settings.user_id == user_id)).first()
+
+    return _remember(SettingsSnapshot(*row), seen_writes) if row else None
+
+def _write(user_id: str, values: dict) -> SettingsSnapshot | None:
+    seen_writes = _written()
+    with SessionLocal() as session:
+        row = session.execute(
+            update(Settings)
+            .where(Settings.user_id == user_id)
+            .values(values)
+            .returning(*_COLUMNS)
+        ).first()
+        session.commit()
+
+    if row is None:
+        return None
+
+    snapshot = _remember(SettingsSnapshot(*row), seen_writes, write=True)
+
+    # Незагруженный индекс прочитает флаг из БД сам, строить его ради переключателя не нужно
+    if "search_allowed" in values:
+        index = loaded_index()
+        if index is not None:
+            index.set_search_allowed(user_id, snapshot.search_allowed)
+
+    return snapshot
+
+def update_settings(user_id, **changes) -> SettingsSnapshot | None:
+    """Записывает изменения в БД и сразу обновляет кэш."""
+    return _write(str(user_id), changes)
+
+def toggle_setting(user_id, field: str) -> SettingsSnapshot | None:
+    """Атомарно инвертирует булеву настройку (ai_enabled, search_allowed)."""
+    return _write(str(user_id), {field: not_(getattr(Settings, field))})
+
+def invalidate(user_id):
+    with _cache_lock:
+        _cache.pop(str(user_id), None)
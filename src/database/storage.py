@@ -0,0 +1,104 @@
+import os
+import time
+import hashlib
+import tempfile
+from pathlib import Path
+
+IMAGES_DIR = Path("images")
+# Загрузки, которые пользователь еще не подтвердил: в хранилище их переносит
+# save_image, остальные удаляет sweep_staging
+STAGING_DIR = IMAGES_DIR / "staging"
+
+def content_path(digest: str) -> Path:
+    """Путь объекта в хранилище: images/ab/cd/<sha256>.jpg
+
+    Два уровня подкаталогов по 256 вариантов держат каталоги небольшими
+    даже при миллионах файлов.
+    """
+    return IMAGES_DIR / digest[:2] / digest[2:4] / f"{digest}.jpg"
+
+def is_stored(path) -> bool:
+    """Лежит ли файл уже в хранилище (путь вида images/ab/cd/<hash>.jpg)."""
+    path = Path(path)
+    return path.parent.parent.parent == IMAGES_DIR and path == content_path(path.stem)
+
+def store_image(data: bytes) -> Path:
+    """Сохраняет байты изображения под их sha256 и возвращает путь.
+
+    Повторная загрузка того же содержимого не пишет файл заново. Запись
+    идет через временный файл и os.replace, поэтому параллельные загрузки
+    не видят недописанный объект.
+    """
+    path = content_path(hashlib.sha256(data).hexdigest())
+    if path.exists():
+        return path
+
+    _write_atomic(path, data)
+    return path
+
+def _write_atomic(path: Path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+def staged_path(digest: str) -> Path:
+    return STAGING_DIR / f"{digest}.jpg"
+
+def stage_image(data: bytes) -> Path:
+    """Сохраняет неподтвержденную загрузку во временный каталог и возвращает путь.
+
+    Имя файла - sha256 содержимого, как в хранилище. Повторная загрузка
+    обновляет время изменения, чтобы sweep_staging не удалил файл, на который
+    ссылается новый шаг диалога.
+    """
+    path = staged_path(hashlib.sha256(data).hexdigest())
+    if path.exists():
+        os.utime(path)
+        return path
+
+    _write_atomic(path, data)
+    return path
+
+def find_upload(digest: str) -> Path | None:
+    """Уже скачанный файл с этим содержимым: в хранилище или среди неподтвержденных."""
+    path = content_path(digest)
+    if path.exists():
+        return path
+
+    path = staged_path(digest)
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return path
+
+def sweep_staging(max_age: float) -> int:
+    """Удаляет неподтвержденные загрузки старше max_age секунд.
+
+    max_age должен быть не меньше времени жизни шага диалога (CONVERSATION_TTL),
+    иначе подтверждение найдет удаленный файл. Returns: число удаленных файлов
+    """
+    deadline = time.time() - max_age
+    removed = 0
+    for path in STAGING_DIR.glob("*"):
+        try:
+            if path.stat().st_mtime < deadline:
+                path.unlink()
+                removed += 1
+        except FileNotFoundError:
+            pass
+    if removed:
+        print(f"Removed {removed} unconfirmed uploads")
+    return removed
+
+def store_file(image_path) -> Path:
+    """Кладет файл в хранилище (если он еще не там) и возвращает путь."""
+    if is_stored(image_path):
+        return Path(image_path)
+    return store_image(Path(image_path).read_bytes())
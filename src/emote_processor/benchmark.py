@@ -1,9 +1,12 @@
 import os
 import time
+import asyncio
 import numpy as np
-import matplotlib.pyplot as plt
+from types import SimpleNamespace
 
-from src.emote_processor.get_emote import get_emotions
+from src.emote_processor.get_emote import analyze_emotions
+from src.emote_processor.detector_cascade import build_profile, save_profile, DETECTOR_PROFILE_PATH, MIN_FACE_CONFIDENCE
+from src.emote_processor.inference_pool import run_inference, shutdown, analyze, INFERENCE_WORKERS
 
 backends = ['opencv', 'ssd', 'mtcnn', 'retinaface']
 emotions = ['angry', 'disgust', 'fear', 'happy', 'neutral', 'sad', 'surprise']
@@ -25,6 +28,9 @@ def run_benchmark():
     # Store accuracy data for heatmap
     accuracy_list = []
 
+    # Per-image (confidence, correct, time) for the cascade profile
+    records = {}
+
     # Benchmark each backend
     for backend in backends:
         total_correct = 0
@@ -34,18 +40,25 @@ def run_benchmark():
         emote_counts = {e: 0 for e in emotions}
 
         processing_times = []
+        records[backend] = []
         
         for idx, (img_path, true_emotion) in enumerate(image_list):
             start_time = time.time()
             try:
-                result = get_emotions(img_path, backend) or {}
+                result = analyze_emotions(img_path, backend, min_confidence=0) or {}
             except Exception as e:
                 print(f"Error processing {img_path} with {backend}: {e}")
+                records[backend].append((None, False, time.time() - start_time))
                 continue
             elapsed = time.time() - start_time
+            pred_emotion = result.get('dominant_emotion', '').lower()
+            records[backend].append((result.get('face_confidence', 0.0), pred_emotion == true_emotion, elapsed))
+
+            # Low confidence counts as "no face", as in get_emotions
+            if result.get('face_confidence', 0.0) < MIN_FACE_CONFIDENCE:
+                continue
             processing_times.append(elapsed)
             
-            pred_emotion = result.get('dominant_emotion', '').lower()
             if true_emotion in emotions:
                 emote_counts[true_emotion] += 1
                 total_emotes += 1
@@ -59,6 +72,11 @@ def run_benchmark():
         total_excl_init = total_time - init_time
         avg_time = total_excl_init / (len(processing_times) - 1) if len(processing_times) > 1 else 0
 
+        # The first call includes model initialization, count it as an average call
+        if records[backend]:
+            confidence, correct, _ = records[backend][0]
+            records[backend][0] = (confidence, correct, avg_time)
+
         # Calculate accuracy percentages
         accuracy = {}
         for emotion in emotions:
@@ -80,6 +98,8 @@ def run_benchmark():
                 f.write(f"{emotion}: {acc:.4f}\n")
 
     # Generate heatmap visualization
+    import matplotlib.pyplot as plt  # Only needed for the report plot
+
     plt.figure(figsize=(12, 8))
 
     # Prepare data matrix
@@ -106,4 +126,110 @@ def run_benchmark():
     plt.savefig(os.path.join(benchmark_dir, 'accuracy_heatmap.png'))
     plt.close()
 
+    # Escalation policy for FACE_DETECTOR=cascade
+    if image_list:
+        profile = build_profile(records)
+        save_profile(profile)
+        print(f"Cascade {' -> '.join(profile['cascade'])}, thresholds {profile['thresholds']}: "
+              f"accuracy {profile['expected']['accuracy']:.3f}, avg time {profile['expected']['avg_time']:.4f}s "
+              f"(saved to {DETECTOR_PROFILE_PATH})")
+
     print("Benchmarking completed. Results saved in benchmark_results/")
+
+BENCHMARK_CHAT_ID = "benchmark_async_user"
+
+def _offline_bot(bot, image_bytes: bytes):
+    """Заменяет сетевые вызовы бота main_async локальными, чтобы мерить сами обработчики.
+
+    Каждая загрузка получает уникальные байты (хвост после конца JPEG), чтобы
+    не попадать в кэш анализа.
+
+    Returns:
+        list: тексты отправленных ботом сообщений
+    """
+    replies = []
+
+    async def send_message(chat_id, text, **kwargs):
+        replies.append(text)
+
+    async def get_file(file_id):
+        return SimpleNamespace(file_path=file_id)
+
+    async def download_file(file_path):
+        return image_bytes + os.urandom(16)
+
+    bot.send_message = send_message
+    bot.get_file = get_file
+    bot.download_file = download_file
+    return replies
+
+def _message(n: int | None = None):
+    photo = [SimpleNamespace(file_id=f"benchmark_{n}", file_unique_id=f"benchmark_{n}_{time.time_ns()}")]
+    return SimpleNamespace(chat=SimpleNamespace(id=BENCHMARK_CHAT_ID), text="⚙️ Настройки", photo=photo)
+
+async def _button_latencies(handle_settings, stop: asyncio.Event, interval: float) -> list:
+    """Нажимает кнопку настроек через настоящий обработчик main_async."""
+    latencies = []
+    while not stop.is_set():
+        start_time = time.perf_counter()
+        await handle_settings(_message())
+        latencies.append(time.perf_counter() - start_time)
+        await asyncio.sleep(interval)
+    return latencies
+
+async def _concurrency_benchmark(image_path: str, n_uploads: int, interval: float):
+    import main_async  # Бот создается при импорте, нужен только здесь
+
+    with open(image_path, "rb") as f:
+        replies = _offline_bot(main_async.bot, f.read())
+    await asyncio.to_thread(main_async.register_user, BENCHMARK_CHAT_ID)
+
+    # Прогрев пула, чтобы не мерить загрузку моделей
+    await asyncio.gather(*(run_inference(analyze, image_path) for _ in range(INFERENCE_WORKERS)))
+
+    stop = asyncio.Event()
+    probe = asyncio.create_task(_button_latencies(main_async.handle_settings, stop, interval))
+    await asyncio.sleep(1)
+    stop.set()
+    idle = await probe
+
+    # Полный путь handle_photo: скачивание, хранилище, кэш анализа и пул инференса
+    stop = asyncio.Event()
+    probe = asyncio.create_task(_button_latencies(main_async.handle_settings, stop, interval))
+    start_time = time.perf_counter()
+    replies.clear()
+    results = await asyncio.gather(*(main_async.handle_photo(_message(n)) for n in range(n_uploads)),
+                                   return_exceptions=True)
+    elapsed = time.perf_counter() - start_time
+    stop.set()
+    loaded = await probe
+
+    # handle_photo сам перехватывает ошибки инференса и просит выбрать эмоцию вручную
+    errors = [result for result in results if isinstance(result, BaseException)]
+    errors += [RuntimeError(reply) for reply in replies if reply.startswith("Не удалось распознать")]
+    return idle, loaded, elapsed, errors
+
+def run_concurrency_benchmark(image_path: str, n_uploads: int = 16, interval: float = 0.05, max_degradation_ms: float = 50):
+    """Проверяет, что N одновременных handle_photo не замедляют нажатия кнопок в asyncio режиме."""
+    from src.benchmark_suite import cleanup
+
+    try:
+        idle, loaded, elapsed, errors = asyncio.run(_concurrency_benchmark(image_path, n_uploads, interval))
+    finally:
+        shutdown()
+        cleanup()
+
+    idle_p95 = np.percentile(idle, 95) * 1000
+    loaded_p95 = np.percentile(loaded, 95) * 1000
+    # Упавшая загрузка не нагружает пул, и задержка кнопок под ней ничего не доказывает
+    passed = loaded_p95 - idle_p95 <= max_degradation_ms and not errors
+
+    print(f"Workers: {INFERENCE_WORKERS}, simultaneous uploads: {n_uploads}")
+    print(f"Uploads/sec: {(n_uploads - len(errors)) / elapsed:.2f}")
+    if errors:
+        print(f"Failed uploads: {len(errors)} / {n_uploads}")
+        for error in errors[:3]:
+            print(f"  {type(error).__name__}: {error}")
+    print(f"Button latency p95: idle {idle_p95:.1f} ms, under load {loaded_p95:.1f} ms")
+    print(f"Target (+{max_degradation_ms:.0f} ms): {'OK' if passed else 'FAILED'}")
+    return passed
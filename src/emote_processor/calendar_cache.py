@@ -0,0 +1,146 @@
+import io
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from PIL import Image
+from dotenv import load_dotenv
+from os import environ
+
+from src.database.services import get_month_entries
+from src.emote_processor.create_calendar import render_calendar, draw_day, cell_photo
+from src.metrics import stage_timer
+
+load_dotenv()
+CALENDAR_CACHE_SIZE = int(environ.get("CALENDAR_CACHE_SIZE", 1000))
+# Страховка от записей в обход бота (bulk импорт, другие процессы). Кэш у каждого
+# процесса свой: add_day обновляет только процесс, сохранивший фото, поэтому
+# в webhook режиме (несколько процессов) webhook.py по умолчанию ставит 60 секунд
+CALENDAR_CACHE_TTL = float(environ.get("CALENDAR_CACHE_TTL", 60 * 60))
+
+@dataclass
+class CachedCalendar:
+    """Отрисованный месяц пользователя.
+
+    Attributes:
+        canvas: Изображение, в которое дорисовываются новые дни
+        days: Дни месяца, у которых на canvas уже есть фото
+        png: Закодированный canvas или None, если его нужно перекодировать
+        file_id: file_id фото в Telegram для повторной отправки без загрузки
+    """
+    canvas: Image.Image
+    days: set
+    png: bytes | None = None
+    file_id: str | None = None
+    expires: float = field(default_factory=lambda: time.monotonic() + CALENDAR_CACHE_TTL)
+
+_cache: OrderedDict[tuple[str, int, int], CachedCalendar] = OrderedDict()
+_lock = threading.Lock()
+
+def _key(user_id, year: int | None, month: int | None) -> tuple[str, int, int]:
+    now = datetime.now()
+    return str(user_id), year or now.year, month or now.month
+
+# Месяцы, которые сейчас отрисовываются: key -> [число отрисовок, поколение].
+# add_day и invalidate увеличивают поколение, отрисовка попадает в кэш, только
+# если поколение не изменилось с ее начала
+_rendering: dict[tuple[str, int, int], list[int]] = {}
+
+def get_calendar(user_id, year: int | None = None, month: int | None = None) -> tuple[bytes, str | None]:
+    """Календарь из кэша; при промахе отрисовывается целиком один раз.
+
+    Returns:
+        tuple: (PNG, file_id в Telegram или None, если этот вариант еще не отправлялся)
+    """
+    key = _key(user_id, year, month)
+
+    with _lock:
+        cached = _cache.get(key)
+        if cached is not None and cached.expires < time.monotonic():
+            del _cache[key]
+            cached = None
+        if cached is not None:
+            _cache.move_to_end(key)
+            if cached.png is None:
+                cached.png = _encode(cached.canvas)
+            return cached.png, cached.file_id
+        rendering = _rendering.setdefault(key, [0, 0])
+        rendering[0] += 1
+        generation = rendering[1]
+
+    try:
+        _, year, month = key
+        with stage_timer("create_calendar", "query"):
+            day_data = get_month_entries(key[0], year, month)
+        canvas = render_calendar(year, month, day_data)
+        with stage_timer("create_calendar", "encode"):
+            png = _encode(canvas)
+        cached = CachedCalendar(canvas=canvas, days=set(day_data), png=png)
+    finally:
+        with _lock:
+            rendering = _rendering[key]
+            changed = rendering[1] != generation
+            rendering[0] -= 1
+            if not rendering[0]:
+                del _rendering[key]
+
+    # Если во время отрисовки добавился день, результат мог его не увидеть
+    if not changed:
+        with _lock:
+            _cache[key] = cached
+            _cache.move_to_end(key)
+            while len(_cache) > CALENDAR_CACHE_SIZE:
+                _cache.popitem(last=False)
+    return cached.png, None
+
+def remember_file_id(user_id, year: int | None, month: int | None, png: bytes, file_id: str):
+    """Запоминает file_id отправленного календаря, если он все еще актуален."""
+    with _lock:
+        cached = _cache.get(_key(user_id, year, month))
+        if cached is not None and cached.png is png:
+            cached.file_id = file_id
+
+def add_day(user_id, created_date: datetime, image_path: str, emotion: str):
+    """Дорисовывает в закэшированный месяц только ячейку нового дня.
+
+    Если за этот день фото уже было, календарь не меняется: в ячейке
+    показывается первое фото дня. Миниатюра читается (или создается) без
+    блокировки, под блокировкой фото только вставляется в холст.
+    """
+    key = _key(user_id, created_date.year, created_date.month)
+    day = created_date.day
+
+    with _lock:
+        if key in _rendering:
+            _rendering[key][1] += 1
+
+        cached = _cache.get(key)
+        if cached is None or day in cached.days:
+            return
+
+    entry = {"image_path": image_path, "emotion": emotion}
+    photo = cell_photo(entry)
+
+    with _lock:
+        cached = _cache.get(key)
+        if cached is None or day in cached.days:
+            return
+
+        draw_day(cached.canvas, created_date.year, created_date.month, day, entry, photo=photo)
+        cached.days.add(day)
+        cached.png = None
+        cached.file_id = None
+
+def invalidate(user_id):
+    with _lock:
+        for key in [key for key in _cache if key[0] == str(user_id)]:
+            _cache.pop(key)
+        for key, rendering in _rendering.items():
+            if key[0] == str(user_id):
+                rendering[1] += 1
+
+def _encode(canvas: Image.Image) -> bytes:
+    output = io.BytesIO()
+    canvas.save(output, "PNG")
+    return output.getvalue()
@@ -1,41 +1,91 @@
 from PIL import Image, ImageDraw, ImageFont, ImageEnhance
+from functools import lru_cache
 import datetime
 import calendar
-from collections import defaultdict
-from src.database.services import get_user_data
+from src.database.services import get_month_entries
+from src.emote_processor.thumbnails import load_thumbnail, CALENDAR_CELL_SIZE
+from src.metrics import stage_timer, timed
 
-def create_calendar(user_id, year: int | None = None, month: int | None = None, output_path="calendar.png"):
-    now = datetime.datetime.now()
+# Параметры изображения
+PADDING = 5
+HEADER_HEIGHT = 40
 
-    if not year:
-        year = now.year
-    if not month:
-        month = now.month
-    
+EMOTION_COLORS = {
+    "happy": (255, 255, 0),
+    "sad": (0, 0, 255),
+    "angry": (255, 0, 0),
+    "neutral": (200, 200, 200),
+    "surprise": (255, 165, 0),
+    "disgust": (0, 255, 0),
+    "fear": (128, 0, 128),
+}
+
+@lru_cache(maxsize=None)
+def _font(size: int):
+    return ImageFont.truetype("arial.ttf", size)
+
+def cell_origin(year: int, month: int, day: int) -> tuple[int, int]:
+    """Левый верхний угол ячейки дня на изображении календаря."""
+    for week_num, week in enumerate(calendar.monthcalendar(year, month)):
+        if day in week:
+            x = week.index(day) * (CALENDAR_CELL_SIZE + PADDING)
+            y = HEADER_HEIGHT + week_num * (CALENDAR_CELL_SIZE + PADDING)
+            return x, y
+    raise ValueError(f"No day {day} in {year}-{month}")
+
+def cell_photo(entry: dict) -> Image.Image | None:
+    """Фото ячейки дня с цветом эмоции или None, если фото не читается."""
+    try:
+        photo = load_thumbnail(entry["image_path"], "cell")
+
+        # Наложение цвета
+        color = EMOTION_COLORS.get(entry["emotion"], (255,255,255))
+        overlay = Image.new("RGBA", photo.size, color + (64,))
+        return Image.alpha_composite(
+            photo.convert("RGBA"),
+            overlay
+        ).convert("RGB")
+    except Exception as e:
+        print(f"Error processing image: {e}")
+        return None
+
+def draw_day(img: Image.Image, year: int, month: int, day: int, entry: dict | None = None,
+             photo: Image.Image | None = None):
+    """Рисует ячейку дня: рамку, фото с цветом эмоции (если есть) и номер.
+
+    photo - заранее подготовленный cell_photo(entry), чтобы не читать файл при рисовании.
+    """
+    cell_size = CALENDAR_CELL_SIZE
+    x, y = cell_origin(year, month, day)
+    draw = ImageDraw.Draw(img)
+
+    # Рамка дня
+    draw.rectangle([x, y, x+cell_size, y+cell_size], outline="gray")
+
+    if photo is None and entry:
+        photo = cell_photo(entry)
+    if photo is not None:
+        img.paste(photo, (x, y))
+
+    # Текст с номером дня
+    draw.text((x + 5, y + 5), str(day), font=_font(20), fill="black")
+
+@timed("create_calendar", "render")
+def render_calendar(year: int, month: int, day_data: dict) -> Image.Image:
+    """Изображение месяца по записям {день месяца: запись}."""
     month_cal = calendar.monthcalendar(year, month)
-    day_data = defaultdict(list)
-    
-    entries = get_user_data(user_id)
-    for entry in entries:
-        date = entry["created_at"]
-        if date.year == year and date.month == month:
-            day_data[date.day].append(entry)
-
-    # Параметры изображения
-    cell_size = 100
-    padding = 5
-    header_height = 40
+
+    cell_size = CALENDAR_CELL_SIZE
     cols = 7
     rows = len(month_cal)
-    
+
     # Рассчитываем размеры
-    width = cols * cell_size + (cols-1)*padding
-    height = header_height + rows * cell_size + (rows-1)*padding
+    width = cols * cell_size + (cols-1)*PADDING
+    height = HEADER_HEIGHT + rows * cell_size + (rows-1)*PADDING
     img = Image.new("RGB", (width, height), "white")
     draw = ImageDraw.Draw(img)
-    
-    font = ImageFont.truetype("arial.ttf", 20)
-    header_font = ImageFont.truetype("arial.ttf", 30)
+
+    header_font = _font(30)
     header = f"{calendar.month_name[month]} {year}"
     bbox = draw.textbbox((0, 0), header, font=header_font)
 
@@ -44,58 +94,29 @@ def create_calendar(user_id, year: int | None = None, month: int | None = None,
 
     draw.text(((width - w)//2, 10), header, font=header_font, fill="black")
 
-    emotion_colors = {
-        "happy": (255, 255, 0),
-        "sad": (0, 0, 255),
-        "angry": (255, 0, 0),
-        "neutral": (200, 200, 200),
-        "surprise": (255, 165, 0),
-        "disgust": (0, 255, 0),
-        "fear": (128, 0, 128),
-    }
-
-    for week_num, week in enumerate(month_cal):
-        for day_num, day in enumerate(week):
-            if day == 0:
-                continue
-                
-            # Координаты ячейки
-            x = day_num * (cell_size + padding)
-            y = header_height + week_num * (cell_size + padding)
-            
-            # Рамка дня
-            draw.rectangle([x, y, x+cell_size, y+cell_size], outline="gray")
-            entries = day_data.get(day, [])
-            
-            if entries:
-                try:
-                    entry = entries[0]
-                    with Image.open(entry["image_path"]) as photo:
-                        # Обрезка до квадрата
-                        w, h = photo.size
-                        size = min(w, h)
-                        left = (w - size) // 2
-                        top = (h - size) // 2
-                        photo = photo.crop((left, top, left+size, top+size))
-                        photo = photo.resize((cell_size, cell_size))
-                        
-                        # Наложение цвета
-                        color = emotion_colors.get(entry["emotion"], (255,255,255))
-                        overlay = Image.new("RGBA", photo.size, color + (64,))
-                        photo = Image.alpha_composite(
-                            photo.convert("RGBA"), 
-                            overlay
-                        ).convert("RGB")
-                        
-                        img.paste(photo, (x, y))
-                except Exception as e:
-                    print(f"Error processing image: {e}")
-            
-            # Текст с номером дня
-            draw.text((x + 5, y + 5), str(day), font=font, fill="black")
+    for week in month_cal:
+        for day in week:
+            if day != 0:
+                draw_day(img, year, month, day, day_data.get(day))
+
+    return img
+
+@timed("create_calendar")
+def create_calendar(user_id, year: int | None = None, month: int | None = None, output_path="calendar.png"):
+    now = datetime.datetime.now()
+
+    if not year:
+        year = now.year
+    if not month:
+        month = now.month
+
+    with stage_timer("create_calendar", "query"):
+        day_data = get_month_entries(user_id, year, month)
+
+    img = render_calendar(year, month, day_data)
 
     # img.save(output_path)
     return img
 
 if __name__ == "__main__":
-    create_calendar("test_user100")
\ No newline at end of file
+    create_calendar("test_user100")
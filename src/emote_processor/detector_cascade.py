@@ -0,0 +1,144 @@
+import json
+import threading
+from dotenv import load_dotenv
+from os import environ
+
+load_dotenv()
+DETECTOR_PROFILE_PATH = environ.get("DETECTOR_PROFILE_PATH", "detector_profile.json")
+# Доля точности лучшего детектора, которую должен сохранить каскад
+CASCADE_TARGET_SHARE = float(environ.get("CASCADE_TARGET_SHARE", 0.95))
+
+# Профиль без результатов бенчмарка: быстрый детектор, при сомнениях - точный
+DEFAULT_PROFILE = {
+    "cascade": ["opencv", "retinaface"],
+    "thresholds": {"opencv": 0.95},
+}
+
+MIN_FACE_CONFIDENCE = 0.80
+
+class NoFaceError(ValueError):
+    """Детектор отработал и не нашел лица. В отличие от других ValueError
+    (несколько лиц, битый файл) результат окончательный и кэшируется."""
+
+_profile = None
+_profile_lock = threading.Lock()
+
+def load_profile() -> dict:
+    """Профиль каскада из DETECTOR_PROFILE_PATH (создается benchmark.py) или DEFAULT_PROFILE."""
+    global _profile
+
+    with _profile_lock:
+        if _profile is None:
+            try:
+                with open(DETECTOR_PROFILE_PATH, encoding="utf-8") as f:
+                    _profile = json.load(f)
+            except FileNotFoundError:
+                _profile = DEFAULT_PROFILE
+        return _profile
+
+def cascade(attempt, profile: dict | None = None):
+    """Запускает детекторы от дешевого к точному.
+
+    attempt(backend) возвращает (результат, уверенность) или бросает ValueError,
+    если лицо не найдено. Следующий детектор запускается, только если
+    уверенность ниже порога этой ступени. Если уверенной ступени нет,
+    возвращается результат с наибольшей уверенностью.
+
+    Raises:
+        ValueError: Если ни один детектор не нашел лицо
+    """
+    profile = profile or load_profile()
+    backends = profile["cascade"]
+
+    best, best_confidence, error = None, -1.0, None
+    for stage, backend in enumerate(backends):
+        try:
+            result, confidence = attempt(backend)
+        except ValueError as e:
+            error = e
+            continue
+
+        if confidence > best_confidence:
+            best, best_confidence = result, confidence
+
+        is_last = stage == len(backends) - 1
+        if is_last or confidence >= profile["thresholds"].get(backend, 1.0):
+            break
+
+    if best is None:
+        raise error or NoFaceError("No face detected or unable to recognize emotion in the image.")
+    return best, best_confidence
+
+def _simulate(records: dict, backends: list, thresholds: dict) -> tuple[float, float]:
+    """Точность и среднее время каскада на записях бенчмарка.
+
+    records[backend] - список (уверенность или None, верна ли эмоция, время) по изображениям.
+    """
+    n_images = len(records[backends[0]])
+    correct = total_time = 0.0
+
+    for i in range(n_images):
+        best_confidence, best_correct = -1.0, False
+        for stage, backend in enumerate(backends):
+            confidence, is_correct, elapsed = records[backend][i]
+            total_time += elapsed
+            if confidence is None:
+                continue
+            if confidence > best_confidence:
+                best_confidence, best_correct = confidence, is_correct
+            if stage == len(backends) - 1 or confidence >= thresholds.get(backend, 1.0):
+                break
+
+        correct += best_correct and best_confidence >= MIN_FACE_CONFIDENCE
+
+    return correct / n_images, total_time / n_images
+
+def _fit_thresholds(records: dict, backends: list, target: float) -> dict:
+    """Наименьшие пороги ступеней, при которых точность каскада не ниже target."""
+    thresholds = {}
+    candidates = [round(MIN_FACE_CONFIDENCE + step / 100, 2) for step in range(21)]
+    for backend in backends[:-1]:
+        for threshold in candidates:
+            accuracy, _ = _simulate(records, backends, {**thresholds, backend: threshold})
+            if accuracy >= target:
+                thresholds[backend] = threshold
+                break
+        else:
+            thresholds[backend] = 1.0
+    return thresholds
+
+def build_profile(records: dict, target_share: float = CASCADE_TARGET_SHARE) -> dict:
+    """Строит профиль каскада по результатам бенчмарка детекторов.
+
+    Перебираются наборы детекторов, упорядоченные по среднему времени. Для
+    каждой ступени выбирается наименьший порог уверенности, при котором каскад
+    сохраняет target_share точности лучшего детектора (чем ниже порог, тем
+    реже запускается следующая ступень). Из подходящих наборов берется самый
+    быстрый, если таких нет - самый точный.
+    """
+    stats = {backend: _simulate(records, [backend], {}) for backend in records}
+    target = target_share * max(accuracy for accuracy, _ in stats.values())
+    by_time = sorted(records, key=lambda b: stats[b][1])
+
+    options = []
+    for mask in range(1, 2 ** len(by_time)):
+        backends = [backend for i, backend in enumerate(by_time) if mask >> i & 1]
+        thresholds = _fit_thresholds(records, backends, target)
+        accuracy, avg_time = _simulate(records, backends, thresholds)
+        options.append((accuracy >= target, -avg_time if accuracy >= target else accuracy, backends, thresholds, accuracy, avg_time))
+
+    _, _, backends, thresholds, accuracy, avg_time = max(options, key=lambda option: option[:2])
+    return {
+        "cascade": backends,
+        "thresholds": thresholds,
+        "expected": {"accuracy": accuracy, "avg_time": avg_time},
+        "backends": {backend: {"accuracy": acc, "avg_time": t} for backend, (acc, t) in stats.items()},
+    }
+
+def save_profile(profile: dict, path: str = DETECTOR_PROFILE_PATH):
+    global _profile
+
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(profile, f, indent=2)
+    with _profile_lock:
+        _profile = profile
@@ -0,0 +1,98 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+from os import environ
+
+from src.metrics import register_queue
+
+load_dotenv()
+EMOTION_BATCHING = environ.get("EMOTION_BATCHING", "0") == "1"
+EMOTION_BATCH_SIZE = int(environ.get("EMOTION_BATCH_SIZE", 16))
+EMOTION_BATCH_WAIT_MS = float(environ.get("EMOTION_BATCH_WAIT_MS", 20))
+
+def prepare_face(face: np.ndarray) -> np.ndarray:
+    """Готовит лицо (RGB в [0, 1]) ко входу модели эмоций: 48x48x1 в оттенках серого.
+
+    Повторяет подготовку DeepFace.analyze и EmotionClient.predict.
+    """
+    from deepface.modules import preprocessing  # TensorFlow грузится при импорте deepface
+
+    img = preprocessing.resize_image(img=face[:, :, ::-1], target_size=(224, 224))[0]
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    gray = cv2.resize(gray, (48, 48))
+    return gray[..., np.newaxis]
+
+def predict_emotions(faces: list[np.ndarray]) -> list[str]:
+    """Классифицирует пачку подготовленных лиц одним проходом модели."""
+    from deepface import DeepFace
+    from deepface.models.demography import Emotion
+
+    model = DeepFace.build_model(task="facial_attribute", model_name="Emotion").model
+    predictions = model(np.stack(faces), training=False).numpy()
+    return [Emotion.labels[int(i)] for i in np.argmax(predictions, axis=1)]
+
+class EmotionBatcher:
+    """Собирает лица от параллельных запросов в пачки для модели эмоций.
+
+    Пачка уходит в модель, когда набралось max_batch лиц или с момента
+    первого лица прошло max_wait_ms. Вызывающий поток ждет свой результат.
+    """
+
+    def __init__(self, max_batch: int = EMOTION_BATCH_SIZE, max_wait_ms: float = EMOTION_BATCH_WAIT_MS):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def classify(self, face: np.ndarray) -> str:
+        future = Future()
+        self.queue.put((prepare_face(face), future))
+        return future.result()
+
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    def _collect(self) -> list:
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                labels = predict_emotions([face for face, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future), label in zip(batch, labels):
+                future.set_result(label)
+
+_batcher: EmotionBatcher | None = None
+_batcher_lock = threading.Lock()
+
+def get_batcher() -> EmotionBatcher:
+    global _batcher
+
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = EmotionBatcher()
+            register_queue("emotion_batcher", _batcher.depth)
+        return _batcher
@@ -0,0 +1,180 @@
+import json
+import hashlib
+from dataclasses import dataclass
+from dotenv import load_dotenv
+from os import environ
+
+import cv2
+import numpy as np
+
+from src.emote_processor.get_emote import resize_for_deepface
+from src.emote_processor.image_loader import load_image, ANALYSIS_SIZE
+from src.emote_processor.detector_cascade import cascade, load_profile, NoFaceError, MIN_FACE_CONFIDENCE
+from src.emote_processor.emotion_batcher import EMOTION_BATCHING, get_batcher
+from src.metrics import stage_timer
+
+load_dotenv()
+FACE_DETECTOR = environ.get("FACE_DETECTOR", "opencv")  # детектор DeepFace или cascade
+
+@dataclass(frozen=True)
+class FaceAnalysis:
+    """Результат анализа одного лица на фотографии.
+
+    Attributes:
+        box: Рамка лица (top, right, bottom, left) в координатах декодированного изображения
+        confidence: Уверенность детектора
+        emotion: Доминирующая эмоция
+        embedding: 128-мерный вектор лица (dlib)
+    """
+    box: tuple[int, int, int, int]
+    confidence: float
+    emotion: str
+    embedding: list
+
+def decode_image(image) -> np.ndarray:
+    """Декодирует изображение (путь, байты или numpy array) в BGR массив.
+
+    Большие JPEG декодируются сразу в уменьшенном масштабе (не меньше ANALYSIS_SIZE).
+    """
+    try:
+        return load_image(image, ANALYSIS_SIZE)
+    except (OSError, ValueError) as e:
+        raise ValueError(f"Could not read image: {e}")
+
+def _extract_face(resized: np.ndarray, backend: str) -> dict:
+    from deepface import DeepFace  # TensorFlow грузится при импорте, нужен только при анализе
+
+    faces = DeepFace.extract_faces(
+        img_path=resized,
+        detector_backend=backend,
+        enforce_detection=False,
+        align=True
+    )
+
+    if not faces:
+        raise NoFaceError("No face detected or unable to recognize emotion in the image.")
+
+    if len(faces) > 1:
+        raise ValueError("Multiple faces detected")
+
+    return faces[0]
+
+def detector_key(backend: str = FACE_DETECTOR) -> str:
+    """Настройки детекции, от которых зависит результат analyze_face: часть ключа кэша.
+
+    Для каскада в ключ входит отпечаток профиля, поэтому новый профиль
+    (benchmark.py) не использует результаты старого.
+    """
+    if backend == 'cascade':
+        profile = json.dumps(load_profile(), sort_keys=True)
+        backend = f"cascade-{hashlib.sha256(profile.encode()).hexdigest()[:12]}"
+    return f"{backend}@{MIN_FACE_CONFIDENCE}"
+
+def detect_face(image: np.ndarray, backend: str = FACE_DETECTOR):
+    """Находит единственное лицо на изображении.
+
+    Детекция выполняется на уменьшенной копии, рамка пересчитывается
+    в координаты переданного изображения. backend='cascade' запускает
+    детекторы из профиля detector_cascade от быстрого к точному.
+
+    Returns:
+        tuple: (выровненное лицо RGB в [0, 1], рамка (top, right, bottom, left), уверенность)
+
+    Raises:
+        ValueError: Если лицо не найдено или лиц несколько
+    """
+    resized = resize_for_deepface(image)
+
+    if backend == 'cascade':
+        def attempt(stage_backend):
+            face = _extract_face(resized, stage_backend)
+            return face, face['confidence']
+
+        face, _ = cascade(attempt)
+    else:
+        face = _extract_face(resized, backend)
+
+    if face['confidence'] < MIN_FACE_CONFIDENCE:
+        raise NoFaceError("No face detected or unable to recognize emotion in the image.")
+
+    # Пересчет рамки в координаты оригинала
+    h, w = image.shape[:2]
+    scale = w / resized.shape[1]
+    area = face['facial_area']
+    top = max(int(area['y'] * scale), 0)
+    left = max(int(area['x'] * scale), 0)
+    bottom = min(int((area['y'] + area['h']) * scale), h)
+    right = min(int((area['x'] + area['w']) * scale), w)
+
+    return face['face'], (top, right, bottom, left), face['confidence']
+
+def classify_emotion(face: np.ndarray) -> str:
+    """Классифицирует эмоцию по уже вырезанному лицу (RGB в [0, 1]).
+
+    При EMOTION_BATCHING лицо уходит в общую пачку с параллельными запросами.
+    """
+    if EMOTION_BATCHING:
+        return get_batcher().classify(face)
+
+    from deepface import DeepFace
+    from deepface.models.demography import Emotion
+    from deepface.modules import preprocessing
+
+    # Та же подготовка, что и в DeepFace.analyze: rgb -> bgr и 224x224 с полями
+    face = preprocessing.resize_image(img=face[:, :, ::-1], target_size=(224, 224))
+    model = DeepFace.build_model(task="facial_attribute", model_name="Emotion")
+    predictions = model.predict(face)
+    return Emotion.labels[int(np.argmax(predictions))]
+
+def _overlap(a: tuple[int, int, int, int], b: tuple[int, int, int, int]) -> int:
+    """Площадь пересечения двух рамок (top, right, bottom, left)."""
+    height = min(a[2], b[2]) - max(a[0], b[0])
+    width = min(a[1], b[1]) - max(a[3], b[3])
+    return max(height, 0) * max(width, 0)
+
+def encode_face(image: np.ndarray, box: tuple[int, int, int, int]) -> list:
+    """Считает 128-мерный эмбеддинг dlib для уже найденного лица.
+
+    Эмбеддинг считается по рамке HOG детектора face_recognition, как в
+    get_face_embedding: рамки DeepFace детекторов другой формы, и векторы
+    по ним не сравнимы с уже сохраненными. box выбирает лицо, если HOG
+    нашел несколько, и используется сам, только если HOG лица не нашел.
+    """
+    import face_recognition  # dlib грузит модели при импорте, нужен только при расчете
+
+    rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    locations = face_recognition.face_locations(rgb)
+    location = max(locations, key=lambda location: _overlap(location, box)) if locations else box
+
+    face_encodings = face_recognition.face_encodings(rgb, known_face_locations=[location])
+    return face_encodings[0].tolist()
+
+def analyze_face(image, backend: str = FACE_DETECTOR) -> FaceAnalysis:
+    """Полный анализ лица: одно декодирование и одна детекция
+    для классификатора эмоций и энкодера dlib.
+
+    Args:
+        image: Путь к файлу, байты изображения или BGR массив
+        backend: Детектор лиц DeepFace или 'cascade'
+
+    Returns:
+        FaceAnalysis: Рамка, уверенность, эмоция и эмбеддинг
+
+    Raises:
+        ValueError: Если лицо не найдено или лиц несколько
+    """
+    with stage_timer("analyze_face", "decode"):
+        img = decode_image(image)
+    with stage_timer("analyze_face", "detect"):
+        face, box, confidence = detect_face(img, backend)
+    with stage_timer("analyze_face", "emotion"):
+        emotion = classify_emotion(face)
+    with stage_timer("analyze_face", "embedding"):
+        embedding = encode_face(img, box)
+
+    return FaceAnalysis(
+        box=box,
+        confidence=confidence,
+        emotion=emotion,
+        embedding=embedding
+    )
@@ -1,14 +1,22 @@
-import face_recognition
+from src.emote_processor.image_loader import load_image, ANALYSIS_SIZE
+
+def get_face_embedding(image) -> list:
+    """128-мерный эмбеддинг dlib первого найденного лица.
+
+    Args:
+        image: Путь к файлу, закодированные байты изображения или RGB массив
+    """
+    import face_recognition  # dlib грузит модели при импорте, нужен только при расчете
+
+    image = load_image(image, ANALYSIS_SIZE, mode="RGB")
 
-def get_face_embedding(image_path: str) -> list:
-    image = face_recognition.load_image_file(image_path)
     face_locations = face_recognition.face_locations(image)
-    
+
     if not face_locations:
         raise ValueError("No face detected in the image")
-    
+
     face_encodings = face_recognition.face_encodings(
-        image, 
+        image,
         known_face_locations=[face_locations[0]]
     )
     return face_encodings[0].tolist()
\ No newline at end of file
@@ -1,5 +1,6 @@
 import cv2
-from deepface import DeepFace
+from src.emote_processor.image_loader import load_image
+from src.emote_processor.detector_cascade import cascade, MIN_FACE_CONFIDENCE
 
 def resize_for_deepface(image, target_size=(152, 152), max_dimension=1024):
     """
@@ -15,8 +16,9 @@ def resize_for_deepface(image, target_size=(152, 152), max_dimension=1024):
     """
     
     if isinstance(image, str):
-        image = cv2.imread(image)
-        if image is None:
+        try:
+            image = load_image(image, target_size)
+        except OSError:
             raise ValueError(f"Could not read image from path: {image}")
     
     h, w = image.shape[:2]
@@ -32,11 +34,58 @@ def resize_for_deepface(image, target_size=(152, 152), max_dimension=1024):
     resized = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_AREA)
     return resized
 
+def _analyze_with(resized_image, backend: str) -> dict:
+    """Один проход DeepFace.analyze с заданным детектором.
+
+    Raises:
+        ValueError: Если лицо не найдено или лиц несколько
+    """
+    from deepface import DeepFace  # TensorFlow грузится при импорте, нужен только при анализе
+
+    analysis = DeepFace.analyze(
+        img_path=resized_image,
+        actions=['emotion'],
+        detector_backend=backend,
+        enforce_detection=False,
+        silent=True
+    )
+
+    if not analysis or not isinstance(analysis, list):
+        raise ValueError("No face detected or unable to recognize emotion in the image.")
+
+    if len(analysis) > 1:
+        raise ValueError("Multiple faces detected")
+
+    return analysis[0]
+
+def analyze_emotions(image_path: str, backend: str = 'opencv', min_confidence: float = MIN_FACE_CONFIDENCE) -> dict:
+    """Результат DeepFace.analyze для единственного лица (dominant_emotion, face_confidence, ...).
+
+    backend='cascade' запускает детекторы из профиля detector_cascade от быстрого
+    к точному, пока уверенность не достигнет порога ступени.
+    """
+    resized_image = resize_for_deepface(image_path)
+
+    if backend == 'cascade':
+        def attempt(stage_backend):
+            result = _analyze_with(resized_image, stage_backend)
+            return result, result['face_confidence']
+
+        result, _ = cascade(attempt)
+    else:
+        result = _analyze_with(resized_image, backend)
+
+    if result['face_confidence'] < min_confidence:
+        raise ValueError("No face detected or unable to recognize emotion in the image.")
+
+    return result
+
 def get_emotions(image_path: str, backend: str = 'opencv'):
     """Detect human emotion in an image.
     
     Args:
         image_path: Path to the image file
+        backend: DeepFace detector backend or 'cascade'
         
     Returns:
         str: Dominant detected emotion or None if no human found
@@ -46,29 +95,7 @@ def get_emotions(image_path: str, backend: str = 'opencv'):
         ValueError: If image is corrupted
     """
     try:
-        img = cv2.imread(image_path)
-        resized_image = resize_for_deepface(img)
-
-        analysis = DeepFace.analyze(
-            img_path=resized_image,
-            actions=['emotion'],
-            detector_backend=backend,
-            enforce_detection=False,
-            silent=True
-        )
-
-        if not analysis or not isinstance(analysis, list):
-            raise ValueError("No face detected or unable to recognize emotion in the image.")
-
-        if len(analysis) > 1:
-            raise ValueError("Multiple faces detected")
-
-        result = analysis[0]
-        
-        if result['face_confidence'] < 0.80:
-            raise ValueError("No face detected or unable to recognize emotion in the image.")
-        
-        return result['dominant_emotion']
+        return analyze_emotions(image_path, backend)['dominant_emotion']
         
     except FileNotFoundError:
         raise FileNotFoundError
@@ -0,0 +1,50 @@
+import io
+import numpy as np
+from PIL import Image, ImageOps
+
+# Наибольшая сторона для анализа лица: больше детектору и dlib не нужно
+# (resize_for_deepface все равно ограничивает изображение 1024px)
+ANALYSIS_SIZE = (1024, 1024)
+
+def _open(source) -> Image.Image:
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    return Image.open(source)
+
+def image_size(source) -> tuple[int, int]:
+    """Размер (w, h) по заголовку файла, без декодирования пикселей."""
+    with _open(source) as photo:
+        return photo.size
+
+def open_reduced(source, min_size: tuple[int, int] | None = None) -> Image.Image:
+    """Декодирует изображение в RGB с наименьшим масштабом JPEG (1/2, 1/4, 1/8),
+    при котором обе стороны не меньше min_size.
+
+    Для не-JPEG и при min_size=None изображение декодируется целиком.
+    Поворот по EXIF применяется, как в cv2.imread.
+
+    Args:
+        source: Путь к файлу, байты или файловый объект
+        min_size: Минимальные (w, h), которые нужны потребителю
+    """
+    with _open(source) as photo:
+        if min_size is not None:
+            # Заголовок уже прочитан: draft выбирает масштаб DCT до декодирования
+            photo.draft("RGB", _oriented(photo, min_size))
+        photo = ImageOps.exif_transpose(photo)
+        return photo.convert("RGB")
+
+def load_image(source, min_size: tuple[int, int] | None = None, mode: str = "BGR") -> np.ndarray:
+    """То же, что open_reduced, но numpy массивом BGR (для OpenCV/DeepFace) или RGB (для dlib)."""
+    if isinstance(source, np.ndarray):
+        return source
+
+    rgb = np.asarray(open_reduced(source, min_size))
+    if mode == "RGB":
+        return rgb
+    return np.ascontiguousarray(rgb[:, :, ::-1])
+
+def _oriented(photo: Image.Image, size: tuple[int, int]) -> tuple[int, int]:
+    """min_size в координатах файла: при повороте EXIF на 90° стороны меняются местами."""
+    orientation = photo.getexif().get(0x0112, 1)
+    return (size[1], size[0]) if orientation in (5, 6, 7, 8) else size
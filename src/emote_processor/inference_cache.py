@@ -0,0 +1,246 @@
+from __future__ import annotations
+
+import time
+import asyncio
+import sqlite3
+import threading
+import numpy as np
+from typing import TYPE_CHECKING
+from dotenv import load_dotenv
+from os import environ
+
+if TYPE_CHECKING:
+    from src.emote_processor.face_analysis import FaceAnalysis
+
+load_dotenv()
+INFERENCE_CACHE_PATH = environ.get("INFERENCE_CACHE_PATH", "inference_cache.sqlite3")  # Пустое значение - кэш выключен
+INFERENCE_CACHE_SIZE = int(environ.get("INFERENCE_CACHE_SIZE", 100_000))
+
+TRIM_EVERY = 1000  # записей между проверками размера
+
+class InferenceCache:
+    """Постоянный кэш результатов analyze_face в SQLite.
+
+    Ключи: file_unique_id фото в Telegram -> хэш содержимого, (хэш, детектор) ->
+    результат. Детектор (detector_key) входит в ключ, чтобы смена FACE_DETECTOR
+    или профиля каскада не возвращала старые результаты. Из неудачных анализов
+    кэшируется только окончательный - лицо не найдено (NoFaceError), чтобы
+    повторная отправка того же фото не запускала модели снова. Размер ограничен
+    INFERENCE_CACHE_SIZE, вытесняются давно не использованные записи.
+    """
+
+    def __init__(self, path: str, max_size: int = INFERENCE_CACHE_SIZE):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # Старая таблица без детектора в ключе хранила и случайные ошибки как "лица нет"
+        self.conn.execute("DROP TABLE IF EXISTS analyses")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS face_analyses (
+                content_hash TEXT NOT NULL,
+                detector TEXT NOT NULL,
+                emotion TEXT,
+                box TEXT,
+                confidence REAL,
+                embedding BLOB,
+                used REAL NOT NULL,
+                PRIMARY KEY (content_hash, detector)
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS ix_face_analyses_used ON face_analyses (used)")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                file_unique_id TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL
+            )
+        """)
+        self.conn.commit()
+
+        self.puts = 0
+        self.counts = {"file_hits": 0, "file_misses": 0, "hits": 0, "misses": 0}
+
+    def content_hash(self, file_unique_id: str) -> str | None:
+        """Хэш содержимого уже загруженного фото, чтобы не скачивать его снова."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT content_hash FROM files WHERE file_unique_id = ?", (file_unique_id,)
+            ).fetchone()
+            self.counts["file_hits" if row else "file_misses"] += 1
+        return row[0] if row else None
+
+    def remember_file(self, file_unique_id: str, content_hash: str):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO files (file_unique_id, content_hash) VALUES (?, ?)",
+                (file_unique_id, content_hash)
+            )
+            self.conn.commit()
+
+    def get(self, content_hash: str, detector: str) -> tuple[bool, FaceAnalysis | None]:
+        """Returns: (найдено ли, результат или None, если лица нет)"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT emotion, box, confidence, embedding FROM face_analyses WHERE content_hash = ? AND detector = ?",
+                (content_hash, detector)
+            ).fetchone()
+            self.counts["hits" if row else "misses"] += 1
+            if row is None:
+                return False, None
+
+            self.conn.execute(
+                "UPDATE face_analyses SET used = ? WHERE content_hash = ? AND detector = ?",
+                (time.time(), content_hash, detector)
+            )
+            self.conn.commit()
+
+        emotion, box, confidence, embedding = row
+        if emotion is None:
+            return True, None
+
+        from src.emote_processor.face_analysis import FaceAnalysis  # Не грузим модели ради dataclass заранее
+        return True, FaceAnalysis(
+            box=tuple(int(value) for value in box.split(",")),
+            confidence=confidence,
+            emotion=emotion,
+            embedding=np.frombuffer(embedding, dtype=np.float64).tolist()
+        )
+
+    def put(self, content_hash: str, detector: str, analysis: FaceAnalysis | None):
+        if analysis is None:
+            values = (content_hash, detector, None, None, None, None, time.time())
+        else:
+            values = (
+                content_hash,
+                detector,
+                analysis.emotion,
+                ",".join(str(value) for value in analysis.box),
+                float(analysis.confidence),
+                np.asarray(analysis.embedding, dtype=np.float64).tobytes(),
+                time.time()
+            )
+
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO face_analyses VALUES (?, ?, ?, ?, ?, ?, ?)", values)
+            self.puts += 1
+            if self.puts % TRIM_EVERY == 0:
+                self._trim()
+            self.conn.commit()
+
+    def _trim(self):
+        (size,) = self.conn.execute("SELECT count(*) FROM face_analyses").fetchone()
+        if size > self.max_size:
+            self.conn.execute("""
+                DELETE FROM face_analyses WHERE rowid IN (
+                    SELECT rowid FROM face_analyses ORDER BY used LIMIT ?
+                )
+            """, (size - self.max_size,))
+            self.conn.execute("DELETE FROM files WHERE content_hash NOT IN (SELECT content_hash FROM face_analyses)")
+
+    def stats(self) -> dict:
+        """Счетчики обращений и доли попаданий по file_unique_id и по содержимому."""
+        with self.lock:
+            counts = dict(self.counts)
+
+        def rate(hits, misses):
+            return hits / (hits + misses) if hits + misses else 0.0
+
+        counts["file_hit_rate"] = rate(counts["file_hits"], counts["file_misses"])
+        counts["hit_rate"] = rate(counts["hits"], counts["misses"])
+        return counts
+
+_cache: InferenceCache | None = None
+_cache_lock = threading.Lock()
+
+def get_cache() -> InferenceCache | None:
+    """Общий кэш процесса или None, если INFERENCE_CACHE_PATH пуст."""
+    global _cache
+
+    if not INFERENCE_CACHE_PATH:
+        return None
+
+    with _cache_lock:
+        if _cache is None:
+            _cache = InferenceCache(INFERENCE_CACHE_PATH)
+        return _cache
+
+def cached_content_hash(file_unique_id: str) -> str | None:
+    cache = get_cache()
+    return cache.content_hash(file_unique_id) if cache is not None else None
+
+def remember_file(file_unique_id: str, content_hash: str):
+    cache = get_cache()
+    if cache is not None:
+        cache.remember_file(file_unique_id, content_hash)
+
+def _detector(detector: str | None) -> str:
+    if detector is not None:
+        return detector
+    from src.emote_processor.face_analysis import detector_key
+    return detector_key()
+
+def analyze_cached(content_hash: str, image, analyze, detector: str | None = None) -> FaceAnalysis:
+    """analyze(image) с кэшированием результата по хэшу содержимого и детектору.
+
+    detector по умолчанию - detector_key() для FACE_DETECTOR. Кэшируются
+    найденное лицо и NoFaceError; другие ошибки (несколько лиц, битый файл,
+    сбой детектора) пробрасываются без записи в кэш.
+
+    Raises:
+        ValueError: Если лицо не найдено (в том числе в прошлый раз для того же фото) или лиц несколько
+    """
+    cache = get_cache()
+    if cache is None:
+        return analyze(image)
+
+    from src.emote_processor.detector_cascade import NoFaceError
+
+    detector = _detector(detector)
+    found, analysis = cache.get(content_hash, detector)
+    if found:
+        if analysis is None:
+            raise NoFaceError("No face detected (cached result)")
+        return analysis
+
+    try:
+        analysis = analyze(image)
+    except NoFaceError:
+        cache.put(content_hash, detector, None)
+        raise
+
+    cache.put(content_hash, detector, analysis)
+    return analysis
+
+async def analyze_cached_async(content_hash: str, image, analyze, detector: str | None = None) -> FaceAnalysis:
+    """То же, что analyze_cached, с асинхронной analyze (например, через run_inference)."""
+    cache = get_cache()
+    if cache is None:
+        return await analyze(image)
+
+    from src.emote_processor.detector_cascade import NoFaceError
+
+    detector = await asyncio.to_thread(_detector, detector)
+    found, analysis = await asyncio.to_thread(cache.get, content_hash, detector)
+    if found:
+        if analysis is None:
+            raise NoFaceError("No face detected (cached result)")
+        return analysis
+
+    try:
+        analysis = await analyze(image)
+    except NoFaceError:
+        await asyncio.to_thread(cache.put, content_hash, detector, None)
+        raise
+
+    await asyncio.to_thread(cache.put, content_hash, detector, analysis)
+    return analysis
+
+def report_stats():
+    cache = get_cache()
+    if cache is None:
+        return
+
+    stats = cache.stats()
+    print(f"Inference cache: file_unique_id hit rate {stats['file_hit_rate']:.0%} "
+          f"({stats['file_hits']}/{stats['file_hits'] + stats['file_misses']}), "
+          f"content hit rate {stats['hit_rate']:.0%} ({stats['hits']}/{stats['hits'] + stats['misses']})")
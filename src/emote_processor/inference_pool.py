@@ -0,0 +1,91 @@
+import os
+import asyncio
+import weakref
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dotenv import load_dotenv
+from os import environ
+
+from src.bot.startup import PRELOAD_MODELS, warmup_models, report_startup
+from src.metrics import register_queue
+
+load_dotenv()
+INFERENCE_WORKERS = int(environ.get("INFERENCE_WORKERS", os.cpu_count() or 1))
+INFERENCE_QUEUE = int(environ.get("INFERENCE_QUEUE", INFERENCE_WORKERS * 4))
+# thread - один процесс с потоками, чтобы лица попадали в общие пачки EMOTION_BATCHING
+INFERENCE_EXECUTOR = environ.get("INFERENCE_EXECUTOR", "process")
+
+_executor: Executor | None = None
+# Семафор привязан к циклу событий, поэтому свой на каждый цикл (например, повторный asyncio.run)
+_slots: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore] = weakref.WeakKeyDictionary()
+_pending = 0  # задачи в пуле и ожидающие места в нем
+
+def depth() -> int:
+    return _pending
+
+register_queue("inference", depth)
+
+# Функции для пула импортируют модели внутри, чтобы TensorFlow и dlib
+# загружались только в рабочих процессах
+def analyze(image):
+    from src.emote_processor.face_analysis import analyze_face
+    return analyze_face(image)
+
+def embed(image) -> list:
+    from src.emote_processor.face_embedding import get_face_embedding
+    return get_face_embedding(image)
+
+def _init_worker():
+    if PRELOAD_MODELS and warmup_models():
+        report_startup()
+
+def _ping():
+    return os.getpid()
+
+def get_executor() -> Executor:
+    """Пул для инференса DeepFace и dlib.
+
+    Для процессов используется spawn, чтобы не форкать процесс с уже загруженным TensorFlow.
+    """
+    global _executor
+
+    if _executor is None and INFERENCE_EXECUTOR == "thread":
+        _executor = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, initializer=_init_worker)
+    elif _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=INFERENCE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker
+        )
+    return _executor
+
+async def run_inference(func, *args):
+    """Выполняет func(*args) в пуле процессов, не блокируя цикл событий.
+
+    Одновременно в пуле находится не больше INFERENCE_QUEUE задач,
+    остальные вызовы ждут свободного места.
+    """
+    global _pending
+
+    loop = asyncio.get_running_loop()
+    slots = _slots.get(loop)
+    if slots is None:
+        slots = _slots[loop] = asyncio.Semaphore(INFERENCE_QUEUE)
+
+    _pending += 1
+    try:
+        async with slots:
+            return await loop.run_in_executor(get_executor(), func, *args)
+    finally:
+        _pending -= 1
+
+async def prestart():
+    """Запускает все рабочие процессы заранее (с прогревом моделей при PRELOAD_MODELS)."""
+    await asyncio.gather(*(run_inference(_ping) for _ in range(INFERENCE_WORKERS)))
+
+def shutdown():
+    global _executor
+
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
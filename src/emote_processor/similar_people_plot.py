@@ -1,10 +1,12 @@
 from PIL import Image
-import matplotlib.pyplot as plt
+from src.emote_processor.thumbnails import load_thumbnail, COLLAGE_HEIGHT
+from src.metrics import timed
 
+@timed("create_similar_image")
 def create_similar_image(found_images):
     """
     Display all images for an actor in a single row with 5px spacing between them.
-    All images are resized to 768px height while maintaining aspect ratio.
+    All images are read from 512px high collage derivatives while maintaining aspect ratio.
     
     Args:
         found_images (tuple): Tuple of image file paths (0 < len(images) < 100) for perfomance
@@ -13,15 +15,9 @@ def create_similar_image(found_images):
         print("No images to display")
         return
     
-    target_height = 512
+    target_height = COLLAGE_HEIGHT
     
-    images = []
-    for img_path in found_images:
-        img = Image.open(img_path).convert('RGB')
-        width_percent = (target_height / float(img.size[1]))
-        new_width = int((float(img.size[0]) * float(width_percent)))
-        img = img.resize((new_width, target_height), Image.Resampling.LANCZOS)
-        images.append(img)
+    images = [load_thumbnail(img_path, "strip") for img_path in found_images]
     
     spacing = 5
     total_width = sum(img.width for img in images) + spacing * (len(images) - 1)
@@ -0,0 +1,91 @@
+from pathlib import Path
+from PIL import Image
+
+from src.emote_processor.image_loader import open_reduced
+from src.database.database import SessionLocal
+from src.database.models import Image as ImageModel
+
+CALENDAR_CELL_SIZE = 100
+COLLAGE_HEIGHT = 512
+THUMBNAIL_QUALITY = 90
+
+def make_calendar_cell(photo: Image.Image) -> Image.Image:
+    """Квадрат по центру фото размером с ячейку календаря."""
+    w, h = photo.size
+    size = min(w, h)
+    left = (w - size) // 2
+    top = (h - size) // 2
+    photo = photo.crop((left, top, left+size, top+size))
+    return photo.resize((CALENDAR_CELL_SIZE, CALENDAR_CELL_SIZE))
+
+def make_collage_strip(photo: Image.Image) -> Image.Image:
+    """Фото высотой в полосу коллажа похожих людей с сохранением пропорций."""
+    width_percent = (COLLAGE_HEIGHT / float(photo.size[1]))
+    new_width = int((float(photo.size[0]) * float(width_percent)))
+    return photo.resize((new_width, COLLAGE_HEIGHT), Image.Resampling.LANCZOS)
+
+THUMBNAILS = {
+    "cell": make_calendar_cell,
+    "strip": make_collage_strip,
+}
+
+# Минимальный размер (w, h) оригинала, которого достаточно для производного
+MIN_SOURCE_SIZES = {
+    "cell": (CALENDAR_CELL_SIZE, CALENDAR_CELL_SIZE),
+    "strip": (1, COLLAGE_HEIGHT),
+}
+
+def _min_source_size(kinds) -> tuple[int, int]:
+    return (
+        max(MIN_SOURCE_SIZES[kind][0] for kind in kinds),
+        max(MIN_SOURCE_SIZES[kind][1] for kind in kinds),
+    )
+
+def thumbnail_path(image_path: str, kind: str) -> Path:
+    """Путь производного изображения рядом с оригиналом: images/ab/cd/<hash>_<kind>.jpg"""
+    path = Path(image_path)
+    return path.with_name(f"{path.stem}_{kind}.jpg")
+
+def create_thumbnails(image_path: str, kinds=tuple(THUMBNAILS)) -> dict[str, Path]:
+    """Создает производные изображения, декодируя оригинал один раз
+    в наименьшем масштабе, достаточном для всех kinds."""
+    paths = {}
+    photo = open_reduced(image_path, _min_source_size(kinds))
+    for kind in kinds:
+        path = thumbnail_path(image_path, kind)
+        THUMBNAILS[kind](photo).save(path, "JPEG", quality=THUMBNAIL_QUALITY)
+        paths[kind] = path
+    return paths
+
+def load_thumbnail(image_path: str, kind: str) -> Image.Image:
+    """Открывает производное изображение, создавая его из оригинала при отсутствии."""
+    path = thumbnail_path(image_path, kind)
+    if not path.exists():
+        try:
+            create_thumbnails(image_path, (kind,))
+        except OSError:
+            # Не удалось записать производное - отдаем результат без сохранения
+            return THUMBNAILS[kind](open_reduced(image_path, MIN_SOURCE_SIZES[kind]))
+
+    with Image.open(path) as thumbnail:
+        return thumbnail.convert('RGB')
+
+def backfill_thumbnails():
+    """Создает недостающие производные для всех изображений в БД."""
+    created = missing = 0
+    with SessionLocal() as session:
+        for (file_path,) in session.query(ImageModel.file_path).distinct().yield_per(1000):
+            kinds = tuple(kind for kind in THUMBNAILS if not thumbnail_path(file_path, kind).exists())
+            if not kinds:
+                continue
+            try:
+                create_thumbnails(file_path, kinds)
+                created += 1
+            except OSError as e:
+                missing += 1
+                print(f"Error processing {file_path}: {e}")
+
+    print(f"Thumbnails created for {created} images, {missing} failed")
+
+if __name__ == "__main__":
+    backfill_thumbnails()
@@ -0,0 +1,155 @@
+import time
+import bisect
+import inspect
+import functools
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+from os import environ
+
+load_dotenv()
+METRICS_PORT = environ.get("METRICS_PORT")  # Пустое значение - endpoint выключен
+METRICS_HOST = environ.get("METRICS_HOST", "127.0.0.1")
+
+# Границы корзин в секундах: от быстрых SQL запросов до инференса на CPU
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for key, value in labels)
+    return "{" + ",".join(escaped) + "}"
+
+class Histogram:
+    """Гистограмма в формате Prometheus с произвольными метками."""
+
+    def __init__(self, name: str, help: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.series = {}  # метки -> [счетчики корзин..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = {key: list(values) for key, values in self.series.items()}
+
+        for key, values in series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', bound),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {values[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {values[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {values[-1]}")
+        return lines
+
+class Gauge:
+    """Текущее значение, которое считывается функцией в момент запроса метрик."""
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.sources = {}
+        self.lock = threading.Lock()
+
+    def set_function(self, func, **labels):
+        with self.lock:
+            self.sources[tuple(sorted(labels.items()))] = func
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        with self.lock:
+            sources = dict(self.sources)
+
+        for key, func in sources.items():
+            try:
+                value = func()
+            except Exception as e:
+                print(f"Error reading gauge {self.name}: {e}")
+                continue
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+STAGE_SECONDS = Histogram("emotebot_stage_seconds", "Duration of an operation stage")
+SQL_SECONDS = Histogram("emotebot_sql_seconds", "Duration of SQL statements by kind")
+QUEUE_DEPTH = Gauge("emotebot_queue_depth", "Items waiting in an in-process queue or pool")
+
+_metrics = [STAGE_SECONDS, SQL_SECONDS, QUEUE_DEPTH]
+
+@contextmanager
+def stage_timer(operation: str, stage: str):
+    """Замеряет стадию операции: with stage_timer("save_image", "db_insert"): ..."""
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start_time, operation=operation, stage=stage)
+
+def timed(operation: str, stage: str = "total"):
+    """Декоратор: полное время вызова функции (или корутины) как стадия stage операции."""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with stage_timer(operation, stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage_timer(operation, stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def register_queue(name: str, depth):
+    """Добавляет gauge глубины очереди: depth() вызывается при каждом запросе метрик."""
+    QUEUE_DEPTH.set_function(depth, queue=name)
+
+def render() -> str:
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port: str | int | None = METRICS_PORT, host: str = METRICS_HOST):
+    """Запускает HTTP endpoint /metrics в фоновом потоке, если задан METRICS_PORT."""
+    if not port:
+        return None
+
+    server = ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Metrics available at http://{host}:{port}/metrics")
+    return server
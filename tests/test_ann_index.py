@@ -0,0 +1,58 @@
+import threading
+from datetime import datetime
+
+import numpy as np
+
+from src.database import ann_index
+from src.database.ann_index import AnnIndex, _nearest
+
+def filled_index(n: int, seed: int = 0) -> AnnIndex:
+    rng = np.random.default_rng(seed)
+    index = AnnIndex(dim=8)
+    for i in range(n):
+        index.add(f"id{i}", f"user{i % 10}", "happy", datetime(2024, 1, 1), rng.normal(size=8))
+    return index
+
+def test_nearest_in_chunks_matches_full_product():
+    rng = np.random.default_rng(1)
+    vectors, centroids = rng.normal(size=(1000, 8)), rng.normal(size=(7, 8))
+    assert (_nearest(vectors, centroids, chunk=64) == np.argmax(vectors @ centroids.T, axis=1)).all()
+
+def test_train_builds_lists_for_every_row():
+    index = filled_index(400)
+    index.train()
+
+    assert len(index.centroids) == 20
+    assert sorted(np.concatenate([lst.view() for lst in index.lists]).tolist()) == list(range(400))
+    assert index.trained_size == 400
+
+def test_search_finds_exact_neighbour_after_training():
+    index = filled_index(400)
+    index.train()
+    index.add("query", "someone", "happy", datetime(2024, 1, 1), index.vectors.data[5] + 1e-3)
+
+    hits = index.search("query", find_n=1, n_probe=len(index.centroids))
+    assert hits[0][0] == "id5"
+
+def test_add_does_not_wait_for_training(monkeypatch):
+    index = filled_index(400)
+    nearest = ann_index._nearest
+    added = []
+
+    def slow_nearest(vectors, centroids, chunk=ann_index.ASSIGN_CHUNK):
+        if not added:
+            # Обучение идет без блокировки: вставка из другого потока не ждет
+            thread = threading.Thread(target=lambda: index.add("late", "user", "sad", datetime(2024, 1, 1), np.ones(8)))
+            thread.start()
+            thread.join(5)
+            added.append(not thread.is_alive())
+        return nearest(vectors, centroids, chunk)
+
+    monkeypatch.setattr(ann_index, "_nearest", slow_nearest)
+    index.train()
+
+    assert added == [True]
+    # Строка, добавленная во время обучения, тоже попала в список кластера
+    rows = np.concatenate([lst.view() for lst in index.lists])
+    assert index.id_to_row["late"] in rows
+    assert len(index.assignments.view()) == len(index)
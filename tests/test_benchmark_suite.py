@@ -0,0 +1,35 @@
+from src import benchmark_suite
+from src.benchmark_suite import compare
+
+STATS = {"p50_ms": 10, "p95_ms": 20, "p99_ms": 30, "peak_memory_mb": 1, "throughput_per_sec": 100}
+
+def report(names, failed=None):
+    return {"benchmarks": {name: dict(STATS) for name in names}, "failed": failed or {}}
+
+def test_compare_no_changes():
+    assert compare(report(["a", "b"]), report(["a", "b"])) == []
+
+def test_compare_missing_benchmark_is_regression():
+    regressions = compare(report(["a", "b"]), report(["a"], failed={"b": "boom"}))
+    assert regressions == ["b (missing)"]
+
+def test_compare_partial_run_checks_only_selected():
+    assert compare(report(["a", "b"]), report(["a"]), names=["a"]) == []
+
+def test_compare_slower_is_regression():
+    current = report(["a"])
+    current["benchmarks"]["a"]["p95_ms"] = 30
+    assert compare(report(["a"]), current) == ["a.p95_ms"]
+
+def test_run_removes_benchmark_data(db, tmp_path, monkeypatch):
+    from sqlalchemy import text
+    from src.database import storage
+
+    monkeypatch.setattr(storage, "IMAGES_DIR", tmp_path / "images")
+    report = benchmark_suite.run(["save_image", "find_similar_images"], iterations=2)
+
+    assert report["failed"] == {}
+    with db.connect() as conn:
+        assert conn.scalar(text("SELECT count(*) FROM users WHERE user_id LIKE 'benchmark\\_%'")) == 0
+        assert conn.scalar(text("SELECT count(*) FROM images WHERE user_id LIKE 'benchmark\\_%'")) == 0
+    assert not list((tmp_path / "images").rglob("*.jpg"))
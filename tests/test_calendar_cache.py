@@ -0,0 +1,91 @@
+import threading
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+
+from src.emote_processor import calendar_cache
+
+USER = "calendar_user"
+
+@pytest.fixture(autouse=True)
+def offline_render(monkeypatch):
+    monkeypatch.setattr(calendar_cache, "render_calendar", lambda year, month, days: Image.new("RGB", (4, 4)))
+    monkeypatch.setattr(calendar_cache, "draw_day", lambda *args, **kwargs: None)
+    monkeypatch.setattr(calendar_cache, "cell_photo", lambda entry: None)
+    calendar_cache.invalidate(USER)
+    yield
+    calendar_cache.invalidate(USER)
+
+def cached_days():
+    now = datetime.now()
+    cached = calendar_cache._cache.get((USER, now.year, now.month))
+    return cached.days if cached is not None else None
+
+def test_render_is_cached(monkeypatch):
+    monkeypatch.setattr(calendar_cache, "get_month_entries", lambda user_id, year, month: {1: {}})
+    calendar_cache.get_calendar(USER)
+    assert cached_days() == {1}
+
+def test_first_render_finishing_after_second_starts_is_not_cached(monkeypatch):
+    days = {1: {}}
+    started = {name: threading.Event() for name in "ab"}
+    release = {name: threading.Event() for name in "ab"}
+
+    def get_month_entries(user_id, year, month):
+        name = threading.current_thread().name
+        snapshot = dict(days)
+        started[name].set()
+        release[name].wait(5)
+        return snapshot
+
+    monkeypatch.setattr(calendar_cache, "get_month_entries", get_month_entries)
+    render = lambda: calendar_cache.get_calendar(USER)
+
+    first = threading.Thread(target=render, name="a")
+    first.start()
+    started["a"].wait(5)
+
+    # Во время первой отрисовки сохранен новый день и началась вторая отрисовка
+    days[2] = {}
+    calendar_cache.add_day(USER, datetime.now().replace(day=2), "photo.jpg", "happy")
+    second = threading.Thread(target=render, name="b")
+    second.start()
+    started["b"].wait(5)
+
+    release["a"].set()
+    first.join(5)
+    assert cached_days() is None  # первая отрисовка не видела день 2
+
+    release["b"].set()
+    second.join(5)
+    assert cached_days() == {1, 2}
+    assert not calendar_cache._rendering
+
+def test_add_day_loads_photo_without_lock(monkeypatch):
+    monkeypatch.setattr(calendar_cache, "get_month_entries", lambda user_id, year, month: {1: {}})
+    calendar_cache.get_calendar(USER)
+
+    loaded = []
+    def cell_photo(entry):
+        assert not calendar_cache._lock.locked()
+        loaded.append(entry["image_path"])
+    monkeypatch.setattr(calendar_cache, "cell_photo", cell_photo)
+
+    calendar_cache.add_day(USER, datetime.now().replace(day=2), "images/ab/cd/photo.jpg", "happy")
+    assert loaded == ["images/ab/cd/photo.jpg"]
+    assert cached_days() == {1, 2}
+
+def test_saved_photo_uses_stored_path(monkeypatch):
+    import main
+
+    added = []
+    monkeypatch.setattr(main, "save_image", lambda *args, **kwargs: ("id", "images/ab/cd/stored.jpg"))
+    monkeypatch.setattr(main, "get_users", lambda emotion=None: 1)
+    monkeypatch.setattr(main.bot, "send_message", lambda *args, **kwargs: None)
+    monkeypatch.setattr(main.calendar_cache, "add_day", lambda user_id, date, path, emotion: added.append(path))
+
+    message = SimpleNamespace(chat=SimpleNamespace(id=USER))
+    main.save_photo(message, "images/staging/stored.jpg", "happy", [0.0] * 128)
+    assert added == ["images/ab/cd/stored.jpg"]
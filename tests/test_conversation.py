@@ -0,0 +1,105 @@
+import threading
+
+import pytest
+
+from src.bot.conversation import ConversationStore, MemoryConversationStore, FileConversationStore, create_store
+
+def make_store(backend, tmp_path, ttl=60):
+    if backend == "file":
+        return FileConversationStore(str(tmp_path / "conversations"), ttl=ttl)
+    if backend == "sql":
+        from src.bot.conversation import SqlConversationStore
+        return SqlConversationStore(ttl=ttl)
+    return MemoryConversationStore(ttl=ttl)
+
+@pytest.fixture(params=["memory", "file", "sql"])
+def backend(request):
+    if request.param == "sql":
+        request.getfixturevalue("db")
+    return request.param
+
+def register(store):
+    calls = []
+
+    @store.step
+    def save_emotion(message, photo_path, embedding=None):
+        calls.append((message, photo_path, embedding))
+
+    return save_emotion, calls
+
+def test_step_round_trip(backend, tmp_path):
+    store = make_store(backend, tmp_path)
+    save_emotion, calls = register(store)
+
+    store.set_step("test_chat", save_emotion, "images/a.jpg", [0.5, 1.0])
+    assert store.has_step("test_chat")
+
+    handler, args = store.pop_step("test_chat")
+    handler("message", *args)
+    assert calls == [("message", "images/a.jpg", [0.5, 1.0])]
+    assert not store.has_step("test_chat")
+    assert store.pop_step("test_chat") is None
+
+def test_new_step_replaces_previous(backend, tmp_path):
+    store = make_store(backend, tmp_path)
+    save_emotion, _ = register(store)
+
+    store.set_step("test_chat", save_emotion, "first.jpg")
+    store.set_step("test_chat", save_emotion, "second.jpg")
+    assert store.pop_step("test_chat")[1] == ["second.jpg"]
+
+def test_expired_step_is_dropped(backend, tmp_path):
+    store = make_store(backend, tmp_path, ttl=-1)
+    save_emotion, _ = register(store)
+
+    store.set_step("test_chat", save_emotion, "a.jpg")
+    assert not store.has_step("test_chat")
+    assert store.pop_step("test_chat") is None
+
+def test_step_is_taken_once(backend, tmp_path):
+    # Два экземпляра бота с общим хранилищем получают одно сообщение
+    store = make_store(backend, tmp_path)
+    other = make_store(backend, tmp_path) if backend != "memory" else store
+    save_emotion, _ = register(store)
+    register(other)
+
+    store.set_step("test_chat", save_emotion, "a.jpg")
+    results = []
+    barrier = threading.Barrier(8)
+
+    def take(instance):
+        barrier.wait()
+        results.append(instance.pop_step("test_chat"))
+
+    threads = [threading.Thread(target=take, args=(store if i % 2 else other,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(result is not None for result in results) == 1
+
+def test_unregistered_step_is_rejected(tmp_path):
+    store = make_store("memory", tmp_path)
+
+    def not_a_step(message):
+        pass
+
+    with pytest.raises(ValueError):
+        store.set_step("test_chat", not_a_step)
+
+def test_steps_resolve_by_name_in_another_instance(tmp_path):
+    # Другой процесс регистрирует свои функции с теми же именами
+    writer = make_store("file", tmp_path)
+    reader = make_store("file", tmp_path)
+    save_emotion, _ = register(writer)
+    reader_step, calls = register(reader)
+
+    writer.set_step("test_chat", save_emotion, "a.jpg")
+    handler, args = reader.pop_step("test_chat")
+    assert handler is reader_step
+
+def test_create_store_rejects_unknown_backend():
+    assert isinstance(create_store("memory"), ConversationStore)
+    with pytest.raises(ValueError):
+        create_store("redis")
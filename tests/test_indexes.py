@@ -0,0 +1,23 @@
+from sqlalchemy import text
+
+from src.database.indexes import ensure_indexes
+
+def index_definition(conn, name):
+    return conn.scalar(text("SELECT indexdef FROM pg_indexes WHERE indexname = :name"), {"name": name})
+
+def test_missing_partial_index_is_created_partial(db):
+    with db.begin() as conn:
+        conn.execute(text("DROP INDEX IF EXISTS ix_photo_jobs_pending"))
+
+    ensure_indexes()
+    with db.connect() as conn:
+        assert "WHERE" in index_definition(conn, "ix_photo_jobs_pending")
+
+def test_full_index_is_migrated_to_partial(db):
+    with db.begin() as conn:
+        conn.execute(text("DROP INDEX IF EXISTS ix_photo_jobs_pending"))
+        conn.execute(text("CREATE INDEX ix_photo_jobs_pending ON photo_jobs (available_at)"))
+
+    ensure_indexes()
+    with db.connect() as conn:
+        assert "WHERE" in index_definition(conn, "ix_photo_jobs_pending")
@@ -0,0 +1,63 @@
+import pytest
+
+from src.emote_processor import inference_cache
+from src.emote_processor.detector_cascade import NoFaceError
+from src.emote_processor.face_analysis import FaceAnalysis, detector_key
+from src.emote_processor.inference_cache import InferenceCache, analyze_cached
+
+ANALYSIS = FaceAnalysis(box=(1, 2, 3, 4), confidence=0.9, emotion="happy", embedding=[0.5] * 128)
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    cache = InferenceCache(str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr(inference_cache, "get_cache", lambda: cache)
+    return cache
+
+class Analyzer:
+    def __init__(self, result):
+        self.result = result
+        self.calls = 0
+
+    def __call__(self, image):
+        self.calls += 1
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+def test_found_face_is_cached():
+    analyze = Analyzer(ANALYSIS)
+    assert analyze_cached("hash", b"", analyze, "opencv") == ANALYSIS
+    assert analyze_cached("hash", b"", analyze, "opencv") == ANALYSIS
+    assert analyze.calls == 1
+
+def test_no_face_is_cached():
+    analyze = Analyzer(NoFaceError("no face"))
+    for _ in range(2):
+        with pytest.raises(NoFaceError):
+            analyze_cached("hash", b"", analyze, "opencv")
+    assert analyze.calls == 1
+
+@pytest.mark.parametrize("error", [ValueError("Multiple faces detected"), ValueError("Could not read image"),
+                                   RuntimeError("detector crashed")])
+def test_other_errors_are_not_cached(error):
+    analyze = Analyzer(error)
+    for _ in range(2):
+        with pytest.raises(type(error)):
+            analyze_cached("hash", b"", analyze, "opencv")
+    assert analyze.calls == 2
+
+def test_detector_is_part_of_the_key():
+    with pytest.raises(NoFaceError):
+        analyze_cached("hash", b"", Analyzer(NoFaceError("no face")), "opencv")
+
+    analyze = Analyzer(ANALYSIS)
+    assert analyze_cached("hash", b"", analyze, "retinaface") == ANALYSIS
+    assert analyze.calls == 1
+
+def test_cascade_key_follows_profile(monkeypatch):
+    from src.emote_processor import face_analysis
+
+    before = detector_key("cascade")
+    monkeypatch.setattr(face_analysis, "load_profile", lambda: {"cascade": ["ssd"], "thresholds": {}})
+    assert detector_key("cascade") != before
+    assert detector_key("opencv") != before
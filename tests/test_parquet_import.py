@@ -0,0 +1,48 @@
+import io
+
+import pytest
+from PIL import Image as PILImage
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+from src.database import bulk_import, parquet, storage
+from src.emote_processor import face_embedding
+
+def png_bytes():
+    output = io.BytesIO()
+    PILImage.new("RGB", (8, 8), "red").save(output, "PNG")
+    return output.getvalue()
+
+@pytest.fixture
+def dataset(tmp_path):
+    path = tmp_path / "train.parquet"
+    images = [{"bytes": png_bytes()}, {"bytes": b"not an image"}, {"bytes": png_bytes()}]
+    pq.write_table(pa.table({"image": images}), path)
+    return path
+
+@pytest.fixture(autouse=True)
+def fake_embedding(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "IMAGES_DIR", tmp_path / "images")
+    monkeypatch.setattr(face_embedding, "get_face_embedding", lambda data: [0.0] * 128)
+
+def test_corrupt_row_is_skipped_not_fatal(dataset):
+    items = list(parquet.stream_items(str(dataset)))
+    assert [item.source for item in items] == [f"{dataset}#{row}" for row in range(3)]
+
+    results = [bulk_import._process(item) for item in items]
+
+    assert [embedding is not None for _, embedding, _ in results] == [True, False, True]
+    assert results[1][0] == f"{dataset}#1"
+
+def test_corrupt_row_is_checkpointed(dataset, tmp_path):
+    checkpoint = bulk_import.Checkpoint(str(tmp_path / "import.checkpoint"))
+    for item in parquet.stream_items(str(dataset)):
+        source, embedding, _ = bulk_import._process(item)
+        checkpoint.mark([("ok" if embedding is not None else "skip", source)])
+    checkpoint.close()
+
+    # После перезапуска ни одна строка, включая битую, не обрабатывается заново
+    resumed = bulk_import.Checkpoint(str(tmp_path / "import.checkpoint"))
+    assert [item for item in parquet.stream_items(str(dataset)) if item.source not in resumed.done] == []
+    resumed.close()
@@ -0,0 +1,97 @@
+import uuid
+
+import pytest
+from sqlalchemy import select, text
+
+from src.database.database import SessionLocal
+from src.database.models import PhotoJob
+from src.database.photo_jobs import (claim_job, complete_job, fail_job, enqueue_photo, get_job,
+                                     purge_finished_jobs)
+
+@pytest.fixture
+def users(db):
+    # Очередь общая: задачи других тестов не должны мешать
+    with db.begin() as conn:
+        conn.execute(text("DELETE FROM photo_jobs WHERE status IN ('queued', 'running')"))
+    return [f"test_{uuid.uuid4().hex[:12]}" for _ in range(2)]
+
+def enqueue(user_id):
+    return enqueue_photo(user_id, "photo.jpg", "0" * 64)
+
+def test_claims_oldest_job_first(users):
+    first, second = enqueue(users[0]), enqueue(users[1])
+    assert claim_job("w1").id == first
+    assert claim_job("w2").id == second
+    assert claim_job("w3") is None
+
+def test_user_jobs_run_in_order(users):
+    first, later = enqueue(users[0]), enqueue(users[0])
+    other = enqueue(users[1])
+
+    assert claim_job("w1").id == first
+    assert claim_job("w2").id == other  # later ждет, пока first не завершится
+    assert claim_job("w3") is None
+
+    assert complete_job(first, "w1", "happy", [0.0] * 128)
+    assert claim_job("w3").id == later
+
+def test_locked_job_is_skipped(users):
+    first, second = enqueue(users[0]), enqueue(users[1])
+
+    with SessionLocal() as session:
+        session.execute(select(PhotoJob).where(PhotoJob.id == first).with_for_update()).scalar_one()
+        # Другой воркер не ждет блокировку, а берет следующую задачу
+        assert claim_job("w2").id == second
+        session.rollback()
+
+    assert claim_job("w1").id == first
+
+def test_expired_lease_is_reclaimed(users):
+    job_id = enqueue(users[0])
+    job = claim_job("w1", visibility=0)
+
+    again = claim_job("w2")
+    assert again.id == job_id and again.attempts == 2
+    assert not complete_job(job_id, "w1", "happy", None)  # аренда уже у w2
+    assert complete_job(job_id, "w2", "sad", None)
+    assert get_job(job_id).emotion == "sad"
+    assert job.attempts == 1
+
+def test_expired_lease_on_last_attempt_fails_job(users):
+    job_id = enqueue(users[0])
+    later = enqueue(users[0])
+    claim_job("w1", visibility=0, max_attempts=1)
+
+    failed = claim_job("w2", max_attempts=1)
+    assert failed.id == job_id and failed.status == "failed"
+    assert get_job(job_id).status == "failed"
+    assert claim_job("w2", max_attempts=1).id == later  # следующее фото пользователя больше не заблокировано
+
+def test_retry_with_backoff_then_fail(users):
+    job_id = enqueue(users[0])
+    job = claim_job("w1")
+    assert not fail_job(job, "w1", "boom", max_attempts=2)
+    assert get_job(job_id).status == "queued"
+    assert claim_job("w1") is None  # задержка перед повтором
+
+    with SessionLocal() as session:
+        session.execute(text("UPDATE photo_jobs SET available_at = LOCALTIMESTAMP WHERE id = :id"), {"id": job_id})
+        session.commit()
+    job = claim_job("w1")
+    assert fail_job(job, "w1", "boom", max_attempts=2)
+    assert get_job(job_id).status == "failed"
+
+def test_purge_finished_jobs(users):
+    done, pending = enqueue(users[0]), enqueue(users[1])
+    claim_job("w1")
+    complete_job(done, "w1", "happy", None)
+
+    assert purge_finished_jobs(retention=3600) == 0
+    with SessionLocal() as session:
+        session.execute(text("UPDATE photo_jobs SET created_date = created_date - interval '2 hours' WHERE id IN (:a, :b)"),
+                        {"a": done, "b": pending})
+        session.commit()
+
+    assert purge_finished_jobs(retention=3600) == 1
+    assert get_job(done) is None
+    assert get_job(pending) is not None
@@ -0,0 +1,112 @@
+"""Обработчики main.py укладываются в свой query_budget.
+
+Сообщения - заглушки, методы бота, которые ходят в Telegram, подменены.
+"""
+import uuid
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from src.database.instrumentation import assert_max_queries
+
+@pytest.fixture
+def main(db, monkeypatch):
+    import main
+
+    sent = []
+    def record(name):
+        return lambda *args, **kwargs: sent.append((name, args, kwargs)) or SimpleNamespace(photo=[])
+
+    for name in ("send_message", "send_photo", "edit_message_reply_markup"):
+        monkeypatch.setattr(main.bot, name, record(name))
+    monkeypatch.setattr(main.bot, "get_chat", lambda user_id: SimpleNamespace(username=f"name_{user_id}"))
+    main.sent = sent
+    return main
+
+@pytest.fixture
+def user_id(db):
+    from src.database.services import register_user
+
+    user_id = f"test_{uuid.uuid4().hex[:12]}"
+    register_user(user_id)
+    return user_id
+
+def message(chat_id, text=None):
+    return SimpleNamespace(chat=SimpleNamespace(id=chat_id), text=text, message_id=1,
+                           from_user=SimpleNamespace(id=chat_id, username=None))
+
+def call(chat_id, data):
+    return SimpleNamespace(data=data, message=message(chat_id), from_user=SimpleNamespace(id=chat_id, username=None))
+
+def add_image(user_id, emotion="happy", vector=None):
+    from src.database.database import SessionLocal
+    from src.database.models import Image
+
+    with SessionLocal() as session:
+        session.add(Image(user_id=user_id, emotion=emotion, file_path=f"{user_id}.jpg",
+                          embedding=vector or [1.0] + [0.0] * 127, created_date=datetime.now()))
+        session.commit()
+
+def test_start(main, db):
+    chat_id = f"test_{uuid.uuid4().hex[:12]}"
+    with assert_max_queries(main.handle_start.max_queries):
+        main.handle_start(message(chat_id, "/start"))
+    assert main.sent[-1][0] == "send_message"
+
+@pytest.mark.parametrize("handler", ["handle_settings", "handle_calendar", "handle_similar"])
+def test_buttons_without_images(main, user_id, handler):
+    handler = getattr(main, handler)
+    with assert_max_queries(handler.max_queries):
+        handler(message(user_id))
+    assert main.sent
+
+@pytest.mark.parametrize("handler, data", [("toggle_ai", "toggle_ai"), ("toggle_search", "toggle_search"),
+                                           ("change_time", "change_time")])
+def test_settings_callbacks(main, user_id, handler, data):
+    handler = getattr(main, handler)
+    with assert_max_queries(handler.max_queries):
+        handler(call(user_id, data))
+    assert main.sent
+
+def test_time_input(main, user_id):
+    from src.database.settings_service import get_settings
+
+    with assert_max_queries(main.process_time_input.max_queries):
+        main.process_time_input(message(user_id, "21:30"), user_id)
+    assert get_settings(user_id).reminder_time.strftime("%H:%M") == "21:30"
+
+def test_wrong_emotion(main, user_id):
+    with assert_max_queries(main.save_emotion.max_queries):
+        main.save_emotion(message(user_id, "не эмоция"), "missing.jpg")
+    assert main.sent[-1][1][1] == "Неверная эмоция"
+
+def test_steps_without_text(main, user_id):
+    # Стикер или фото вместо текста: у сообщения нет text
+    main.save_emotion(message(user_id), "missing.jpg")
+    assert main.sent[-1][1][1] == "Неверная эмоция"
+
+    main.process_time_input(message(user_id), user_id)
+    assert main.sent[-1][1][1].startswith("❌")
+
+def test_similar_with_images(main, user_id, monkeypatch):
+    from src.database.services import register_user
+
+    other_id = f"test_{uuid.uuid4().hex[:12]}"
+    register_user(other_id)
+    add_image(other_id, vector=[0.9, 0.1] + [0.0] * 126)
+    add_image(user_id)
+    monkeypatch.setattr(main, "create_similar_image", lambda paths: b"png")
+
+    with assert_max_queries(main.handle_similar.max_queries):
+        main.handle_similar(message(user_id))
+    assert other_id in main.sent[-1][1][1]
+
+def test_confirm_pending_job(main, user_id):
+    from src.database.photo_jobs import enqueue_photo
+
+    job_id = enqueue_photo(user_id, "missing.jpg", "0" * 64)
+    with assert_max_queries(main.confirm_job.max_queries):
+        main.confirm_job(message(user_id, "✅ Подтвердить"), job_id)
+    assert main.conversation.has_step(user_id)
+    main.conversation.pop_step(user_id)
@@ -0,0 +1,33 @@
+from datetime import datetime
+
+from src.bot.reminders import MinuteCursor
+
+def minute(hour, minute):
+    return datetime(2026, 1, 1, hour, minute)
+
+def test_first_run_dispatches_current_minute():
+    cursor = MinuteCursor()
+    assert cursor.advance(datetime(2026, 1, 1, 12, 0, 5)) == [minute(12, 0)]
+
+def test_same_minute_is_not_dispatched_twice():
+    cursor = MinuteCursor()
+    cursor.advance(datetime(2026, 1, 1, 12, 0, 5))
+    assert cursor.advance(datetime(2026, 1, 1, 12, 0, 40)) == []
+
+def test_late_run_catches_up_skipped_minute():
+    cursor = MinuteCursor()
+    cursor.advance(datetime(2026, 1, 1, 12, 0, 1))
+    # Запуск за 12:01 опоздал до 12:02:20
+    assert cursor.advance(datetime(2026, 1, 1, 12, 2, 20)) == [minute(12, 1), minute(12, 2)]
+    # Запуск за 12:02 уже ничего не рассылает
+    assert cursor.advance(datetime(2026, 1, 1, 12, 2, 30)) == []
+
+def test_catch_up_is_limited():
+    cursor = MinuteCursor(catch_up=2)
+    cursor.advance(minute(12, 0))
+    assert cursor.advance(minute(13, 0)) == [minute(12, 58), minute(12, 59), minute(13, 0)]
+
+def test_clock_going_back_does_not_resend():
+    cursor = MinuteCursor()
+    cursor.advance(minute(12, 5))
+    assert cursor.advance(minute(12, 4)) == []
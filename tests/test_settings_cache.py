@@ -0,0 +1,56 @@
+from datetime import time
+
+import pytest
+
+from src.database import settings_service
+from src.database.settings_service import SettingsSnapshot, _remember, _written
+
+def snapshot(ai_enabled: bool) -> SettingsSnapshot:
+    return SettingsSnapshot("cache_user", ai_enabled, time(20, 0), True)
+
+@pytest.fixture(autouse=True)
+def clean_cache():
+    settings_service.invalidate("cache_user")
+    yield
+    settings_service.invalidate("cache_user")
+
+def cached():
+    cached = settings_service._cache.get("cache_user")
+    return cached[0] if cached is not None else None
+
+def test_read_fill_is_cached():
+    _remember(snapshot(True), _written())
+    assert cached() == snapshot(True)
+
+def test_slow_read_does_not_overwrite_newer_write():
+    seen_by_read = _written()  # чтение началось до записи
+    _remember(snapshot(False), _written(), write=True)
+    _remember(snapshot(True), seen_by_read)  # старая строка из медленного чтения
+    assert cached() is None  # следующий get_settings перечитает БД
+
+def test_concurrent_writes_drop_the_entry():
+    seen_a = _written()
+    seen_b = _written()
+    _remember(snapshot(True), seen_b, write=True)
+    _remember(snapshot(False), seen_a, write=True)
+    assert cached() is None
+
+def test_entry_expires_after_ttl(db, monkeypatch):
+    from sqlalchemy import text
+    from src.database.services import register_user
+
+    # Запись другого процесса видна после истечения TTL
+    user_id = "test_settings_ttl"
+    register_user(user_id)
+    now = [1000.0]
+    monkeypatch.setattr(settings_service, "SETTINGS_CACHE_TTL", 60)
+    monkeypatch.setattr(settings_service, "monotonic", lambda: now[0])
+    assert settings_service.get_settings(user_id).ai_enabled
+
+    with db.begin() as conn:
+        conn.execute(text("UPDATE settings SET ai_enabled = false WHERE user_id = :user_id"), {"user_id": user_id})
+    assert settings_service.get_settings(user_id).ai_enabled
+
+    now[0] += 61
+    assert not settings_service.get_settings(user_id).ai_enabled
+    settings_service.invalidate(user_id)
@@ -0,0 +1,55 @@
+import uuid
+from datetime import datetime
+
+import pytest
+
+from src.database import services
+
+@pytest.fixture
+def images(db):
+    from src.database.database import SessionLocal
+    from src.database.models import Image
+
+    users = [f"test_{uuid.uuid4().hex[:12]}" for _ in range(3)]
+    ids = []
+    with SessionLocal() as session:
+        for i, user_id in enumerate(users):
+            services.register_user(user_id)
+            image = Image(id=uuid.uuid4(), user_id=user_id, emotion="happy", file_path=f"{user_id}.jpg",
+                          embedding=[1.0, i / 10] + [0.0] * 126, created_date=datetime.now())
+            session.add(image)
+            ids.append(str(image.id))
+        session.commit()
+    return ids
+
+@pytest.fixture
+def searches(monkeypatch):
+    calls = []
+    search = services._search_postgres
+
+    def counted(*args):
+        calls.append(args[7])  # exact
+        return search(*args)
+
+    monkeypatch.setattr(services, "_search_postgres", counted)
+    monkeypatch.setattr(services, "VECTOR_INDEX", "hnsw")
+    return calls
+
+def test_few_matching_rows_do_not_trigger_exact_fallback(images, searches):
+    results = services.find_similar_images(images[0], find_n=5)
+    assert {result["id"] for result in results} == set(images[1:])
+    assert searches == [False]
+
+def test_short_approximate_result_falls_back_when_rows_exist(images, searches, monkeypatch):
+    search = services._search_postgres
+    # Индекс вернул меньше строк, чем есть на самом деле
+    monkeypatch.setattr(services, "_search_postgres",
+                        lambda *args: search(*args)[:1] if not args[7] else search(*args))
+
+    results = services.find_similar_images(images[0], find_n=5)
+    assert len(results) == 2
+    assert searches == [False, True]
+
+def test_explicit_options_never_fall_back(images, searches):
+    services.find_similar_images(images[0], find_n=5, ef_search=10)
+    assert searches == [False]
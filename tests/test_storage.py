@@ -0,0 +1,36 @@
+import os
+import time
+
+import pytest
+
+from src.database import storage
+
+@pytest.fixture(autouse=True)
+def images_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "IMAGES_DIR", tmp_path / "images")
+    monkeypatch.setattr(storage, "STAGING_DIR", tmp_path / "images" / "staging")
+
+def test_upload_is_staged_until_saved():
+    path = storage.stage_image(b"photo")
+    assert not storage.is_stored(path)
+    assert not storage.content_path(path.stem).exists()
+    assert storage.find_upload(path.stem) == path
+
+    stored = storage.store_file(path)
+    assert storage.is_stored(stored)
+    assert storage.find_upload(path.stem) == stored
+
+def test_sweep_removes_only_old_uploads():
+    old = storage.stage_image(b"old")
+    fresh = storage.stage_image(b"fresh")
+    os.utime(old, (time.time() - 3600, time.time() - 3600))
+
+    assert storage.sweep_staging(60) == 1
+    assert not old.exists() and fresh.exists()
+
+def test_reupload_keeps_staged_file_alive():
+    path = storage.stage_image(b"photo")
+    os.utime(path, (time.time() - 3600, time.time() - 3600))
+
+    assert storage.stage_image(b"photo") == path
+    assert storage.sweep_staging(60) == 0
@@ -0,0 +1,41 @@
+import sys
+import importlib
+
+import pytest
+
+from src.database import ann_index, settings_service
+from src.emote_processor import calendar_cache
+
+@pytest.fixture
+def load_webhook(monkeypatch):
+    # webhook.py меняет настройки кэшей процесса: monkeypatch вернет их после теста
+    monkeypatch.setattr(settings_service, "SETTINGS_CACHE_TTL", settings_service.SETTINGS_CACHE_TTL)
+    monkeypatch.setattr(calendar_cache, "CALENDAR_CACHE_TTL", calendar_cache.CALENDAR_CACHE_TTL)
+    monkeypatch.setattr(ann_index, "ANN_INDEX_PATH", ann_index.ANN_INDEX_PATH)
+    monkeypatch.setattr(ann_index, "_index", ann_index._index)
+    monkeypatch.setattr("src.bot.startup.PRELOAD_MODELS", False)
+    monkeypatch.delitem(sys.modules, "webhook", raising=False)
+    return lambda: importlib.import_module("webhook")
+
+def test_requires_secret(load_webhook, monkeypatch):
+    monkeypatch.delenv("WEBHOOK_SECRET", raising=False)
+    with pytest.raises(RuntimeError):
+        load_webhook()
+
+def test_rejects_wrong_secret(load_webhook, monkeypatch):
+    monkeypatch.setenv("WEBHOOK_SECRET", "secret")
+    webhook = load_webhook()
+    client = webhook.app.test_client()
+
+    assert client.post("/webhook", data="{}").status_code == 403
+    assert client.post("/webhook", data="{}", headers={"X-Telegram-Bot-Api-Secret-Token": "other"}).status_code == 403
+
+def test_workers_start_no_background_jobs(load_webhook, monkeypatch):
+    monkeypatch.setenv("WEBHOOK_SECRET", "secret")
+    load_webhook()
+    import main
+
+    assert not main.scheduler.running
+    assert main.reminders.thread is None
+    assert ann_index.get_index() is None
+    assert settings_service.SETTINGS_CACHE_TTL > 0
@@ -0,0 +1,84 @@
+"""Webhook-режим: любое число процессов бота за балансировщиком.
+
+    python webhook.py set          # зарегистрировать WEBHOOK_URL в Telegram
+    gunicorn -w 4 -b 0.0.0.0:8000 webhook:app
+    python webhook.py scheduler    # напоминания и фоновые задачи, ровно один процесс
+
+WEBHOOK_SECRET обязателен: без него любой, кто знает адрес, может слать боту
+поддельные обновления.
+
+Шаги диалога должны храниться вне процесса (CONVERSATION_BACKEND=sql или file),
+иначе ответ пользователя может попасть в процесс, который не видел его фото.
+
+Кэши, которые остаются у каждого процесса свои:
+    - настройки (settings_service): SETTINGS_CACHE_TTL, здесь по умолчанию 5 секунд
+    - календари (calendar_cache): CALENDAR_CACHE_TTL, здесь по умолчанию 60 секунд
+    - username (usernames): USERNAME_CACHE_TTL, устаревший ник некритичен
+    - счетчики дня (daily_stats): 5 секунд
+ANN индекс в этом режиме выключен и поиск похожих идет через Postgres:
+опт-аут и новые фото попадали бы только в индекс одного процесса.
+"""
+import time
+import argparse
+from flask import Flask, request, abort
+from telebot import types
+from dotenv import load_dotenv
+from os import environ
+
+from main import bot, schedule_jobs
+from src.bot.conversation import CONVERSATION_BACKEND
+from src.bot.startup import PRELOAD_MODELS, warmup_models
+from src.database import settings_service
+from src.database.ann_index import disable_index
+from src.emote_processor import calendar_cache
+
+load_dotenv()
+WEBHOOK_URL = environ.get("WEBHOOK_URL")  # https://example.com/webhook
+WEBHOOK_SECRET = environ.get("WEBHOOK_SECRET")
+
+# Кэши процесса не видят записи других процессов: короткие сроки жизни по умолчанию
+calendar_cache.CALENDAR_CACHE_TTL = float(environ.get("CALENDAR_CACHE_TTL", 60))
+settings_service.SETTINGS_CACHE_TTL = float(environ.get("SETTINGS_CACHE_TTL", 5))
+disable_index()
+
+if CONVERSATION_BACKEND == "memory":
+    print("Warning: CONVERSATION_BACKEND=memory, conversation steps are not shared between webhook processes")
+
+app = Flask(__name__)
+
+@app.post("/webhook")
+def handle_webhook():
+    if request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+        abort(403)
+
+    # Обработка идет в пуле потоков бота, Telegram получает ответ сразу
+    bot.process_new_updates([types.Update.de_json(request.get_data(as_text=True))])
+    return ""
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Webhook runtime helpers")
+    parser.add_argument("command", choices=["set", "delete", "scheduler"])
+    args = parser.parse_args()
+
+    if args.command == "set":
+        if not WEBHOOK_SECRET:
+            parser.error("WEBHOOK_SECRET is required to set a webhook")
+        bot.remove_webhook()
+        bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET)
+        print(f"Webhook set to {WEBHOOK_URL}")
+    elif args.command == "delete":
+        bot.remove_webhook()
+        print("Webhook removed")
+    else:
+        schedule_jobs()
+        print("Scheduler ready")
+        while True:
+            time.sleep(60)
+else:
+    # Процесс gunicorn: без секрета обновления не принимаются
+    if not WEBHOOK_SECRET:
+        raise RuntimeError("WEBHOOK_SECRET is required in webhook mode")
+
+    # Модели грузим только в процессах, которые обслуживают запросы
+    if PRELOAD_MODELS:
+        warmup_models()